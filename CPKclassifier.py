@@ -28,15 +28,11 @@ from argparse import ArgumentParser
 from CPKclassifierPack.utils.DataSet import DataSet, DataSetInvalidMetadataFields, DataSetNoDataPath, DataSetInvalidTarget, DataSetInvalidDataFileForMetadata
 from CPKclassifierPack.utils.DocReader import DocReaderMetadata, DocReaderInvalidMetadataFields, DocReaderNeedDataFile
 
-from CPKclassifierPack.CPKclassifierDataDump import CPKclassifierDataDumpInvalidFile, CPKclassifierDataDump
-
-from CPKclassifierPack.preprocessing.Preprocessing import Preprocessing, LemmatizerException, Lemmatizer
-from CPKclassifierPack.features.Features import Features, FeaturesNoData
-from CPKclassifierPack.classification.Classification import Classification
 from CPKclassifierPack.balancing.Balancing import Balancing
 from CPKclassifierPack.prediction.Prediction import Prediction
-from CPKclassifierPack.testing.SplitTestSet import SplitTestSet
-from CPKclassifierPack.testing.Testing import Testing
+
+#Moduly pro předzpracování (morphodita), extrakci příznaků, klasifikaci a testování (sklearn, scipy, gensim, pandas)
+#se načítají až v metodách, které je potřebují, aby jednotlivé nástroje načítaly pouze to, co používají.
 
 
     
@@ -160,6 +156,16 @@ class ArgumentsManager:
         
         parserPreprocessing.add_argument("--input", type=str,
                 help="Vstupní soubor s daty (povinné)", required=True)
+        parserPreprocessing.add_argument("--annotated", type=str,
+                help="Soubor s anotovaným vertikálem vstupu (tokeny, lemmata, slovní druhy). Pokud neexistuje, nebo neodpovídá vstupu či slovníku, je vytvořen. Předzpracování je z něj odvozeno bez morfologické analýzy.")
+        parserPreprocessing.add_argument("--shard", type=str,
+                help="Zpracuje pouze díl vstupního souboru ve tvaru i/N (i-tý z N dílů, číslováno od 1). Soubor je dělen podle offsetu v bajtech na hranicích řádků. Díly lze zpracovávat nezávisle (i na různých strojích) a jejich výstupy poté sloučit pomocí mergeShards.")
+        parserPreprocessing.add_argument("--output", type=str,
+                help="Výstupní soubor. Místo do stdout zapisuje výsledek do tohoto souboru a průběžně ukládá kontrolní body (OUTPUT.checkpoint). Přerušené předzpracování po opětovném spuštění se stejnými parametry pokračuje od posledního kontrolního bodu.")
+        parserPreprocessing.add_argument("--incremental", action='store_true',
+                help="Pokud byl vstupní soubor od předchozího běhu se stejným OUTPUT pouze rozšířen o další řádky, tak předzpracuje pouze připojené řádky a připojí je k výstupu. Jinak předzpracuje celý vstupní soubor. Vyžaduje parametr output.")
+        parserPreprocessing.add_argument("--mergeShards", nargs='+',
+                help="Neprovádí předzpracování, ale zřetězí výstupy všech dílů (uvedené v pořadí 1/N až N/N) vytvořené s parametrem shard do stdout. Ověřuje, že počty řádků odpovídají dílům vstupního souboru.")
         parserPreprocessing.add_argument("--config", type=str,
                 help="Tento konfigurační soubor přenastaví parametry z defaultního konfiguračního souboru. (Pouze uvedené)")
         parserPreprocessing.add_argument("--log", type=str,
@@ -176,6 +182,8 @@ class ArgumentsManager:
                 help="Cesta kam bude uložen výsledný datový soubor.")
         parserGetData.add_argument("--saveMetadataTo", type=str,
                 help="Cesta kam bude uložen výsledný metadatový soubor.")
+        parserGetData.add_argument("--ids", type=str,
+                help="Soubor s identifikátory dokumentů (jeden na řádek), které budou vybrány. Identifikátor je hodnota pole ID_FIELD ze sekce GET_DATA.")
         parserGetData.add_argument("--config", type=str,
                 help="Tento konfigurační soubor přenastaví parametry z defaultního konfiguračního souboru. (Pouze uvedené)")
         parserGetData.add_argument("--log", type=str,
@@ -225,6 +233,8 @@ class ArgumentsManager:
                 help="Vstupní metadatový soubor.",)
         parserPredict.add_argument("--classifiers", type=str,
                 help="Cesta k souboru s uloženými klasifikátory/klasifikátorem.", required=True)
+        parserPredict.add_argument("--ids", type=str,
+                help="Soubor s identifikátory dokumentů (jeden na řádek), pro které bude provedena predikce. Identifikátor je hodnota pole ID_FIELD ze sekce GET_DATA.")
         parserPredict.add_argument("--config", type=str,
                 help="Tento konfigurační soubor přenastaví parametry z defaultního konfiguračního souboru. (Pouze uvedené)")
         parserPredict.add_argument("--log", type=str,
@@ -324,9 +334,26 @@ class ArgumentsManager:
                 raise ArgumentParserError("Musíte uvést parametr features nebo metadata.")
             
         if 'preprocessing'==sys.argv[1]:
+            from CPKclassifierPack.preprocessing.Preprocessing import Preprocessing
+            
             if hasattr(parsed, 'pos') and parsed.pos and any([ x not in Preprocessing.posSigns for x in parsed.pos]):
                 raise ArgumentParserError("Neznámý výběr slovního druhu.")
             
+            if hasattr(parsed, 'shard') and parsed.shard is not None:
+                match=re.fullmatch(r"([0-9]+)/([0-9]+)", parsed.shard)
+                if match is None or not 1<=int(match.group(1))<=int(match.group(2)):
+                    raise ArgumentParserError("Parametr shard musí být ve tvaru i/N, kde 1 <= i <= N.")
+                parsed.shard=(int(match.group(1)), int(match.group(2)))
+                
+                if parsed.annotated or parsed.mergeShards or parsed.incremental:
+                    raise ArgumentParserError("Parametr shard nelze kombinovat s annotated, mergeShards a incremental.")
+                
+            if hasattr(parsed, 'incremental') and parsed.incremental and not parsed.output:
+                raise ArgumentParserError("Při použití parametru incremental je nutné uvést i parametr output.")
+            
+            if hasattr(parsed, 'output') and parsed.output and (parsed.annotated or parsed.mergeShards):
+                raise ArgumentParserError("Parametr output nelze kombinovat s annotated a mergeShards.")
+            
         if "testing"==sys.argv[1]:
             if hasattr(parsed, 'sepResults') and parsed.sepResults is not False and (not hasattr(parsed, 'writeResults') or  parsed.writeResults is None):
                 raise ArgumentParserError("Při použití parametru sepResults je nutné uvést i parametr writeResults.")
@@ -363,11 +390,14 @@ class ConfigManager(object):
         self.configParser = configparser.ConfigParser()
     
         
-    def read(self, filesPaths):
+    def read(self, filesPaths, classificationSections=True):
         """
         Přečte hodnoty z konfiguračních souborů. Také je validuje a převede do jejich datových typů.
         
         :param filesPaths: list s cestami ke konfiguračním souborům.
+        :param classificationSections: False => sekce FEATURES, CLASSIFICATION a TESTING nejsou převedeny ani validovány.
+            Jejich validace vyžaduje načtení modulů pro extrakci příznaků, klasifikaci a testování, které nástroje
+            pro předzpracování, výběr dat a statistiky nepotřebují.
         :returns: Konfigurace.
         """
         try:
@@ -379,13 +409,14 @@ class ConfigManager(object):
             raise ExceptionMessageCode("Nevalidní konfigurační soubor.",
                                        ErrorMessenger.CODE_INVALID_CONFIG)
         
-        return self.__transformVals()
+        return self.__transformVals(classificationSections)
         
         
-    def __transformVals(self):
+    def __transformVals(self, classificationSections=True):
         """
         Převede hodnoty a validuje je.
         
+        :param classificationSections: False => sekce FEATURES, CLASSIFICATION a TESTING nejsou převedeny.
         :returns: dict -- ve formátu jméno sekce jako klíč a k němu dict s hodnotami.
         """
         result={}
@@ -393,12 +424,15 @@ class ConfigManager(object):
         result[self.sectionDefault]=self.__transformDefaultVals()
         result[self.sectionPreprocessing]=self.__transformPreprocessingVals();
         result[self.sectionGetData]=self.__transformGetDataVals()
-        result[self.sectionFeatures]=self.__transformFeaturesVals(result[self.sectionGetData])
+        if classificationSections:
+            result[self.sectionFeatures]=self.__transformFeaturesVals(result[self.sectionGetData])
         result[self.sectionDOC2VEC]=self.__transformDOC2VECVals()
         result[self.sectionHashingVectorizer]=self.__transformHashingVectorizerVals()
-        result[self.sectionClassification]=self.__transformClassificationVals(result[self.sectionGetData])
+        if classificationSections:
+            result[self.sectionClassification]=self.__transformClassificationVals(result[self.sectionGetData])
         result[self.sectionPredict]=self.__transformPredictVals()
-        result[self.sectionTesting]=self.__transformTestingVals()
+        if classificationSections:
+            result[self.sectionTesting]=self.__transformTestingVals()
         result[self.sectionKNeighborsClassifier]=self.__transformKNeighborsClassifierVals()
         result[self.sectionSGDClassifier]=self.__transformSGDClassifierVals()
         
@@ -432,7 +466,9 @@ class ConfigManager(object):
             "DICT":None,
             "WORKERS": 1,
             "STOP_WORDS":None,
-            "MAX_NUMBER_OF_WORDS_PER_LINE_PART":100000
+            "MAX_NUMBER_OF_WORDS_PER_LINE_PART":100000,
+            "LEMMATIZER_CACHE_SIZE":100000,
+            "LEMMATIZER_CACHE_FILE":None
             }
         
         if preprocessing["DICT"]: 
@@ -475,6 +511,29 @@ class ConfigManager(object):
                 raise ExceptionMessageCode("Nevalidní hodnota v konfiguračním souboru v sekci "+self.sectionPreprocessing+" u parametru: MAX_NUMBER_OF_WORDS_PER_LINE_PART",
                                            ErrorMessenger.CODE_INVALID_CONFIG)
             
+        if preprocessing["LEMMATIZER_CACHE_SIZE"]:
+            
+            try:
+                result["LEMMATIZER_CACHE_SIZE"]=int(preprocessing["LEMMATIZER_CACHE_SIZE"])
+                if result["LEMMATIZER_CACHE_SIZE"]<0:
+                    raise ValueError()
+            
+            except ValueError:
+                raise ExceptionMessageCode("Nevalidní hodnota v konfiguračním souboru v sekci "+self.sectionPreprocessing+" u parametru: LEMMATIZER_CACHE_SIZE",
+                                           ErrorMessenger.CODE_INVALID_CONFIG)
+                
+        if preprocessing["LEMMATIZER_CACHE_FILE"]:
+            
+            if preprocessing["LEMMATIZER_CACHE_FILE"][0]!="/":
+                result["LEMMATIZER_CACHE_FILE"]=os.path.dirname(os.path.realpath(__file__))+"/"+preprocessing["LEMMATIZER_CACHE_FILE"]
+            else:
+                result["LEMMATIZER_CACHE_FILE"]=preprocessing["LEMMATIZER_CACHE_FILE"]
+                
+            if not os.path.isdir(os.path.dirname(result["LEMMATIZER_CACHE_FILE"])):
+                raise ExceptionMessageCode("Nevalidní hodnota v konfiguračním souboru. V sekci "+self.sectionPreprocessing+\
+                                           " v parametru LEMMATIZER_CACHE_FILE není cesta do existujícího adresáře.",
+                                               ErrorMessenger.CODE_INVALID_CONFIG)
+            
         return result
     
     def __transformGetDataVals(self):
@@ -486,11 +545,20 @@ class ConfigManager(object):
         result={
             "TARGET_FIELD":"TARGET",
             "ITEM_DELIMITER": None,
-            "COPY":{}
+            "COPY":{},
+            "WORKERS":1,
+            "CACHE_DIR":None,
+            "READAHEAD":None,
+            "ID_FIELD":None,
+            "TOKEN_IDS":False
             }
         getData=self.configParser[self.sectionGetData]
         
         result["LAZY_EVAL_DATA"]=getData["LAZY_EVAL_DATA"].lower()=="true"
+        
+        if getData["TOKEN_IDS"]:
+            result["TOKEN_IDS"]=getData["TOKEN_IDS"].lower()=="true"
+            
         result["NON_EMPTY"]=shlex.split(getData["NON_EMPTY"])
         result["EMPTY"]=shlex.split(getData["EMPTY"])
         
@@ -528,6 +596,36 @@ class ConfigManager(object):
         
         result["GET_FULLTEXT"]=getData["GET_FULLTEXT"].lower()=="true"
         
+        if getData["WORKERS"]:
+            try:
+                result["WORKERS"]=int(getData["WORKERS"])
+        
+                if result["WORKERS"]<1 and result["WORKERS"]!=-1:
+                    raise ValueError()
+                
+            except ValueError:
+                raise ExceptionMessageCode("Nevalidní hodnota v konfiguračním souboru v sekci "+self.sectionGetData+" u parametru: WORKERS",
+                                       ErrorMessenger.CODE_INVALID_CONFIG)
+        
+        if getData["CACHE_DIR"]:
+            result["CACHE_DIR"]=shlex.split(getData["CACHE_DIR"])[0]
+            if result["CACHE_DIR"][0]!="/":
+                result["CACHE_DIR"]=os.path.dirname(os.path.realpath(__file__))+"/"+result["CACHE_DIR"]
+        
+        if getData["ID_FIELD"]:
+            result["ID_FIELD"]=shlex.split(getData["ID_FIELD"])[0]
+        
+        if getData["READAHEAD"]:
+            try:
+                result["READAHEAD"]=int(getData["READAHEAD"])
+        
+                if result["READAHEAD"]<1:
+                    raise ValueError()
+                
+            except ValueError:
+                raise ExceptionMessageCode("Nevalidní hodnota v konfiguračním souboru v sekci "+self.sectionGetData+" u parametru: READAHEAD",
+                                       ErrorMessenger.CODE_INVALID_CONFIG)
+        
         result["GET_META_FIELDS"]=shlex.split(getData["GET_META_FIELDS"])
 
         if result["GET_META_FIELDS"]:
@@ -569,6 +667,7 @@ class ConfigManager(object):
         :param transformedGetData: Pro validaci je nutné, poskytnout převedenou sekci get data.
         :returns: dict -- ve formátu jméno prametru jako klíč a k němu hodnota parametru
         """
+        from CPKclassifierPack.features.Features import Features
         
         result={
             "FULL_TEXT_VECTORIZER_BUILD_VOCABULARY_ON": None,
@@ -864,6 +963,7 @@ class ConfigManager(object):
         :param transformedGetData: Pro validaci je nutné, poskytnout převedenou sekci get data.
         :returns: dict -- ve formátu jméno prametru jako klíč a k němu hodnota parametru
         """
+        from CPKclassifierPack.classification.Classification import Classification
         
         #defaultní hodnoty
         result={
@@ -990,7 +1090,8 @@ class ConfigManager(object):
             "CONF_POSTFIX": None,
             "USE_PROB":True,
             "THRESHOLD":0.0,
-            "WORKERS":1
+            "WORKERS":1,
+            "BATCH_SIZE":100000
             }
         
         
@@ -1009,6 +1110,15 @@ class ConfigManager(object):
                 raise ExceptionMessageCode("Nevalidní hodnota v konfiguračním souboru v sekci "+self.sectionPredict+" u parametru: WORKERS",
                                        ErrorMessenger.CODE_INVALID_CONFIG)
                 
+        if predict["BATCH_SIZE"]:
+            try:
+                result["BATCH_SIZE"]=int(predict["BATCH_SIZE"])
+                if result["BATCH_SIZE"]<1:
+                    raise ValueError()
+            except ValueError:
+                raise ExceptionMessageCode("Nevalidní hodnota v konfiguračním souboru v sekci "+self.sectionPredict+" u parametru: BATCH_SIZE (pouze kladné celé číslo)",
+                                           ErrorMessenger.CODE_INVALID_CONFIG)
+                
         if predict["THRESHOLD"]:
             try:
                 threshold = float(predict["THRESHOLD"])
@@ -1049,6 +1159,7 @@ class ConfigManager(object):
         
         :returns: dict -- ve formátu jméno prametru jako klíč a k němu hodnota parametru
         """
+        from CPKclassifierPack.testing.SplitTestSet import SplitTestSet
         
         result={
             "SPLIT_METHOD":SplitTestSet.stratifiedKFoldName,
@@ -1351,11 +1462,12 @@ class CPKclassifier(object):
         
         self.partSize=1000    #používá se u predikace a extrakce příznaků
     
-    def __initCheck(self, args):
+    def __initCheck(self, args, classificationSections=True):
         """
         Počáteční kontrola.
         
         :param args: Argumenty z argument manažéru.
+        :param classificationSections: False => nenačítá sekce konfigurace pro extrakci příznaků, klasifikaci a testování.
         :raises ExceptionMessageCode: Pokud neexistuje konfigurační soubor.
         """
         self.config=ConfigManager()
@@ -1371,7 +1483,7 @@ class CPKclassifier(object):
                         ErrorMessenger.CODE_INVALID_ARGUMENTS)
 
         
-        self.configAll=self.config.read(configFiles)
+        self.configAll=self.config.read(configFiles, classificationSections)
     
     def preprocessing(self,args):
         """
@@ -1379,25 +1491,38 @@ class CPKclassifier(object):
         
         :param args: Argumenty z argument manažéru.
         """
-        self.__initCheck(args)
+        from CPKclassifierPack.preprocessing.Preprocessing import Preprocessing, LemmatizerException, PreprocessingShardsException
+
+        self.__initCheck(args, False)
         
         if self.configAll[ConfigManager.sectionPreprocessing]["STOP_WORDS"] is None:
             raise ExceptionMessageCode(ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_CONFIG)+" Chybí STOP_WORDS.",
                                            ErrorMessenger.CODE_INVALID_CONFIG)
          
-        if self.configAll[ConfigManager.sectionPreprocessing]["DICT"] is None:
+        if (args.lemmatize or args.pos or args.annotated) and self.configAll[ConfigManager.sectionPreprocessing]["DICT"] is None:
+            #pro samotné oddělení znaků (sepSigns) není slovník potřeba, bez něj je použit český tokenizátor
             raise ExceptionMessageCode(ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_CONFIG)+" Chybí DICT.",
                                            ErrorMessenger.CODE_INVALID_CONFIG)
             
         
         try:
-            Preprocessing(args, self.configAll[ConfigManager.sectionPreprocessing]["STOP_WORDS"], 
+            preprocessing=Preprocessing(args, self.configAll[ConfigManager.sectionPreprocessing]["STOP_WORDS"], 
                       self.configAll[ConfigManager.sectionPreprocessing]["DICT"], 
                       self.configAll[ConfigManager.sectionPreprocessing]["WORKERS"], self.logAfterSec,
-                      self.configAll[ConfigManager.sectionPreprocessing]["MAX_NUMBER_OF_WORDS_PER_LINE_PART"]).start()
+                      self.configAll[ConfigManager.sectionPreprocessing]["MAX_NUMBER_OF_WORDS_PER_LINE_PART"],
+                      self.configAll[ConfigManager.sectionPreprocessing]["LEMMATIZER_CACHE_SIZE"],
+                      self.configAll[ConfigManager.sectionPreprocessing]["LEMMATIZER_CACHE_FILE"])
+            
+            if args.mergeShards:
+                preprocessing.mergeShards(args.mergeShards)
+            else:
+                preprocessing.start()
         except LemmatizerException:
             raise ExceptionMessageCode(ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_CONFIG)+" Problém s dict.",
                                            ErrorMessenger.CODE_INVALID_CONFIG)   
+        except PreprocessingShardsException as e:
+            raise ExceptionMessageCode(ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_INPUT_FILE)+" "+str(e),
+                                           ErrorMessenger.CODE_INVALID_INPUT_FILE)
         
 
     def getDataArgs(self, args):
@@ -1406,7 +1531,7 @@ class CPKclassifier(object):
         
         :param args: Argumenty z argument manažéru.
         """
-        self.__initCheck(args)
+        self.__initCheck(args, False)
 
         dataSet=self.__getDataSet(args)
 
@@ -1435,6 +1560,7 @@ class CPKclassifier(object):
         
         :param args: Argumenty z argument manažéru.
         """
+        from CPKclassifierPack.CPKclassifierDataDump import CPKclassifierDataDump
   
         self.__initCheck(args)
         
@@ -1464,6 +1590,20 @@ class CPKclassifier(object):
         if not useConfig:
             useConfig=self.configAll
         
+        ids=None
+        if getattr(args, "ids", None):
+            if not useConfig[ConfigManager.sectionGetData]["ID_FIELD"]:
+                raise ExceptionMessageCode(
+                    ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_CONFIG)+" Pro výběr dokumentů podle identifikátorů je nutné vyplnit ID_FIELD.",
+                    ErrorMessenger.CODE_INVALID_CONFIG)
+            
+            try:
+                with open(args.ids, "r") as fIds:
+                    ids=[line.strip() for line in fIds if line.strip()]
+            except IOError:
+                raise ExceptionMessageCode(ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_INPUT_FILE)+" "+args.ids,
+                    ErrorMessenger.CODE_INVALID_INPUT_FILE)
+        
         try:        
             
             dataSet=DataSet(metadata=args.metadata, 
@@ -1481,7 +1621,14 @@ class CPKclassifier(object):
                             selectWords=useConfig[ConfigManager.sectionGetData]["SELECT_WORDS"], 
                             selectItems=useConfig[ConfigManager.sectionGetData]["SELECT_ITEMS"], 
                             copyAndRen=useConfig[ConfigManager.sectionGetData]["COPY"],
-                            fulltextName=ConfigManager.fulltextName)
+                            fulltextName=ConfigManager.fulltextName,
+                            workers=useConfig[ConfigManager.sectionGetData]["WORKERS"],
+                            additionalMetaFields=self.configAll[ConfigManager.sectionPredict]["WRITE_META_FIELDS"],
+                            cacheDir=useConfig[ConfigManager.sectionGetData]["CACHE_DIR"],
+                            readahead=useConfig[ConfigManager.sectionGetData]["READAHEAD"],
+                            ids=ids,
+                            idField=useConfig[ConfigManager.sectionGetData]["ID_FIELD"],
+                            tokenIds=useConfig[ConfigManager.sectionGetData]["TOKEN_IDS"])
             
         except DataSetInvalidMetadataFields:
             raise ExceptionMessageCode(
@@ -1554,6 +1701,9 @@ class CPKclassifier(object):
         :param retFeatTool: True
         :returns: Dvojici (extrahované příznaky, Features). Pokud retFeatTool false => extrahované příznaky.
         """
+        from CPKclassifierPack.preprocessing.Preprocessing import LemmatizerException, Lemmatizer
+        from CPKclassifierPack.features.Features import Features, FeaturesNoData
+
         lemmatizer=None
         try:
             allVecNames=[]
@@ -1565,7 +1715,8 @@ class CPKclassifier(object):
                 
                 
             if Features.matchTargetVectorizer in allVecNames:
-                lemmatizer=Lemmatizer(self.configAll[ConfigManager.sectionPreprocessing]["DICT"])
+                lemmatizer=Lemmatizer(self.configAll[ConfigManager.sectionPreprocessing]["DICT"],
+                                      self.configAll[ConfigManager.sectionPreprocessing]["LEMMATIZER_CACHE_SIZE"])
                 
         except LemmatizerException:
             raise ExceptionMessageCode(ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_CONFIG)+" Problém s dict.",
@@ -1647,6 +1798,8 @@ class CPKclassifier(object):
         
         :param args: Argumenty z argument manažéru.
         """    
+        from CPKclassifierPack.CPKclassifierDataDump import CPKclassifierDataDumpInvalidFile, CPKclassifierDataDump
+        from CPKclassifierPack.classification.Classification import Classification
         
         self.__initCheck(args)
         
@@ -1743,6 +1896,8 @@ class CPKclassifier(object):
         
         :param args: Argumenty z argument manažéru.
         """
+        from CPKclassifierPack.CPKclassifierDataDump import CPKclassifierDataDumpInvalidFile, CPKclassifierDataDump
+
         self.__initCheck(args)
         
         loadData=CPKclassifierDataDump()
@@ -1777,10 +1932,12 @@ class CPKclassifier(object):
         if loadData.configFea[ConfigManager.sectionGetData]["GET_FULLTEXT"]:
             allKinds.add(ConfigManager.fulltextName)
             
-        testData=self.__getData(args, False, useDataset=dSet)
+        testKinds=set(dSet.metaFields)
+        if self.configAll[ConfigManager.sectionGetData]["GET_FULLTEXT"]:
+            testKinds.add(ConfigManager.fulltextName)
 
         
-        if set(testData.keys())!=allKinds:
+        if testKinds!=allKinds:
             raise ExceptionMessageCode(ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_CONFIG)+" Pro predikci musí být pouze tato data: "+", ".join(allKinds),
                                            ErrorMessenger.CODE_INVALID_CONFIG)
 
@@ -1793,43 +1950,50 @@ class CPKclassifier(object):
                                  self.configAll[ConfigManager.sectionPredict]["CONF_POSTFIX"])
         
         
-        metaForWrite={}
-        if self.configAll[ConfigManager.sectionPredict]["WRITE_META_FIELDS"]:
+        writeMetaFields=self.configAll[ConfigManager.sectionPredict]["WRITE_META_FIELDS"]
+        if writeMetaFields:
 
             try:
-                #upravíme původní dataset, tak abychom mohli získat dodatečná metadata a nemuseli vytvářet nový dSet.
-                dSet.metaFields=self.configAll[ConfigManager.sectionPredict]["WRITE_META_FIELDS"]
-                #chceme jen metadata a nepotřebujeme plný text
-                dSet.disableFulltext()
+                #upravíme původní dataset, tak abychom dodatečná metadata získali ve stejném průchodu daty.
+                dSet.metaFields=dSet.metaFields+[f for f in writeMetaFields if f not in dSet.metaFields]
             except DataSetInvalidMetadataFields:
                 raise ExceptionMessageCode(
                 ErrorMessenger.getMessage(ErrorMessenger.CODE_INVALID_CONFIG)+" V konfiguračním souboru u pole WRITE_META_FIELDS v sekci "+ConfigManager.sectionPredict+" je název pole metadat, který není ve vstupní souboru s metadaty.",
                     ErrorMessenger.CODE_INVALID_CONFIG)
-                
-                            
-            metaForWrite=self.__getData(args, targets=False, useDataset=dSet)
-        
         
-        if self.configAll[ConfigManager.sectionPredict]["USE_PROB"]:
-            predicted=loadData.classificator.predictAuto(loadData.featuresTool.extract(testData, self.partSize, 
-                                           workers=self.configAll[ConfigManager.sectionFeatures]["WORKERS"]), self.partSize, 
-                                                         self.configAll[ConfigManager.sectionPredict]["THRESHOLD"],
-                                                         self.configAll[ConfigManager.sectionPredict]["WORKERS"])
-        else:
-            predicted=loadData.classificator.predict(loadData.featuresTool.extract(testData, self.partSize, 
-                                           workers=self.configAll[ConfigManager.sectionFeatures]["WORKERS"]), self.partSize, 
-                                                         self.configAll[ConfigManager.sectionPredict]["WORKERS"])
-            
         targetsNames=[]
         
         if self.configAll[ConfigManager.sectionPredict]["USE_PROB"] and loadData.classificator.couldGetNBest():
             targetsNames=loadData.classificator.targets
+        
+        #data zpracováváme po částech, aby paměťová náročnost nezávisela na velikosti vstupu
+        docCnt=0
+        for batch in dSet.iterBatches(self.configAll[ConfigManager.sectionPredict]["BATCH_SIZE"]):
+            testData={kind: batch[kind] for kind in allKinds}
+            metaForWrite={f: batch[f] for f in writeMetaFields}
+            
+            if self.configAll[ConfigManager.sectionPredict]["USE_PROB"]:
+                predicted=loadData.classificator.predictAuto(loadData.featuresTool.extract(testData, self.partSize, 
+                                               workers=self.configAll[ConfigManager.sectionFeatures]["WORKERS"]), self.partSize, 
+                                                             self.configAll[ConfigManager.sectionPredict]["THRESHOLD"],
+                                                             self.configAll[ConfigManager.sectionPredict]["WORKERS"])
+            else:
+                predicted=loadData.classificator.predict(loadData.featuresTool.extract(testData, self.partSize, 
+                                               workers=self.configAll[ConfigManager.sectionFeatures]["WORKERS"]), self.partSize, 
+                                                             self.configAll[ConfigManager.sectionPredict]["WORKERS"])
+                
+            predictResult.write(predicted, 
+                                metaForWrite,
+                                targetsNames, docCnt==0)
             
-        predictResult.write(predicted, 
-                            metaForWrite,
-                            targetsNames, True)
+            docCnt+=len(predicted)
+            
+        if docCnt==0:
+            raise ExceptionMessageCode(
+                    ErrorMessenger.getMessage(ErrorMessenger.CODE_NO_INPUT_DATA), 
+                        ErrorMessenger.CODE_NO_INPUT_DATA)
         
-        logging.info("Počet zpracovaných dokumentů: "+str(len(predicted)))
+        logging.info("Počet zpracovaných dokumentů: "+str(docCnt))
     
         
         
@@ -1839,6 +2003,9 @@ class CPKclassifier(object):
         
         :param args: Argumenty z argument manažéru.
         """
+        from CPKclassifierPack.classification.Classification import Classification
+        from CPKclassifierPack.testing.SplitTestSet import SplitTestSet
+        from CPKclassifierPack.testing.Testing import Testing
         
         
         self.__initCheck(args)
@@ -2027,7 +2194,7 @@ class CPKclassifier(object):
             writeConfMat.close()
             
     def stats(self, args): 
-        self.__initCheck(args)       
+        self.__initCheck(args, False)       
         
         try:
             docReader=DocReaderMetadata(metadataFile=args.input, 
@@ -2037,7 +2204,10 @@ class CPKclassifier(object):
                 minPerField=self.configAll[ConfigManager.sectionGetData]["MIN_PER_FIELD"], 
                 maxPerField=self.configAll[ConfigManager.sectionGetData]["MAX_PER_FIELD"],
                 itemDelimiter=self.configAll[ConfigManager.sectionGetData]["ITEM_DELIMITER"], 
-                selectItems=self.configAll[ConfigManager.sectionGetData]["SELECT_ITEMS"])
+                selectItems=self.configAll[ConfigManager.sectionGetData]["SELECT_ITEMS"],
+                workers=self.configAll[ConfigManager.sectionGetData]["WORKERS"],
+                fields=[self.configAll[ConfigManager.sectionGetData]["TARGET_FIELD"], self.configAll[ConfigManager.sectionPredict]["PREDICTED_FIELD_NAME"]],
+                cacheDir=self.configAll[ConfigManager.sectionGetData]["CACHE_DIR"])
             
         except DocReaderNeedDataFile:
             raise ExceptionMessageCode(
@@ -2098,6 +2268,8 @@ class CPKclassifier(object):
             
         if tarFieldName in docReader.fieldNames and preFieldName in docReader.fieldNames:
             logging.info("začátek vyhodnocování úspěšnosti")
+            from CPKclassifierPack.testing.Testing import Testing
+            
             test=Testing(self.configAll[ConfigManager.sectionDefault]["HIER_DELIMITER"])
             test.processResults(predicted, predicted, targets, [], targets)
             
@@ -2158,6 +2330,8 @@ class CPKclassifier(object):
         :param classifiers: Struktura obsahující trojice (název dat, název klasifikátoru, váha)
         :returns: True -> nevalidní. False ->  validní
         """
+        from CPKclassifierPack.features.Features import Features
+        from CPKclassifierPack.classification.Classification import Classification
         
         allClsNames=set([ x[1] for x in classifiers])
         
@@ -2193,6 +2367,8 @@ class CPKclassifier(object):
         Na základě konfigurace, vytvoří parametry klasifikátorů.
         :returns: Parametry pro klasifikátory. Pro parametr classifierParams konstruktoru Classification.
         """
+        from CPKclassifierPack.preprocessing.Preprocessing import LemmatizerException, Lemmatizer
+        from CPKclassifierPack.classification.Classification import Classification
         
         clsPar={}
             
@@ -2214,7 +2390,8 @@ class CPKclassifier(object):
 
             try:
 
-                lemmatizer=Lemmatizer(self.configAll[ConfigManager.sectionPreprocessing]["DICT"])
+                lemmatizer=Lemmatizer(self.configAll[ConfigManager.sectionPreprocessing]["DICT"],
+                                      self.configAll[ConfigManager.sectionPreprocessing]["LEMMATIZER_CACHE_SIZE"])
 
 
                 clsPar[Classification.matchTargetClassifierName]={
@@ -12,6 +12,7 @@ from sklearn.feature_extraction.text import HashingVectorizer, CountVectorizer,
 
 from .Vectorizers import D2VVectorizer, MatchTargetVectorizer
 from CPKclassifierPack.utils.DocReader import DocReaderDataString
+from CPKclassifierPack.utils.TokensArray import TokensDocument
 from CPKclassifierPack.utils.DataSet import DataTypeSelector
 
 import functools
@@ -862,17 +863,21 @@ def analyzerFulltextNgrams(n, x):
     Analyzátor tvořící ngramy pro plný text.
     
     :param n: velikost (například 2 vytvoří bigramy)
-    :param x: list -- se slovy plného textu
+    :param x: list|TokensDocument -- se slovy plného textu
     :returns: Ngramy.
     """
+    if isinstance(x, TokensDocument):
+        #ngramy tvoříme nad identifikátory slov
+        return x.ngrams(n)
+    
     allI=[]
-    if len(x)<n:
-        allI.append("_".join(x))
-        
     words=x
     if isinstance(x, DocReaderDataString):
         #z důvodů výkonu načteme dokument do paměti
         words=[w for w in x]
+        
+    if len(words)<n:
+        allI.append("_".join(words))
       
     for i in range(len(words)-n+1):
         allI.append("_".join(words[i:i+n]))
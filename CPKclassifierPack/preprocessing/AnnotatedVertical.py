@@ -0,0 +1,234 @@
+# -*- coding: UTF-8 -*-
+"""
+Obsahuje třídy pro anotovaný vertikál. Ten uchovává výsledek tokenizace a morfologické analýzy vstupního souboru,
+aby bylo možné z něj odvodit různé varianty předzpracování bez opakované analýzy.
+
+:author:     Martin Dočekal
+:contact:    xdocek09@stud.fit.vubtr.cz
+
+"""
+
+import logging
+import os
+import struct
+from array import array
+
+import numpy as np
+
+class AnnotatedVerticalInvalidFile(Exception):
+    """
+    Soubor s anotovaným vertikálem je poškozený nebo nepatří k danému vstupnímu souboru či slovníku.
+    """
+    pass
+
+class AnnotatedVertical(object):
+    """
+    Anotovaný vertikál vstupního souboru. Pro každý řádek vstupního souboru (stejně jako je dělí
+    Preprocessing.readLineParts) obsahuje tokeny se slovním tvarem, lemmatem a slovním druhem.
+
+    Formát souboru:
+        hlavička (HEADER)
+        pole uint32 tokenů: (identifikátor tvaru << 1) | 1 pokud token předchází bílý znak
+        pole uint64 konců řádků (index tokenu za posledním tokenem řádku)
+        tabulka tvarů v utf-8: pro každý identifikátor tvaru jeden řádek "tvar\\tlemma\\tslovní druh"
+
+    Hlavička obsahuje velikost a čas poslední modifikace vstupního souboru a slovníku morphodity. Pokud neodpovídají,
+    je vertikál považován za neplatný.
+
+    Textová podoba anotovaného textu (viz Lemmatizer.annotate a AnnotatedVerticalWriter.write) je pro každý token
+    [mezera]tvar\\tlemma\\tslovní druh\\t, kde mezera před tvarem značí bílý znak před tokenem.
+    Tvar ani lemma neobsahují bílé znaky.
+    """
+
+    MAGIC=b"CPKAVRT\x00"
+    VERSION=1
+
+    #magic, verze, velikost a čas modifikace (ns) vstupu, velikost a čas modifikace (ns) slovníku,
+    #počet řádků, počet tokenů, počet tvarů, offset tabulky tvarů
+    HEADER=struct.Struct("<8sI4xQQQQQQQQ")
+
+    LINES_AT_ONCE=4096   #po kolika řádcích jsou tokeny převáděny z pole při iteraci
+
+    def __init__(self, vertical, inputFile, dictMorpho):
+        """
+        Otevře anotovaný vertikál.
+
+        :param vertical: Cesta k souboru s anotovaným vertikálem.
+        :param inputFile: Cesta ke vstupnímu souboru, ze kterého byl vertikál vytvořen.
+        :param dictMorpho: Cesta ke slovníku morphodity, se kterým byl vertikál vytvořen.
+        :raises AnnotatedVerticalInvalidFile: Neplatný vertikál.
+        """
+        self.vertical=vertical
+
+        try:
+            with open(vertical, "rb") as f:
+                header=f.read(self.HEADER.size)
+                if len(header)!=self.HEADER.size:
+                    raise AnnotatedVerticalInvalidFile()
+
+                magic, version, inputSize, inputMtime, dictSize, dictMtime, lines, tokens, forms, formsOffset=\
+                    self.HEADER.unpack(header)
+
+                if magic!=self.MAGIC or version!=self.VERSION:
+                    raise AnnotatedVerticalInvalidFile()
+
+                if [inputSize, inputMtime]!=self.fileIdentity(inputFile) or [dictSize, dictMtime]!=self.fileIdentity(dictMorpho):
+                    logging.info("anotovaný vertikál neodpovídá vstupnímu souboru nebo slovníku: "+vertical)
+                    raise AnnotatedVerticalInvalidFile()
+
+                f.seek(formsOffset)
+                table=f.read().decode("utf-8").split("\n")
+        except (IOError, OSError, ValueError, struct.error):
+            raise AnnotatedVerticalInvalidFile()
+
+        table.pop()
+        if len(table)!=forms:
+            raise AnnotatedVerticalInvalidFile()
+
+        self.forms=[]
+        self.lemmas=[]
+        self.POS=[]
+        for x in table:
+            form, lemma, pos=x.split("\t")
+            self.forms.append(form)
+            self.lemmas.append(lemma)
+            self.POS.append(pos)
+
+        self.tokens=np.memmap(vertical, dtype="<u4", mode="r", offset=self.HEADER.size, shape=(tokens,)) \
+            if tokens else np.zeros(0, dtype="<u4")
+        self.lineEnds=np.memmap(vertical, dtype="<u8", mode="r", offset=self.HEADER.size+4*tokens, shape=(lines,)) \
+            if lines else np.zeros(0, dtype="<u8")
+
+    @staticmethod
+    def fileIdentity(path):
+        """
+        Získá údaje identifikující verzi souboru.
+
+        :param path: Cesta k souboru.
+        :returns: list -- [velikost, čas modifikace v ns]
+        """
+        st=os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def __len__(self):
+        """
+        Počet řádků.
+        """
+        return self.lineEnds.shape[0]
+
+    def lines(self):
+        """
+        Iteruje přes řádky.
+
+        :returns: list -- tokenů řádku ve formátu (tvar, lemma, slovní druh, True => tokenu předchází bílý znak)
+        """
+        forms=self.forms
+        lemmas=self.lemmas
+        POS=self.POS
+
+        start=0
+        for chunkStart in range(0, len(self), self.LINES_AT_ONCE):
+            ends=self.lineEnds[chunkStart:chunkStart+self.LINES_AT_ONCE].tolist()
+            tokens=self.tokens[start:ends[-1]].tolist()
+
+            offset=start
+            for end in ends:
+                yield [(forms[t>>1], lemmas[t>>1], POS[t>>1], bool(t&1)) for t in tokens[start-offset:end-offset]]
+                start=end
+
+class AnnotatedVerticalWriter(object):
+    """
+    Vytváří anotovaný vertikál (viz AnnotatedVertical) z anotovaného textu v textové podobě.
+    Soubor je nejprve zapisován do dočasného souboru, který je po uzavření přejmenován.
+    """
+
+    WRITE_TOKENS=2**20   #po kolika tokenech je zapisováno do souboru
+
+    def __init__(self, vertical, inputFile, dictMorpho):
+        """
+        Inicializace.
+
+        :param vertical: Cesta, kam bude vertikál uložen.
+        :param inputFile: Cesta ke vstupnímu souboru, ze kterého je vertikál vytvářen.
+        :param dictMorpho: Cesta ke slovníku morphodity, se kterým je vertikál vytvářen.
+        """
+        self.vertical=vertical
+        self.identity=AnnotatedVertical.fileIdentity(inputFile)+AnnotatedVertical.fileIdentity(dictMorpho)
+        self.tmpFile=vertical+".tmp"+str(os.getpid())
+
+        self.__file=open(self.tmpFile, "wb")
+        self.__file.write(b"\x00"*AnnotatedVertical.HEADER.size)
+
+        self.__formsIds={}
+        self.__formsTable=[]
+        self.__tokens=array("I")
+        self.__tokensCnt=0
+        self.__lineEnds=array("Q")
+        self.__unfinished=""    #začátek řádku, jehož konec ještě nebyl zapsán
+
+    def write(self, text):
+        """
+        Zápis anotovaného textu. Řádky jsou odděleny znakem konce řádku.
+
+        :param text: str -- anotovaný text v textové podobě
+        """
+        lines=text.split("\n")
+        lines[0]=self.__unfinished+lines[0]
+        self.__unfinished=lines.pop()
+
+        formsIds=self.__formsIds
+        tokens=self.__tokens
+        for line in lines:
+            fields=line.split("\t")
+            for i in range(0, len(fields)-1, 3):
+                form=fields[i]
+                glue=0
+                if form.startswith(" "):
+                    form=form.lstrip(" ")
+                    glue=1
+
+                key=(form, fields[i+1], fields[i+2])
+                formId=formsIds.get(key)
+                if formId is None:
+                    formId=len(self.__formsTable)
+                    formsIds[key]=formId
+                    self.__formsTable.append("\t".join(key)+"\n")
+                tokens.append(formId<<1|glue)
+
+            self.__lineEnds.append(self.__tokensCnt+len(tokens))
+
+        if len(tokens)>=self.WRITE_TOKENS:
+            self.__writeTokens()
+
+    def __writeTokens(self):
+        """
+        Zapíše nashromážděné tokeny do souboru.
+        """
+        self.__file.write(np.array(self.__tokens, dtype="<u4").tobytes())
+        self.__tokensCnt+=len(self.__tokens)
+        self.__tokens=array("I")
+
+    def flush(self):
+        """
+        Zápis probíhá až při uzavření. Kvůli kompatibilitě se souborem.
+        """
+        pass
+
+    def close(self):
+        """
+        Dokončí vertikál a uloží jej na místo určení.
+        """
+        if self.__unfinished:
+            self.write("\n")
+        self.__writeTokens()
+
+        self.__file.write(np.array(self.__lineEnds, dtype="<u8").tobytes())
+        formsOffset=self.__file.tell()
+        self.__file.write("".join(self.__formsTable).encode("utf-8"))
+
+        self.__file.seek(0)
+        self.__file.write(AnnotatedVertical.HEADER.pack(AnnotatedVertical.MAGIC, AnnotatedVertical.VERSION,
+                                                        *(self.identity+[len(self.__lineEnds), self.__tokensCnt,
+                                                                         len(self.__formsTable), formsOffset])))
+        self.__file.close()
+        os.replace(self.tmpFile, self.vertical)
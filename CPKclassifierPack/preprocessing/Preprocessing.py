@@ -6,8 +6,19 @@ Obsahuje třídu pro předzpracování vstupních dat.
 :contact:    xdocek09@stud.fit.vubtr.cz
 
 """
-from multiprocessing import Process, Manager, Lock, Value, Queue, Condition
+from multiprocessing import Process, Queue
 import queue
+import heapq
+
+import codecs
+import hashlib
+import io
+import json
+import locale
+import os
+import re
+
+from collections import OrderedDict, deque
 
 import multiprocessing
 import logging
@@ -20,254 +31,163 @@ from ufal.morphodita import *
 import struct
 
 import datetime
-import ctypes
+import time
+
+import numpy as np
+
+from ..utils.BlockCompressedFile import BlockCompressedFile
+from .AnnotatedVertical import AnnotatedVertical, AnnotatedVerticalWriter, AnnotatedVerticalInvalidFile
+from .PreprocessingCheckpoint import PreprocessingCheckpoint
 
 
-class SharedDocumentCache(object):
+class PreprocessingShardsException(Exception):
     """
-    Slouží jako sdílená cache dokumentů mezi procesy.
-    Zabraňuje vypisování dokumentů, které nejsou v pořadí.
-    Do cache není nutné ukládat prázdné dokumenty.
-    
-    Pokud například řeknu pomocí metody waitFor, že čekám na dokument s číslem 20 a 40.
-    Tedy:
-    waitFor(20)    #Tato metoda ukládá čísla dokumentů do listu
-    waitFor(40)
-    
-    Tak v momentě, kdy se objeví v cache dokument s číslem 20, jsou vypsány i prázdné dokumenty
-    před dokumentem 20 (počáteční dokument má číslo 0). Dále pokud se objeví v cache dokument 40. Vypíší se
-    i prázdné dokumenty mezi, tedy 21-39.
+    Výstupy dílů neodpovídají dílům vstupního souboru.
     """
-    
-    #CONDITION_WAIT_TIME_OUT=1.0   #maximální počet sekund, při čekání na podmínku
-    
-    def __init__(self, manager=None):
+    pass
 
+class ByteRangeReader(io.RawIOBase):
+    """
+    Zpřístupňuje pouze daný rozsah bajtů binárního souboru. Používá se pro čtení dílu vstupního souboru.
+    """
+    
+    def __init__(self, fileObj, start, end):
         """
-        Inicializace cache.
+        Inicializace.
         
-        :param manager: Volitelný parametr. Pokud chceme vnutit použití jiného multiprocessing.Manager.
+        :param fileObj: Binární soubor s podporou seek. Je uzavřen společně s tímto objektem.
+        :param start: Offset prvního bajtu rozsahu.
+        :param end: Offset bajtu za posledním bajtem rozsahu.
         """
-        if manager is None:
-            manager=Manager()
-        self.__docCache=manager.list()  #Zde budeme ukladat dokumenty.
-        self.__sharedLock=Lock()
-        self.__shouldWrite=Value(ctypes.c_ulonglong, 0)
-        self.__numOfWaitingForWrite=Value(ctypes.c_uint, 0) #počet čekajicích procesů na výpis
-        
+        self.__file=fileObj
+        self.__file.seek(start)
+        self.__remaining=end-start
         
+    def readable(self):
+        return True
     
-        #List neprázdných dokumentů, na které čekáme. 
-        #Díky tomuto listu nemusíme do cache ukládat prázdné dokumenty.
-
-        self.__waitQ=manager.list()
-        
-        self.__notifyNewActWait=Condition(self.__sharedLock)
-        
-    def gF(self):
-        return self.__docCache[0][0] if len(self.__docCache) else None
-        
-    def getNumberOfDocumentsInCache(self):
+    def readinto(self, b):
         """
-        Získání počtu dokumentu v cache.
+        Čtení do bufferu. Nečte za konec rozsahu.
         
-        :return: Počet dokumentů v cache.
+        :param b: Buffer pro přečtená data.
+        :returns: int -- počet přečtených bajtů
         """
+        if self.__remaining<=0:
+            return 0
         
-        return len(self.__docCache)
+        data=self.__file.read(min(len(b), self.__remaining))
+        b[:len(data)]=data
+        self.__remaining-=len(data)
+        return len(data)
     
-    def getNumberOfWaitingForWrite(self):
-        """
-        Získání počtu procesů, které čekají na zápis.
-        
-        :return: Počet procesů čekajících na zápis.
-        """
+    def close(self):
+        if not self.closed:
+            self.__file.close()
+        super().close()
         
-        return self.__numOfWaitingForWrite.value
 
-    def getLastWritten(self):
+class ReorderBuffer(object):
+    """
+    Vyrovnávací paměť pro výpis zpracovaných částí řádků ve správném pořadí.
+    Používá ji pouze rodičovský proces, který do ní vkládá výsledky přijaté od pracujících procesů.
+    
+    Části mohou přicházet v libovolném pořadí. Část, která je na řadě, je ihned vypsána, ostatní jsou uloženy
+    v min-haldě podle čísla části, dokud na ně nepřijde řada.
+    Výpis jde přes velký buffer, aby se nevolal zápis pro každou část zvlášť.
+    
+    Do pořadí částí lze vložit značky (viz mark). Jakmile jsou vypsány všechny části před značkou, je buffer zapsán
+    a je zavolána funkce onCommit (například pro uložení kontrolního bodu).
+    """
+    
+    WRITE_BUFFER_SIZE=2**22   #počet znaků, po jejichž nashromáždění je buffer zapsán
+    
+    def __init__(self, output=None, onCommit=None):
         """
-        Získání posledně vypsaného dokumentu.
+        Inicializace.
         
-        :return: Vrací číslo naposledy vypsaného dokumentu. -1 znamená, že doposud nebyl vypsán dokument.
+        :param output: Textový soubor pro výpis. None => stdout.
+        :param onCommit: Funkce, která je zavolána s hodnotou značky, když jsou vypsány všechny části před ní.
         """
-        
-        return self.__shouldWrite.value-1
-        
-    def waitFor(self, docNumber):
+        self.output=sys.stdout if output is None else output
+        self.onCommit=onCommit
+        self.nextToWrite=0  #číslo části, která je na řadě pro výpis
+        self.__heap=[]
+        self.__marks=deque()  #(číslo části, hodnota) v pořadí částí
+        self.__buffer=[]
+        self.__bufferSize=0
+        
+    def __len__(self):
         """
-        Uložení čísla dokumentu, který chceme vypsat. Ukládáme takto dokumenty, abychom nemuseli cachovat i prázdné řádky.
-        Vkládání se provádí do fronty.
-        
-        :param docNumber: Číslo dokumentu, na který čekáme pro vypsání.
+        Počet uložených částí, které čekají na výpis.
         """
-        self.__sharedLock.acquire()
-
-        insertAt=0
-        for x in self.__waitQ:
-            if docNumber > x:
-                insertAt+=1
-            else:
-                break
-
-        self.__waitQ.insert(insertAt,docNumber)
-        
-        if len(self.__waitQ)==1:
-            self.__changeActWaitFor(docNumber)
-
-        self.__sharedLock.release()
-        
+        return len(self.__heap)
         
-    def actWaitFor(self):
+    def put(self, partNumber, text, pEnd):
         """
-        Vrátí číslo dokumentu, na který aktuálně čeká.
+        Vložení zpracované části. Vypíše všechny části, které jsou na řadě.
         
-        :return: Číslo dokumentu, na který aktuálně čekáme. Pokud nečekáme na žádný dokument vrací None.
+        :param partNumber: Číslo části.
+        :param text: Zpracovaná část.
+        :param pEnd: Jak bude zakončen výpis části (stejně jako parametr end pro print).
         """
-
-        if len(self.__waitQ)!=0:
-            return self.__waitQ[0]
-        
-        return None
-        
-    def __changeActWaitFor(self, docNumber):
+        if partNumber!=self.nextToWrite:
+            heapq.heappush(self.__heap, (partNumber, text, pEnd))
+            return
+        
+        self.__write(text, pEnd)
+        self.nextToWrite+=1
+        self.__commitMarks()
+        
+        heap=self.__heap
+        while heap and heap[0][0]==self.nextToWrite:
+            _, text, pEnd=heapq.heappop(heap)
+            self.__write(text, pEnd)
+            self.nextToWrite+=1
+            self.__commitMarks()
+            
+    def mark(self, partNumber, value):
         """
-        Změna dokumentu, na který aktuálně čekáme.
-        
-        Dává vědět případným čekajícím dokumentům, které se mají zapsat bez ukládání do cache,
-        že došlo ke změně aktuálního dokumentu, na který čekáme.
+        Vloží značku před část s daným číslem. Značky musí být vkládány v pořadí částí.
         
-        :param docNumber: Číslo dokumentu.
+        :param partNumber: Číslo části, před kterou je značka.
+        :param value: Hodnota předaná funkci onCommit.
         """
-        #dame vedet pripadnym cekajicim dokumentum, ktere se maji zapsat
-        #bez ukladani do cache
-        self.__notifyNewActWait.notify_all()
+        self.__marks.append((partNumber, value))
+        self.__commitMarks()
         
-    def __nextWaitFor(self):
+    def __commitMarks(self):
         """
-        Nastavíme dalšího ve frontě jako aktuálního, na který čekáme.
-        Starého z fronty odstraníme.
-        
-        Dává vědět případným čekajícím dokumentům, které se mají zapsat bez ukládání do cache,
-        Že došlo ke změně aktuálního dokumentu, na který čekáme.
-        
-        Používat pokud vlastním zámek.
-        
+        Zapíše buffer a zavolá onCommit pro značky, před kterými jsou již vypsány všechny části.
         """
-
-        if len(self.__waitQ)!=0:
+        marks=self.__marks
+        while marks and marks[0][0]<=self.nextToWrite:
+            _, value=marks.popleft()
+            self.flush()
+            self.onCommit(value)
             
-            del self.__waitQ[0]
-            #změníme aktuální
-            if len(self.__waitQ)>0:
-                self.__changeActWaitFor(self.__waitQ[0])
-        
-        
-        
-    def cacheDoc(self, docNumber, docTxt, pEnd=''):
+    def __write(self, text, pEnd):
         """
-        Uložení dokumentu do cache.
+        Zápis části do bufferu.
         
-        :param docNumber: Číslo aktuálně nového dokumentu (číslo řádku).
-        :param docTxt: Nový dokument pro uložení.
-        :param pEnd: Jedná se o parametr end pro print. Tedy jak bude zakončen výpis řetězce.
+        :param text: Zpracovaná část.
+        :param pEnd: Zakončení části.
         """
-
-        self.__sharedLock.acquire()
-        insertAt=0
-        for x in self.__docCache:
-            if docNumber > x[0]:
-                insertAt+=1
-            else:
-                break
-
-        self.__docCache.insert(insertAt,(docNumber, docTxt, pEnd))
-
-        self.__sharedLock.release()
+        self.__buffer.append(text)
+        self.__buffer.append(pEnd)
+        self.__bufferSize+=len(text)+len(pEnd)
+        if self.__bufferSize>=self.WRITE_BUFFER_SIZE:
+            self.flush()
             
-    def cacheWrite(self):
+    def flush(self):
         """
-        Vypisuje data z cache. Na stdout.
-        Vypíše jen dokumenty, které neporuší pořadí dané číslem dokumentu.
+        Zapíše obsah bufferu.
         """
-
-        self.__sharedLock.acquire()
-
-        try:
-
-            actWait=self.actWaitFor()
-
-            if actWait is not None:
-                    
-                while len(self.__docCache) and actWait==self.__docCache[0][0]:
-                    if self.__shouldWrite.value==actWait:
-
-                        print(self.__docCache[0][1], end=self.__docCache[0][2], flush=True)
-                        self.__shouldWrite.value+=1
-                        
-                        del self.__docCache[0]
-                        
-
-                        self.__nextWaitFor()
-                        actWait=self.actWaitFor()
-    
-                    else:
-                        #doplníme bílé řádky
-                        print("\n"*(actWait-self.__shouldWrite.value), end="",flush=True)
-                        self.__shouldWrite.value=actWait
-        
-        finally:
-            self.__sharedLock.release()
-            
-        
-    def writeWithoutCaching(self, docNumber, docTxt, pEnd=''):
-        """
-        Vypíše dokument ve správném pořadí, ale nebude ukládán do cache.
-        Místo toho bude čekat do doby než na něj přijde řada.
-        
-        Je nutné si uvědomit, že v tomto případě při čekání máme obsazený jeden proces/vlákno,
-        nemůžeme mezitím tedy konat užitečnou práci, pouze spíme.
-        
-        :param docNumber: Číslo dokumentu.
-        :param docTxt: Obsah dokumentu.
-        :param pEnd: Jedná se o parametr end pro print. Tedy jak bude zakončen výpis řetězce.
-        """
-
-        self.__sharedLock.acquire()
-
-        self.__numOfWaitingForWrite.value+=1
-        
-        try:
-            while True:
-                
-                actWait=self.actWaitFor()
-                
-                
-                if actWait is not None and actWait==docNumber:
-                    if self.__shouldWrite.value<actWait:
-                        #doplníme bílé řádky
-                        
-                        print("\n"*(actWait-self.__shouldWrite.value), end=pEnd,flush=True)
-                        self.__shouldWrite.value=actWait
-                    
-                    print(docTxt, end=pEnd,flush=True)
-                    
-                    self.__numOfWaitingForWrite.value-=1
-                    self.__shouldWrite.value+=1
-                    
-                    self.__nextWaitFor()
-
-                    break
-                
-                else:
-                    #aktuálně nečekáme na předzpracování našeho dokumentu
-                    #počkáme tedy
-                    self.__notifyNewActWait.wait()
-                    
-        finally:
-            self.__sharedLock.release()
-            
-
+        if self.__buffer:
+            self.output.write("".join(self.__buffer))
+            self.__buffer=[]
+            self.__bufferSize=0
+        self.output.flush()
         
 
 class PreprocessingWorker(Process):
@@ -275,31 +195,34 @@ class PreprocessingWorker(Process):
     Třída reprezentující jeden pracující proces provádějící předzpracování.
     """
     
-    def __init__(self, linesForPreprocessing, fileToRead, sharedCache, args, wordsRemover, lemPosExt, onlyPos, errorBoard):
+    def __init__(self, linesForPreprocessing, fileToRead, results, args, wordsRemover, lemPosExt, onlyPos, errorBoard,
+                 annotate=False):
         """
         Inicializace procesu.
         
-        :param linesForPreprocessing: Queue obsahující řádky pro předzpracování.
+        :param linesForPreprocessing: Queue obsahující dávky částí řádků pro předzpracování.
         :param fileToRead: Cesta k souboru, ze kterého získáme řádky pro čtení. Používá se pokud je předán pouze offset.
-        :type sharedCache: SharedDocumentCache
-        :param sharedCache: Sdílená cache pro ukládání řádku/dokumentů, které nejsou v pořadí pro výpis.
+        :param results: Queue, do které jsou vkládány zpracované dávky pro rodiče.
         :param args: Argumenty pro preprocessing z ArgumentsManager pro CPKclassifier.
         :param wordsRemover: RemoveWords -- Používá se pro odstraňování nevhodných slov.
-        :param lemPosExt: Lemmatizer -- Inicializovaný lemmatizer, který bude použit pro lemmatizaci a výběr slov 
-            na základě slovního druhu.
+        :param lemPosExt: Lemmatizer|SignsSeparator -- Inicializovaný lemmatizer, který bude použit pro lemmatizaci a výběr slov 
+            na základě slovního druhu. Pro samotné oddělení znaků stačí SignsSeparator.
         :param onlyPos: list|None -- obsahující slovní druhy pro extrakci
         :param errorBoard: Queue, kde se v případě chyby dá vědět rodičí.
+        :param annotate: True => místo předzpracování provádí pouze tokenizaci a analýzu pro anotovaný vertikál
+            (viz Lemmatizer.annotate).
         """
         super(PreprocessingWorker, self).__init__()
 
         self.linesForPreprocessing = linesForPreprocessing
         self.fileToRead=fileToRead
-        self.sharedCache=sharedCache
+        self.results=results
         self.args=args
         self.wordsRemover=wordsRemover
         self.lemPosExt=lemPosExt
         self.onlyPos=onlyPos
         self.errorBoard=errorBoard
+        self.annotate=annotate
         
         
     def preprocess(self, line):
@@ -313,7 +236,10 @@ class PreprocessingWorker(Process):
         if line == "":
             #optimalizace pro prázdné řádky
             return line
-                            
+        
+        if self.annotate:
+            #pouze tokenizace a analýza pro anotovaný vertikál
+            return self.lemPosExt.annotate(line)
         
         if not self.args.lemmatize:
             line=" ".join(self.wordsRemover.safeSepRemoveWords(line))
@@ -332,8 +258,64 @@ class PreprocessingWorker(Process):
             #neprovádíme tedy separaci znavu, když není potřeba
             
             
-            line=[ x[0] for x in self.lemPosExt.getWordsPOS(line)]
+            line=self.lemPosExt.tokenize(line)
         
+        return self.__finish(line)
+    
+    def preprocessAnnotated(self, tokens):
+        """
+        Předzpracování jedné části řádku z anotovaného vertikálu (viz AnnotatedVertical).
+        Výsledek odpovídá metodě preprocess nad původním textem, ale neprovádí se tokenizace ani morfologická analýza.
+        
+        :param tokens: list -- tokenů ve formátu (tvar, lemma, slovní druh, True => tokenu předchází bílý znak)
+        :returns: string -- předzpracovaná část řádku
+        """
+        
+        if not tokens:
+            return ""
+        
+        if not self.args.lemmatize:
+            #slova oddělená bílými znaky
+            words=[]
+            for t in tokens:
+                if t[3] or not words:
+                    words.append([t])
+                else:
+                    words[-1].append(t)
+            texts=["".join([t[0] for t in w]) for w in words]
+            
+            #stejně jako v preprocess odstraníme celá slova ještě před tokenizací
+            kept=set(self.wordsRemover.safeSepRemoveWords(texts))
+            if len(kept)!=len(texts):
+                words=[w for w, text in zip(words, texts) if text in kept]
+                texts=[text for text in texts if text in kept]
+                tokens=[t for w in words for t in w]
+        
+        if self.args.pos:
+            #extrakce slovních druhů
+            line=[t[1] if self.args.lemmatize else t[0] for t in tokens if t[2] in self.onlyPos]
+            
+        elif self.args.lemmatize:
+            #lemmatizace
+            line=[t[1] for t in tokens]
+            
+        elif self.args.sepSigns:
+            #oddělení znaků od slov
+            line=[t[0] for t in tokens]
+            
+        else:
+            line=texts
+        
+        return self.__finish(line)
+    
+    def __finish(self, line):
+        """
+        Dokončení předzpracování po lemmatizaci/extrakci/separaci znaků.
+        Odstranění nežádaných slov a úprava znaků.
+        
+        :param line: string|list -- řádek nebo jeho slova
+        :returns: string -- předzpracovaný řádek
+        """
         
         if self.wordsRemover.couldRemove():
             #Odstranění nežádaných slov
@@ -352,46 +334,58 @@ class PreprocessingWorker(Process):
         
         return line
             
-    def run(self, once=False):
+    def preprocessPart(self, lineTxt, pEnd):
+        """
+        Předzpracování jedné části řádku.
+        
+        :param lineTxt: str|list|int -- část řádku, tokeny části z anotovaného vertikálu nebo offset řádku v souboru
+            (řádek je poté načten ze souboru)
+        :param pEnd: Jak bude zakončen výpis části.
+        :returns: (str, str) -- předzpracovaná část a její zakončení
+        """
+        if type(lineTxt) == str:
+            lineTxt=self.preprocess(lineTxt)
+        elif type(lineTxt) == list:
+            #tokeny z anotovaného vertikálu
+            lineTxt=self.preprocessAnnotated(lineTxt)
+        else:
+            #dostali jsme pouze offset do souboru (zřejmě velký dokument)
+            #musime dokument tedy prvne nacist do pameti
+            with BlockCompressedFile.open(self.fileToRead, "r") as reading:
+                reading.seek(lineTxt)
+                lineTxt=self.preprocess(reading.readline().rstrip('\n'))
+                
+        if pEnd==" " and len(lineTxt)<1:
+            pEnd=""
+            
+        return (lineTxt, pEnd)
+            
+    def preprocessBatch(self, batch):
         """
-        Předzpracování.
+        Předzpracování dávky částí řádků.
         
-        :param once: Pokud je True. Zpracuje jeden řádek, pokud je ihned k dispozici.
+        :param batch: list -- částí ve formátu (číslo části, část řádku, zakončení)
+        :returns: list -- zpracovaných částí ve formátu (číslo části, předzpracovaná část, zakončení)
+        """
+        return [(partNumber,)+self.preprocessPart(lineTxt, pEnd) for partNumber, lineTxt, pEnd in batch]
+            
+    def run(self):
+        """
+        Předzpracování. Zpracovává dávky z fronty, dokud nepřijde "EOF".
+        Pro každou dávku vrátí rodiči (zpracované části, počet znaků dávky, doba zpracování v sekundách).
+        Po "EOF" vrátí rodiči ("EOF", stav cache lemmatizátoru), aby ji mohl sloučit se svou a uložit.
         """
         
         try:
             while True:
-                try:
-                    msg=self.linesForPreprocessing.get(timeout=1 if once else None)
-                except queue.Empty:
-                    break
-                else:
-                    if msg == "EOF":
-                        return
-                    
-                    lineNumber, lineTxt, pEnd=msg
-
-                    if type(lineTxt) == str:
-                        lineTxt=self.preprocess(lineTxt)
-                    else:
-                        #dostali jsme pouze offset do souboru (zřejmě velký dokument)
-                        #musime dokument tedy prvne nacist do pameti
-                        with open(self.fileToRead, "r") as reading:
-                            reading.seek(lineTxt)
-                            lineTxt=self.preprocess(reading.readline().rstrip('\n'))
-                            
-                    if pEnd==" " and len(lineTxt)<1:
-                        pEnd=""
-                        
-                    if sys.getsizeof(lineTxt)>Preprocessing.MAX_SIZE_OF_SHARED_OBJECT:
-                        #příliš velké pro cache, počkáme na přímé vypsání
-                        self.sharedCache.writeWithoutCaching(lineNumber, lineTxt, pEnd)
-                    else:
-                        #dáme do cache a místo čekání budeme dělat užitečnější práci
-                        self.sharedCache.cacheDoc(lineNumber, lineTxt, pEnd)
-                
-                if once:
+                batch=self.linesForPreprocessing.get()
+                if batch == "EOF":
+                    self.results.put(("EOF", self.lemPosExt.cacheState() if self.lemPosExt is not None else None))
                     return
+                
+                startTime=time.time()
+                processed=self.preprocessBatch(batch)
+                self.results.put((processed, sum(len(x[1]) for x in batch if type(x[1]) == str), time.time()-startTime))
                     
         except:
             self.errorBoard.put("ERROR")
@@ -406,10 +400,21 @@ class Preprocessing(object):
     """
     
     MAX_SIZE_OF_SHARED_OBJECT=2**(struct.calcsize("!i")*8-2)-1 #definuje maximalni velikost v bajtech, sdileneho objektu, na základě omezení v manageru
+    REORDER_WINDOW_PER_WORKER=1024  #maximální počet rozpracovaných a nevypsaných částí na jeden pracující proces
+    
+    #Části řádků jsou procesům posílány v dávkách. Velikost dávky (počet znaků) je průběžně upravována tak,
+    #aby zpracování jedné dávky trvalo přibližně BATCH_TIME sekund.
+    BATCH_START_SIZE=2**14
+    BATCH_MIN_SIZE=2**10
+    BATCH_MAX_SIZE=2**22
+    BATCH_TIME=0.05
+    
+    CHECKPOINT_SIZE=2**26   #po kolika bajtech vstupu je při zápisu do výstupního souboru ukládán kontrolní bod
 
 
     posSigns=["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Z", "X"]
-    def __init__(self, args, stopWords, morphDic, workers=1, logAfterSec=30, maxNumberOfWordsPerLinePart=100000):
+    def __init__(self, args, stopWords, morphDic, workers=1, logAfterSec=30, maxNumberOfWordsPerLinePart=100000,
+                 lemmatizerCacheSize=0, lemmatizerCacheFile=None):
         """
         Inicializace předzpracování
         
@@ -420,6 +425,8 @@ class Preprocessing(object):
         :param logAfterSec: Udává po kolika sekundách nejdříve má dojit k logování.
         :param maxNumberOfWordsPerLinePart: Udává limitní počet slov, které budou zpracovávany společně.
                 Rozděluje řádky na části.
+        :param lemmatizerCacheSize: Maximální počet slovních tvarů v cache lemmatizátoru. 0 => bez cache.
+        :param lemmatizerCacheFile: Cesta k souboru pro uložení a předehřátí cache lemmatizátoru. None => neukládá se.
         """
         
         self.args=args
@@ -439,13 +446,25 @@ class Preprocessing(object):
         self.lastLogTime=None
         
         self.maxNumberOfWordsPerLinePart=maxNumberOfWordsPerLinePart
+        self.lemmatizerCacheSize=lemmatizerCacheSize
+        self.lemmatizerCacheFile=lemmatizerCacheFile
+        self.byteRange=None     #rozsah bajtů vstupního souboru, který je zpracováván (None => celý soubor)
         
     def start(self):
         """
         Zahájí předzpracování. Parametry se nastavují v konstruktoru nebo pomocí setParams.
         Výsledek je zapisován do stdout.
+        
+        Pokud je uveden díl (args.shard), tak je zpracován pouze daný díl vstupního souboru (viz shardRange).
+        Pokud je uveden výstupní soubor (args.output), tak je výsledek zapisován do něj s kontrolními body
+        (viz __preprocessToFile).
         """
         logging.info("začátek předzpracování")
+        
+        if self.args.shard:
+            shard, shards=self.args.shard
+            self.byteRange=self.shardRange(self.args.input, shard, shards)
+            logging.info("díl "+str(shard)+"/"+str(shards)+": bajty "+str(self.byteRange[0])+" až "+str(self.byteRange[1]))
 
 
         lemPosExt=None
@@ -459,21 +478,145 @@ class Preprocessing(object):
                     
         WordsRemover=RemoveWords(wordsToRem, self.args.minWordLength, self.args.maxWordLength)
 
-        if self.args.lemmatize or self.args.pos or self.args.sepSigns:
-            lemPosExt=Lemmatizer(self.dict)
+        if self.args.annotated:
+            #varianta předzpracování je odvozena z anotovaného vertikálu bez morfologické analýzy
+            vertical=self.__annotatedVertical()
             if self.args.pos:
-                onlyPos=set(lemPosExt.translateNumericPOS(self.args.pos))
+                onlyPos=set(Lemmatizer.translateNumericPOS(self.args.pos))
+                
+            self.__preprocessAnnotated(vertical, WordsRemover, onlyPos)
+            logging.info("Předzpracováno "+str(self.lineNumber)+" řádků.")
+            
+        else:
+            if self.args.lemmatize or self.args.pos:
+                lemPosExt=Lemmatizer(self.dict, self.lemmatizerCacheSize, self.lemmatizerCacheFile)
+                if self.args.pos:
+                    onlyPos=set(lemPosExt.translateNumericPOS(self.args.pos))
+            elif self.args.sepSigns:
+                #pouze tokenizace bez morfologické analýzy, tokenizátor ze slovníku je použit, pokud je slovník uveden
+                lemPosExt=SignsSeparator(SignsSeparator.dictionaryTokenizer(self.dict) if self.dict else None)
                 
+            if self.args.output:
+                lines=self.__preprocessToFile(WordsRemover, lemPosExt, onlyPos)
+            else:
+                lines=self.__preprocessLines(WordsRemover, lemPosExt, onlyPos, sys.stdout, byteRange=self.byteRange)
+            logging.info("Předzpracováno "+str(lines)+" řádků.")
+        
+        if lemPosExt is not None:
+            lemPosExt.logCacheStats()
+            lemPosExt.saveCache()
                 
+        logging.info("konec předzpracování")
+        
+    def __preprocessToFile(self, WordsRemover, lemPosExt, onlyPos):
+        """
+        Předzpracování řádků vstupního souboru do výstupního souboru (args.output) s kontrolními body
+        (viz PreprocessingCheckpoint).
+        
+        Vstup je zpracováván v jednom průchodu (se stejnými pracujícími procesy), který je rozdělen na úseky
+        o přibližně CHECKPOINT_SIZE bajtech končící na hranici řádku. Jakmile je vypsán výstup celého úseku, je zapsán
+        na disk a je uložen kontrolní bod. Přerušené předzpracování tak při opětovném spuštění pokračuje od posledního
+        kontrolního bodu. V inkrementálním režimu (args.incremental) jsou po dokončeném běhu
+        zpracovány pouze řádky připojené na konec vstupního souboru.
+        
+        Poslední řádek vstupu bez znaku konce řádku je vypsán, ale kontrolní bod zůstává před ním, protože
+        připojená data jej mohou prodloužit.
+        
+        :param WordsRemover: RemoveWords -- Používá se pro odstraňování nevhodných slov.
+        :param lemPosExt: Lemmatizer|SignsSeparator|None -- Pro lemmatizaci, výběr slov a oddělení znaků.
+        :param onlyPos: set|None -- obsahující slovní druhy pro extrakci
+        :return: int -- počet řádků výstupního souboru
+        """
+        checkpoint=PreprocessingCheckpoint(self.args.output, self.args.input, self.__settings())
+        stored=checkpoint.load(self.args.incremental)
+        
+        with BlockCompressedFile.open(self.args.input, "rb") as fInput:
+            start, end=self.byteRange if self.byteRange else (0, fInput.seek(0, io.SEEK_END))
+            committedEnd=self.__lastLineStart(fInput, start, end)
+            
+            if stored is None:
+                offset, lines, outputOffset=start, 0, 0
+            elif stored["finished"]:
+                logging.info("vstupní soubor již byl celý zpracován: "+self.args.output)
+                return stored["lines"]
+            else:
+                offset, lines, outputOffset=stored["inputOffset"], stored["lines"], stored["outputOffset"]
+                logging.info("pokračuji od kontrolního bodu: řádek "+str(lines)+", offset "+str(offset))
+        
+        with open(self.args.output, "a") as output:
+            output.truncate(outputOffset)
+            startLines=lines
+            
+            def commit(committed):
+                nonlocal offset, lines, outputOffset
+                output.flush()
+                os.fsync(output.fileno())
+                offset, lines=committed[0], startLines+committed[1]
+                outputOffset=os.fstat(output.fileno()).st_size
+                checkpoint.save(offset, lines, outputOffset)
+                logging.info("kontrolní bod: řádek "+str(lines)+", offset "+str(offset))
+            
+            processed=self.__preprocessLines(WordsRemover, lemPosExt, onlyPos, output, byteRange=(offset, end),
+                                             committedEnd=committedEnd, onCommit=commit)
+            output.flush()
+            os.fsync(output.fileno())
+                    
+        checkpoint.save(offset, lines, outputOffset, True)
+        
+        return startLines+processed
+    
+    def __settings(self):
+        """
+        Nastavení, která ovlivňují výsledek předzpracování.
+        
+        :return: str
+        """
+        settings=dict((name, getattr(self.args, name)) for name in ["lemmatize", "noSW", "unidecode", "sepSigns",
+                                                                       "minWordLength", "maxWordLength", "pos", "uc",
+                                                                       "lc", "shard"])
+        settings["maxNumberOfWordsPerLinePart"]=self.maxNumberOfWordsPerLinePart
+        if self.args.noSW:
+            settings["stopWords"]=hashlib.sha1("\n".join(sorted(self.stopWords)).encode("utf-8")).hexdigest()
+        if self.args.lemmatize or self.args.pos:
+            settings["dict"]=AnnotatedVertical.fileIdentity(self.dict)
+            
+        return json.dumps(settings, sort_keys=True)
+        
+    def __preprocessLines(self, WordsRemover, lemPosExt, onlyPos, output, annotate=False, byteRange=None,
+                          committedEnd=None, onCommit=None):
+        """
+        Předzpracování řádků vstupního souboru. Podle počtu procesů jednoprocesorově, nebo multiprocesorově.
+        
+        :param WordsRemover: RemoveWords -- Používá se pro odstraňování nevhodných slov.
+        :param lemPosExt: Lemmatizer|SignsSeparator|None -- Pro lemmatizaci, výběr slov a oddělení znaků.
+        :param onlyPos: set|None -- obsahující slovní druhy pro extrakci
+        :param output: Kam se zapisuje výsledek (objekt s metodami write a flush).
+        :param annotate: True => místo předzpracování vytváří anotovaný text (viz PreprocessingWorker).
+        :param byteRange: (začátek, konec) -- zpracuje pouze daný rozsah bajtů vstupního souboru. None => celý soubor.
+        :param committedEnd: Offset konce části rozsahu, pro kterou je volána funkce onCommit (viz readSegmentsLineParts).
+        :param onCommit: Funkce, která je zavolána s dvojicí (offset konce úseku, počet řádků do konce úseku), jakmile
+            je výstup všech řádků úseku vypsán do output. None => rozsah není dělen na úseky.
+        :return: int -- počet zpracovaných řádků
+        """
+        if onCommit is None:
+            lineParts=self.readLineParts(self.args.input, byteRange=byteRange)
+        else:
+            lineParts=self.readSegmentsLineParts(self.args.input, byteRange, committedEnd, self.CHECKPOINT_SIZE)
+        
+        lines=0
         if self.workers==1:
             #jednoprocesorova varianta
             p=PreprocessingWorker(linesForPreprocessing=None, fileToRead=self.args.input,
-                                  sharedCache=None, args=self.args, wordsRemover=WordsRemover, 
-                                  lemPosExt=lemPosExt, onlyPos=onlyPos, errorBoard=None)
+                                  results=None, args=self.args, wordsRemover=WordsRemover, 
+                                  lemPosExt=lemPosExt, onlyPos=onlyPos, errorBoard=None, annotate=annotate)
             
             self.lineNumber=0
             
-            for lineCnt, isLastPart, lineTxt in self.readLineParts(self.args.input):
+            for lineCnt, isLastPart, lineTxt in lineParts:
+                if lineCnt is None:
+                    #konec úseku, vše je již vypsáno
+                    onCommit((isLastPart, lines))
+                    continue
                 
                 if lineCnt!=self.lineNumber:
                     #další řádek
@@ -495,15 +638,19 @@ class Preprocessing(object):
                 if pEnd==" " and len(pLine)<1:
                     pEnd=""
                 
-                print(pLine, end=pEnd)
+                print(pLine, end=pEnd, file=output)
+                
+                if isLastPart:
+                    lines+=1
 
         else:
             #multiprocesorova varianta
             self.logType=1  #zmenime logovani na multiprocesove
             
-            self.docCache=SharedDocumentCache()
+            self.reorderBuffer=ReorderBuffer(output, onCommit)
 
             self.linesForPreprocessing=Queue()
+            self.results=Queue()
             self.errorBoard=Queue()
             processes=[]
             
@@ -514,123 +661,186 @@ class Preprocessing(object):
             
             for i in range(0,self.workers-1):
                 p=PreprocessingWorker(linesForPreprocessing=self.linesForPreprocessing, fileToRead=self.args.input,
-                                      sharedCache=self.docCache, args=self.args, wordsRemover=WordsRemover, 
-                                      lemPosExt=lemPosExt, onlyPos=onlyPos, errorBoard=self.errorBoard)
+                                      results=self.results, args=self.args, wordsRemover=WordsRemover, 
+                                      lemPosExt=lemPosExt, onlyPos=onlyPos, errorBoard=self.errorBoard,
+                                      annotate=annotate)
                 processes.append(p)
                 logging.info("Proces "+str(i+1)+". start.")
                 p.start()
                 
             
             #Vytvoříme ještě jeden objekt pro případnou pomoc ostatním procesům se zpracováním.
-            forHelpingP=PreprocessingWorker(linesForPreprocessing=self.linesForPreprocessing, fileToRead=self.args.input,
-                                      sharedCache=self.docCache, args=self.args, wordsRemover=WordsRemover, 
-                                      lemPosExt=lemPosExt, onlyPos=onlyPos, errorBoard=self.errorBoard)
+            self.forHelpingP=PreprocessingWorker(linesForPreprocessing=None, fileToRead=self.args.input,
+                                      results=None, args=self.args, wordsRemover=WordsRemover, 
+                                      lemPosExt=lemPosExt, onlyPos=onlyPos, errorBoard=self.errorBoard,
+                                      annotate=annotate)
             
             logging.info("procházím")
             
             #Budeme procházet plné texty, řádek po řádku.
             #Prázdné řádky jsou triviální záležitost a budeme je zpracovávat ve své vlastní režii.
-            #Neprázdné budeme delegovat na ostatní procesy, pokud ale budeme mít dostatečný náskok,
-            #tak pomůžeme ostatním s předzpracováním neprázdných řádků. Pokud bude řádek přiliš velký
+            #Neprázdné shromažďujeme do dávek, které delegujeme na ostatní procesy. Pokud ale budeme mít dostatečný
+            #náskok, tak pomůžeme ostatním se zpracováním dávky. Pokud bude řádek přiliš velký
             #pro meziprocesovou komunikaci, tak jej zpracujeme.
+            #Výsledky přijímáme průběžně a vypisujeme je ve správném pořadí přes ReorderBuffer.
+            #Rozpracovaných částí (odeslaných nebo čekajících na výpis) může být nejvýše REORDER_WINDOW_PER_WORKER
+            #na proces. Při překročení čekáme na výsledky.
             
             self.lineNumber=0
             self.partsCounter=0
+            self.inProcess=0    #počet odeslaných dávek, jejichž výsledek ještě nebyl přijat
+            self.workersEnded=[]    #stavy cache lemmatizátoru ukončených pracujících procesů
+            self.batch=[]
+            self.batchSize=0
+            self.batchLimit=self.BATCH_START_SIZE
+            window=self.REORDER_WINDOW_PER_WORKER*(self.workers-1)
             
-            for lineCnt, isLastPart, lineTxt in self.readLineParts(self.args.input):
+            for lineCnt, isLastPart, lineTxt in lineParts:
                 #procházíme všechny party
                 
                 self.controlMulPErrors()
+                
+                if lineCnt is None:
+                    #konec úseku, kontrolní bod bude uložen, až budou vypsány všechny předchozí části
+                    self.__sendBatch()
+                    self.reorderBuffer.mark(self.partsCounter, (isLastPart, lines))
+                    continue
 
-                if lineTxt != "":
-                    if isLastPart:
-                        pEnd='\n'
-                    elif len(lineTxt)<1:
-                        pEnd=''
-                    else:
-                        pEnd=' '
-                        
+                if isLastPart:
+                    pEnd='\n'
+                elif len(lineTxt)<1:
+                    pEnd=''
+                else:
+                    pEnd=' '
+                    
+                if lineTxt == "":
                     #prázdné řádky nedelegujeme, ale přímo zpracujeme.
-                    if self.linesForPreprocessing.qsize()>(self.workers-1)*2:
-                        logging.info("HELPING");
-                        #Máme dostatečný náskok.
-                        #Pomůžeme se zpracováním.                   
-                            
-                        self.docCache.waitFor(self.partsCounter)
-                            
-                        lineTxt=forHelpingP.preprocess(lineTxt)
-                        
-                        if pEnd==" " and len(lineTxt)<1:
-                            pEnd=""
-                            
-                        if sys.getsizeof(lineTxt)>self.MAX_SIZE_OF_SHARED_OBJECT:
-                            #přiliš velký pro cache
-                            self.docCache.writeWithoutCaching(self.partsCounter, lineTxt, pEnd)
-                        else:
-                            self.docCache.cacheDoc(self.partsCounter, lineTxt, pEnd)
-                                
-                    elif sys.getsizeof(lineTxt)>self.MAX_SIZE_OF_SHARED_OBJECT:
-                        logging.info("MUST HELPING");
-                        #přiliš velký pro meziprocesorovou komunikaci
-                        self.docCache.waitFor(self.partsCounter)
-                            
-                        lineTxt=forHelpingP.preprocess(lineTxt)
-                        
-                        if pEnd==" " and len(lineTxt)<1:
-                            pEnd=""
-                            
-                        #přiliš velký pro cache
-                        self.docCache.writeWithoutCaching(self.partsCounter, lineTxt, pEnd)
-                            
-                    else:
-                        #delegujeme
-                        self.docCache.waitFor(self.partsCounter)
-                        self.linesForPreprocessing.put((self.partsCounter, lineTxt, pEnd))
-                            
-                    #vypíšeme data z cache
-                    self.docCache.cacheWrite()
-                        
-
+                    self.reorderBuffer.put(self.partsCounter, lineTxt, pEnd)
+                    
+                elif sys.getsizeof(lineTxt)>self.MAX_SIZE_OF_SHARED_OBJECT:
+                    logging.info("MUST HELPING");
+                    #přiliš velký pro meziprocesorovou komunikaci
+                    self.reorderBuffer.put(self.partsCounter, *self.forHelpingP.preprocessPart(lineTxt, pEnd))
                     
+                else:
+                    self.batch.append((self.partsCounter, lineTxt, pEnd))
+                    self.batchSize+=len(lineTxt)
+                    if self.batchSize>=self.batchLimit:
+                        self.__sendBatch()
+                    
+                #posuneme se na další part
+                self.partsCounter+=1
+                
+                if self.partsCounter-self.reorderBuffer.nextToWrite>=window:
+                    #na části v neodeslané dávce by se čekalo marně
+                    self.__sendBatch()
+                
+                #přijmeme hotové výsledky, při zaplnění okna čekáme
+                self.__receiveResults(window)
+                
                 if isLastPart:
                     #další řádek
+                    lines+=1
                     self.lineNumber+=1
                     self.logInfo()
                     self.lineNumber=lineCnt
-
-                #posuneme se na další part
-                self.partsCounter+=1
-            
                 
-            while self.linesForPreprocessing.qsize():
-                #nemáme nic na práci, tak pomůžeme ostatním
-                self.controlMulPErrors()
-                forHelpingP.run(True)
-                self.docCache.cacheWrite()
-                self.logInfo()
+            self.__sendBatch()
                 
-
             #vlozime priznak pro ukončení potomků
             for i in range(0,self.workers-1):
                 self.linesForPreprocessing.put("EOF")
                 
+            #přijmeme zbývající výsledky a cache lemmatizátorů, které jsou sloučeny a uloženy jednou na konci
+            self.__receiveResults()
+            self.__receiveWorkersEnd(lemPosExt)
+                
             #čekáme na ukončení
             for proc in processes:
                 self.controlMulPErrors()
-                self.logInfo()
                 proc.join()           
                 
-            #vypíšeme z cache zbytek
-            self.docCache.cacheWrite()
+            self.reorderBuffer.flush()
             
-            if self.docCache.getLastWritten()!=self.partsCounter-1:
-                #doplníme případné prázdné řádky na konci
-                print("\n"*(self.partsCounter-1-self.docCache.getLastWritten()), end="",flush=True)
-                
-        logging.info("Předzpracováno "+str(self.lineNumber)+" řádků.") 
+        return lines
+            
+    def __annotatedVertical(self):
+        """
+        Otevře anotovaný vertikál vstupního souboru. Pokud neexistuje, nebo je neplatný, tak jej vytvoří.
+        
+        :returns: AnnotatedVertical
+        """
+        try:
+            return AnnotatedVertical(self.args.annotated, self.args.input, self.dict)
+        except AnnotatedVerticalInvalidFile:
+            pass
+        
+        logging.info("začátek vytváření anotovaného vertikálu: "+self.args.annotated)
+        
+        lemPosExt=Lemmatizer(self.dict, self.lemmatizerCacheSize, self.lemmatizerCacheFile)
+        writer=AnnotatedVerticalWriter(self.args.annotated, self.args.input, self.dict)
+        self.__preprocessLines(RemoveWords(), lemPosExt, None, writer, True)
+        writer.close()
+        lemPosExt.logCacheStats()
+        lemPosExt.saveCache()
+        
+        logging.info("konec vytváření anotovaného vertikálu: "+self.args.annotated)
+        
+        return AnnotatedVertical(self.args.annotated, self.args.input, self.dict)
+    
+    def __preprocessAnnotated(self, vertical, WordsRemover, onlyPos):
+        """
+        Předzpracování řádků z anotovaného vertikálu. Výsledek je zapisován do stdout.
+        
+        :param vertical: AnnotatedVertical -- anotovaný vertikál vstupního souboru
+        :param WordsRemover: RemoveWords -- Používá se pro odstraňování nevhodných slov.
+        :param onlyPos: set|None -- obsahující slovní druhy pro extrakci
+        """
+        self.logType=0
+        p=PreprocessingWorker(linesForPreprocessing=None, fileToRead=self.args.input,
+                              results=None, args=self.args, wordsRemover=WordsRemover, 
+                              lemPosExt=None, onlyPos=onlyPos, errorBoard=None)
+        output=ReorderBuffer()
+        
+        self.lineNumber=0
+        partsCounter=0
+        for lineCnt, isLastPart, tokens in self.readAnnotatedParts(vertical):
+            if isLastPart:
+                self.lineNumber=lineCnt+1
+                self.logInfo()
+                pEnd='\n'
+            elif len(tokens)<1:
+                pEnd=''
+            else:
+                pEnd=' '
                 
-        logging.info("konec předzpracování")
+            output.put(partsCounter, *p.preprocessPart(tokens, pEnd))
+            partsCounter+=1
+            
+        output.flush()
         
+    def readAnnotatedParts(self, vertical):
+        """
+        Čte řádky z anotovaného vertikálu a dělí je na části stejně jako readLineParts (podle počtu slov oddělených
+        bílými znaky).
+        
+        :param vertical: AnnotatedVertical -- anotovaný vertikál
+        :return: (lineCNT, isLastPartOnLine, tokeny části)
+        """
+        maxWords=self.maxNumberOfWordsPerLinePart
+        
+        for lineCnt, tokens in enumerate(vertical.lines()):
+            if len(tokens)>maxWords:
+                #začátky slov
+                starts=[i for i, t in enumerate(tokens) if t[3] or i==0]
+                partStart=0
+                for i in range(maxWords, len(starts), maxWords):
+                    yield (lineCnt, False, tokens[partStart:starts[i]])
+                    partStart=starts[i]
+                tokens=tokens[partStart:]
+                    
+            yield (lineCnt, True, tokens)
+            
     def logInfo(self):
         """
         Zobrazení logovacích informací.
@@ -644,10 +854,82 @@ class Preprocessing(object):
                 logging.info("Vypsáno "+str(self.lineNumber)+" řádků.")
             elif self.logType==1:
                 self.lastLogTime=datetime.datetime.now()
-                logging.info("Vypsáno "+str(self.docCache.getLastWritten()+1)+" řádků. Zpracovaných, ale nevypsaných částí: "+str(self.partsCounter-self.docCache.getLastWritten())+".")
+                logging.info("Vypsáno "+str(self.reorderBuffer.nextToWrite)+" částí. Zpracovávaných nebo nevypsaných částí: "+str(self.partsCounter-self.reorderBuffer.nextToWrite)+".")
                             
         
         
+    def __sendBatch(self):
+        """
+        Odešle shromážděnou dávku částí ke zpracování. Pokud máme dostatečný náskok, tak ji zpracuje sám.
+        """
+        if not self.batch:
+            return
+        
+        if self.inProcess>(self.workers-1)*2:
+            #Máme dostatečný náskok.
+            #Pomůžeme se zpracováním.
+            for res in self.forHelpingP.preprocessBatch(self.batch):
+                self.reorderBuffer.put(*res)
+        else:
+            #delegujeme
+            self.linesForPreprocessing.put(self.batch)
+            self.inProcess+=1
+            
+        self.batch=[]
+        self.batchSize=0
+        
+    def __receiveResults(self, window=None):
+        """
+        Přijme výsledky od pracujících procesů a předá je ReorderBuffer.
+        
+        :param window: Maximální počet rozpracovaných a nevypsaných částí. Dokud je dosažen, čeká se na další výsledky,
+            jinak jsou přijaty pouze výsledky, které jsou ihned k dispozici.
+            None => čeká se na výsledky všech odeslaných dávek.
+        """
+        while self.inProcess:
+            wait=window is None or self.partsCounter-self.reorderBuffer.nextToWrite>=window
+            try:
+                res=self.results.get(timeout=1) if wait else self.results.get_nowait()
+            except queue.Empty:
+                if not wait:
+                    break
+                self.controlMulPErrors()
+                self.logInfo()
+                continue
+            
+            if res[0]=="EOF":
+                #pracující proces skončil (viz __receiveWorkersEnd)
+                self.workersEnded.append(res[1])
+                continue
+            
+            processed, size, seconds=res
+            for r in processed:
+                self.reorderBuffer.put(*r)
+            self.inProcess-=1
+            
+            if seconds>0:
+                #upravíme velikost dávky podle rychlosti zpracování
+                wanted=min(max(int(size/seconds*self.BATCH_TIME), self.BATCH_MIN_SIZE), self.BATCH_MAX_SIZE)
+                self.batchLimit=(self.batchLimit+wanted)//2
+        
+    def __receiveWorkersEnd(self, lemPosExt):
+        """
+        Počká na ukončení všech pracujících procesů a sloučí jejich cache lemmatizátoru s cache lemPosExt.
+        
+        :param lemPosExt: Lemmatizer|SignsSeparator|None -- se kterým je sloučena cache pracujících procesů.
+        """
+        while len(self.workersEnded)<self.workers-1:
+            try:
+                res=self.results.get(timeout=1)
+            except queue.Empty:
+                self.controlMulPErrors()
+                continue
+            self.workersEnded.append(res[1])
+        
+        if lemPosExt is not None:
+            for state in self.workersEnded:
+                lemPosExt.mergeCache(state)
+        
     def controlMulPErrors(self):
         """
         Kontrola chyb z ostatních procesů.
@@ -659,102 +941,306 @@ class Preprocessing(object):
             exit()
             
             
-    def readLineParts(self, filename, READ_SIZE=1000000):
+    def readLineParts(self, filename, READ_SIZE=2**22, byteRange=None):
         """
         Čte vstupní soubor a dělí jej po řádcích, pokud je vstupní řádek přiliš veliký
         je dále dělen dle počtu slov na jednotlivé části.
         
+        Soubor je zpracováván po velkých blocích (viz __readBlocks), které končí na hranici řádku nebo slova.
+        Blok je rozdělen na řádky a řádky na slova (str.split), takže se nepracuje se znaky jednotlivě.
+        Řádky, o kterých je známo, že již jsou ve tvaru " ".join(line.split()), jsou vráceny bez dělení na slova.
+        
         :param filename: Cesta k souboru
         :type READ_SIZE: int 
-        :param READ_SIZE: Volitelný. Kolik znaků bude maximálně naráz získáno ze souboru.
+        :param READ_SIZE: Volitelný. Kolik bajtů/znaků bude maximálně naráz získáno ze souboru.
+        :param byteRange: Volitelný. (začátek, konec) -- čte pouze daný rozsah bajtů (viz shardRange).
+            Čísla řádků jsou relativní k začátku rozsahu.
         :return: (lineCNT, isLastPartOnLine, part)
         """
         
-        class AutomatonStates(object):
-            START = 1
-            WORD = 2
-            SEARCH_NEXT_WORD=3
-
-        lineCnt=0
-      
-        part=[""]
-      
-        state=AutomatonStates.START
+        maxWords=self.maxNumberOfWordsPerLinePart
         
+        lineCnt=0
+        pending=[]  #slova aktuálního řádku z předchozích bloků, která ještě nebyla vrácena
         
-        with open(filename, "r") as fInput:
-            sr=fInput.read(READ_SIZE)
-
-            while sr!='':
+        for text, normalized in self.__readBlocks(filename, READ_SIZE, byteRange):
+            lines=text.split("\n")
+            
+            #text za posledním znakem konce řádku (řádek pokračuje v dalším bloku)
+            tail=lines.pop()
+            
+            for line in lines:
+                if normalized and not pending and (len(line)<=2*maxWords or line.count(" ")<maxWords):
+                    #řádek je již rozdělen jednou mezerou a nemá příliš mnoho slov
+                    yield (lineCnt, True, line)
+                    lineCnt+=1
+                    continue
+                
+                words=line.split()
+                if pending:
+                    pending.extend(words)
+                    words=pending
+                    pending=[]
+                
                 i=0
-                while i<len(sr):
-                    c=sr[i]
-                    i+=1
-                    #čteme po znacích
-                    if state==AutomatonStates.WORD:
-                        #čteme slovo
-                        
-                        if c.isspace():
-                            if c=="\n":
-                                #konec slova vlivem konce řádku
-                                state=AutomatonStates.START
-                                yield(lineCnt, True, " ".join(part))
-                                lineCnt+=1
-                                part=[""]
-                            else:
-                                #konec slova vlivem bílého znaku
-                                #zkusíme zjistit, zda-li za tímto slovem leží na tomto řádku i další slovo
-                                state=AutomatonStates.SEARCH_NEXT_WORD
-                        else:
-                            #další znak slova
-                            part[-1]+=c
-                            
-                    elif state==AutomatonStates.START:
-                        #čekáme na slovo nebo konec řádku
-                        if c=="\n":
-                            #konec řádku
-                            yield(lineCnt, True, " ".join(part))
-                            lineCnt+=1
-                            part=[""]
-                        elif not c.isspace():
-                            #začátek slova
-                            state=AutomatonStates.WORD
-                            part[-1]+=c
-
+                while len(words)-i>maxWords:
+                    #máme již příliš mnoho slov
+                    yield (lineCnt, False, " ".join(words[i:i+maxWords]))
+                    i+=maxWords
                     
-                            
-                    elif state==AutomatonStates.SEARCH_NEXT_WORD:
-                        #skončili jsme se čtením slova a jsme zvědaví zda-li se na řádku nachází další
-                        
-                        if c.isspace():
-                            if c=="\n":
-                                #již žádné slovo na řádku není
-                                state=AutomatonStates.START
-                                yield(lineCnt, True, " ".join(part))
-                                lineCnt+=1
-                                part=[""]
-                            else:
-                                #vynecháme bílé znaky
-                                pass
-                        else:
-                            state=AutomatonStates.WORD
-                            #našli jsme slovo
-                            if len(part)>=self.maxNumberOfWordsPerLinePart:
-                                #máme již příliš mnoho slov
-                                yield(lineCnt, False, " ".join(part))
-                                #přidáme nové slovo
-                                part=[c]
-                            else:
-                                #přidáme další nové slovo
-                                part.append(c)
-                
-                #další data
-                sr=fInput.read(READ_SIZE)
-            
-            #poslední part
-            part=" ".join(part)
-            if len(part)>0:
-                yield(lineCnt, True, part)
+                yield (lineCnt, True, " ".join(words[i:]) if i else " ".join(words))
+                lineCnt+=1
+            
+            pending.extend(tail.split())
+            i=0
+            while len(pending)-i>maxWords:
+                yield (lineCnt, False, " ".join(pending[i:i+maxWords]))
+                i+=maxWords
+            if i:
+                pending=pending[i:]
+            
+        #poslední part
+        if pending:
+            yield (lineCnt, True, " ".join(pending))
+    
+    def readSegmentsLineParts(self, filename, byteRange, committedEnd, segmentSize):
+        """
+        Čte rozsah bajtů vstupního souboru jako readLineParts, ale po úsecích o přibližně segmentSize bajtech, které
+        končí na hranici řádku. Za každým úsekem do committedEnd je vrácena značka konce úseku. Zbytek rozsahu za
+        committedEnd (neukončený poslední řádek) je přečten bez značky.
+        
+        :param filename: Cesta k souboru
+        :param byteRange: (začátek, konec) -- rozsah bajtů
+        :param committedEnd: Offset (hranice řádku v rozsahu), do kterého jsou vraceny značky konců úseků.
+        :param segmentSize: Přibližná velikost úseku v bajtech.
+        :return: (lineCNT, isLastPartOnLine, part) -- čísla řádků jsou relativní k začátku rozsahu.
+            Značka konce úseku je (None, offset konce úseku, None).
+        """
+        start, end=byteRange
+        lines=0
+        
+        with BlockCompressedFile.open(filename, "rb") as fInput:
+            while start<end:
+                segmentEnd=min(self.lineBoundary(fInput, start+segmentSize), committedEnd) if start<committedEnd else end
+                
+                lineCnt=-1
+                for lineCnt, isLastPart, part in self.readLineParts(filename, byteRange=(start, segmentEnd)):
+                    yield (lines+lineCnt, isLastPart, part)
+                lines+=lineCnt+1
+                
+                if segmentEnd<=committedEnd:
+                    yield (None, segmentEnd, None)
+                start=segmentEnd
+    
+    #bílé znaky (str.isspace) v utf-8 kromě mezery a znaku konce řádku
+    __ASCII_WHITESPACES=b"\t\r\x0b\x0c\x1c\x1d\x1e\x1f"
+    __UNICODE_WHITESPACES=re.compile(rb"\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80")
+    __WHITESPACES_TABLE=bytes.maketrans(__ASCII_WHITESPACES, b"\t"*len(__ASCII_WHITESPACES))
+    
+    def __readBlocks(self, filename, READ_SIZE, byteRange=None):
+        """
+        Čte vstupní soubor po blocích. Každý blok končí znakem konce řádku, bílým znakem nebo koncem souboru, takže žádné
+        slovo není rozděleno mezi dva bloky. Konce řádků jsou převedeny stejně jako při čtení v textovém režimu
+        (\\r\\n a \\r na \\n).
+        
+        Pro utf-8 je soubor čten binárně a u každého bloku je (bez dekódování) zjištěno, zda-li jsou všechny jeho řádky
+        již ve tvaru " ".join(line.split()).
+        
+        :param filename: Cesta k souboru
+        :param READ_SIZE: Kolik bajtů/znaků bude maximálně naráz získáno ze souboru.
+        :param byteRange: (začátek, konec) -- čte pouze daný rozsah bajtů. None => celý soubor.
+        :return: (text bloku, bool True => všechny řádky bloku jsou již rozděleny jednou mezerou)
+        """
+        if codecs.lookup(locale.getpreferredencoding(False)).name!="utf-8":
+            #obecné kódování, čteme v textovém režimu
+            with self.__openInput(filename, False, byteRange) as fInput:
+                carry=""
+                while True:
+                    sr=fInput.read(READ_SIZE)
+                    block=carry+sr
+                    carry=""
+                    if sr=="":
+                        if block:
+                            yield (block, False)
+                        return
+                    
+                    cut=block.rfind("\n")
+                    if cut==-1:
+                        #dlouhý řádek, rozdělíme na posledním bílém znaku
+                        cut=len(block)-1 if block[-1].isspace() else len(block)-len(block.split()[-1])-1
+                        if cut==-1:
+                            carry=block
+                            continue
+                    carry=block[cut+1:]
+                    yield (block[:cut+1], False)
+        
+        with self.__openInput(filename, True, byteRange) as fInput:
+            carry=b""
+            while True:
+                data=fInput.read(READ_SIZE)
+                eof=not data
+                block=carry+data
+                carry=b""
+                
+                if not eof and block.endswith(b"\r"):
+                    #může následovat \n
+                    carry=b"\r"
+                    block=block[:-1]
+                    
+                if b"\r" in block:
+                    block=block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+                
+                if not eof:
+                    cut=block.rfind(b"\n")
+                    if cut==-1:
+                        #dlouhý řádek, rozdělíme na posledním bílém znaku
+                        cut=max(block.rfind(w) for w in (b" ",)+tuple(bytes([w]) for w in self.__ASCII_WHITESPACES))
+                        if cut==-1:
+                            carry=block+carry
+                            continue
+                    carry=block[cut+1:]+carry
+                    block=block[:cut+1]
+                
+                if block:
+                    yield (block.decode("utf-8"), self.__normalizedBlock(block))
+                    
+                if eof:
+                    return
+                
+    @staticmethod
+    def __openInput(filename, binary, byteRange):
+        """
+        Otevře vstupní soubor pro čtení.
+        
+        :param filename: Cesta k souboru
+        :param binary: True => binární režim, False => textový režim
+        :param byteRange: (začátek, konec) -- zpřístupní pouze daný rozsah bajtů. None => celý soubor.
+        :return: Otevřený soubor.
+        """
+        if byteRange is None:
+            return BlockCompressedFile.open(filename, "rb" if binary else "r")
+        
+        fInput=io.BufferedReader(ByteRangeReader(BlockCompressedFile.open(filename, "rb"), *byteRange))
+        return fInput if binary else io.TextIOWrapper(fInput)
+    
+    @staticmethod
+    def shardRange(filename, shard, shards):
+        """
+        Určí rozsah bajtů daného dílu vstupního souboru. Soubor je rozdělen na shards přibližně stejně velkých dílů
+        na hranicích řádků. Řádek patří do dílu, ve kterém začíná. Díly jsou tedy nezávislé a zřetězením
+        jejich výstupů vznikne stejný výstup jako při zpracování celého souboru.
+        U komprimovaného souboru jde o offsety v dekomprimovaných datech.
+        
+        :param filename: Cesta k souboru
+        :param shard: Pořadové číslo dílu (od 1).
+        :param shards: Celkový počet dílů.
+        :return: (začátek, konec) -- konec je offset bajtu za posledním bajtem dílu
+        """
+        with BlockCompressedFile.open(filename, "rb") as fInput:
+            size=fInput.seek(0, io.SEEK_END)
+            return (__class__.lineBoundary(fInput, (shard-1)*size//shards),
+                    __class__.lineBoundary(fInput, shard*size//shards))
+    
+    @staticmethod
+    def lineBoundary(fInput, offset):
+        """
+        Najde začátek prvního řádku, který začíná na daném offsetu nebo za ním.
+        
+        :param fInput: Binární soubor s podporou seek.
+        :param offset: Offset v souboru.
+        :return: Offset začátku řádku. Velikost souboru, pokud za offsetem již žádný řádek nezačíná.
+        """
+        if offset<=0:
+            return 0
+        
+        fInput.seek(offset-1)
+        while True:
+            line=fInput.readline(2**20)    #dlouhý řádek nenačítáme celý naráz
+            if not line or line.endswith(b"\n"):
+                return fInput.tell()
+    
+    @staticmethod
+    def __lastLineStart(fInput, start, end):
+        """
+        Najde v rozsahu bajtů začátek posledního řádku, který není ukončen znakem konce řádku.
+        
+        :param fInput: Binární soubor s podporou seek.
+        :param start: Začátek rozsahu.
+        :param end: Konec rozsahu.
+        :return: Offset začátku neukončeného řádku. Konec rozsahu, pokud je poslední řádek ukončen.
+        """
+        blockEnd=end
+        while blockEnd>start:
+            blockStart=max(start, blockEnd-2**20)
+            fInput.seek(blockStart)
+            pos=fInput.read(blockEnd-blockStart).rfind(b"\n")
+            if pos!=-1:
+                return blockStart+pos+1
+            blockEnd=blockStart
+            
+        return start
+        
+    def mergeShards(self, shardsOutputs, output=None):
+        """
+        Zřetězí výstupy dílů (viz shardRange) ve správném pořadí. Před zápisem ověří, že každý výstup
+        má stejný počet řádků jako jemu odpovídající díl vstupního souboru, aby byla zachována zarovnanost
+        s metadaty.
+        
+        :param shardsOutputs: list -- cesty k výstupům dílů seřazené podle pořadových čísel dílů
+        :param output: Kam zapsat výsledek (textový soubor). None => stdout.
+        :raises PreprocessingShardsException: Výstup některého z dílů neodpovídá dílu vstupního souboru.
+        """
+        output=sys.stdout if output is None else output
+        
+        logging.info("začátek slučování dílů")
+        for shard, shardOutput in enumerate(shardsOutputs):
+            byteRange=self.shardRange(self.args.input, shard+1, len(shardsOutputs))
+            inputLines=sum(1 for _, isLastPart, _ in self.readLineParts(self.args.input, byteRange=byteRange) if isLastPart)
+            
+            outputLines=0
+            lastChar=b"\n"
+            with open(shardOutput, "rb") as f:
+                for block in iter(lambda: f.read(2**22), b""):
+                    outputLines+=block.count(b"\n")
+                    lastChar=block[-1:]
+            
+            if inputLines!=outputLines or lastChar!=b"\n":
+                raise PreprocessingShardsException("Výstup dílu "+str(shard+1)+"/"+str(len(shardsOutputs))+" ("+shardOutput
+                                                   +") má "+str(outputLines)+" řádků, ale díl vstupního souboru jich má "
+                                                   +str(inputLines)+".")
+            
+        output.flush()
+        for shardOutput in shardsOutputs:
+            with open(shardOutput, "rb") as f:
+                for block in iter(lambda: f.read(2**22), b""):
+                    output.buffer.write(block)
+        output.flush()
+        logging.info("konec slučování dílů")
+        
+    @classmethod
+    def __normalizedBlock(cls, block):
+        """
+        Zjistí, zda-li jsou všechny řádky bloku ve tvaru " ".join(line.split()).
+        
+        :param block: bytes -- blok v utf-8 (bez \\r)
+        :return: bool
+        """
+        chars=np.frombuffer(block, dtype=np.uint8)
+        spaces=chars==ord(" ")
+        newLines=chars==ord("\n")
+        #mezera na začátku řádku, více mezer za sebou nebo mezera na konci řádku
+        if spaces[0] or np.any(spaces[1:] & (spaces[:-1] | newLines[:-1])) or np.any(newLines[1:] & spaces[:-1]):
+            return False
+        
+        if block.translate(cls.__WHITESPACES_TABLE).find(b"\t")!=-1:
+            return False
+        
+        if (b"\xc2" in block or b"\xe1" in block or b"\xe2" in block or b"\xe3" in block) and \
+            cls.__UNICODE_WHITESPACES.search(block) is not None:
+            return False
+        
+        #mezera na konci bloku bez konce řádku (dlouhý řádek) je v pořádku, řádek pokračuje
+        return True
         
             
         
@@ -848,7 +1334,273 @@ class RemoveWords(object):
 class LemmatizerException(Exception):
     pass
 
-class Lemmatizer(object):
+class MorphoDictionaries(object):
+    """
+    Sdílený registr slovníků morphodity. Každý slovník je v rámci procesu načten nejvýše jednou a to až při prvním
+    požadavku. Pracující procesy vytvořené pomocí fork jej dědí od rodiče.
+    """
+    
+    __dictionaries={}   #cesta ke slovníku -> Morpho
+    
+    @classmethod
+    def get(cls, dictMorpho):
+        """
+        Získá slovník morphodity. Pokud ještě nebyl načten, tak jej načte.
+        
+        :param dictMorpho: Cesta k souboru se slovníkem morphodity.
+        :returns: Morpho|None -- None => slovník nelze načíst
+        """
+        key=os.path.realpath(dictMorpho)
+        morpho=cls.__dictionaries.get(key)
+        if morpho is None:
+            logging.info("načítám slovník morphodity: "+dictMorpho)
+            morpho=Morpho.load(dictMorpho)
+            if morpho is not None:
+                cls.__dictionaries[key]=morpho
+                
+        return morpho
+
+class LemmatizerCache(object):
+    """
+    Omezená cache výsledků morfologické analýzy slovních tvarů (tvar -> (lemma, slovní druh)).
+    Při zaplnění jsou odstraňovány nejdéle nepoužité tvary (LRU).
+
+    Cache lze uložit do souboru a při dalším spuštění z něj načíst (předehřátí). Uložená cache je platná pouze
+    pro stejný slovník morphodity (porovnává se velikost a čas poslední modifikace slovníku).
+    """
+
+    VERSION=1
+
+    def __init__(self, maxSize, dictMorpho=None, cacheFile=None):
+        """
+        Inicializace cache. Pokud je zadán soubor s uloženou cache, tak je načten.
+
+        :param maxSize: Maximální počet tvarů v cache.
+        :param dictMorpho: Cesta k souboru se slovníkem morphodity, pro který cache platí.
+        :param cacheFile: Cesta k souboru pro uložení cache. None => cache není ukládána.
+        """
+        self.maxSize=maxSize
+        self.cacheFile=cacheFile
+        self.dictIdentity=None
+        if dictMorpho is not None:
+            st=os.stat(dictMorpho)
+            self.dictIdentity=[st.st_size, st.st_mtime_ns]
+
+        self.hits=0
+        self.misses=0
+        self.__forms=OrderedDict()
+
+        if self.cacheFile is not None:
+            self.load()
+
+    def __len__(self):
+        """
+        Počet tvarů v cache.
+        """
+        return len(self.__forms)
+
+    def get(self, form):
+        """
+        Získá výsledek analýzy tvaru z cache.
+
+        :param form: str -- slovní tvar
+        :returns: tuple|None -- (lemma, slovní druh). None => tvar není v cache.
+        """
+        res=self.__forms.get(form)
+        if res is None:
+            self.misses+=1
+        else:
+            self.hits+=1
+            self.__forms.move_to_end(form)
+        return res
+
+    def put(self, form, analysis):
+        """
+        Vloží výsledek analýzy tvaru do cache.
+
+        :param form: str -- slovní tvar
+        :param analysis: tuple -- (lemma, slovní druh)
+        """
+        self.__forms[form]=analysis
+        if len(self.__forms)>self.maxSize:
+            self.__forms.popitem(last=False)
+
+    def hitRate(self):
+        """
+        Podíl dotazů, které byly nalezeny v cache.
+
+        :returns: float -- 0..1
+        """
+        total=self.hits+self.misses
+        return self.hits/total if total else 0.0
+
+    def statsInfo(self):
+        """
+        Statistiky cache pro logování.
+
+        :returns: str
+        """
+        return "cache lemmatizátoru: "+str(len(self))+" tvarů, zásahy: "+str(self.hits)+", výpadky: "+str(self.misses)+\
+            ", úspěšnost: "+"{:.2%}".format(self.hitRate())
+
+    def state(self):
+        """
+        Obsah a statistiky cache pro sloučení s cache jiného procesu (viz merge).
+
+        :returns: (list [tvar, lemma, slovní druh] od nejdéle nepoužitého, zásahy, výpadky)
+        """
+        return ([[form, lemma, pos] for form, (lemma, pos) in self.__forms.items()], self.hits, self.misses)
+
+    def merge(self, state):
+        """
+        Sloučí cache s cache jiného procesu. Tvary jiného procesu jsou vloženy jako naposledy použité
+        a statistiky jsou sečteny.
+
+        :param state: Stav cache jiného procesu (viz state).
+        """
+        forms, hits, misses=state
+        for form, lemma, pos in forms:
+            self.__forms.pop(form, None)
+            self.put(form, (lemma, pos))
+
+        self.hits+=hits
+        self.misses+=misses
+
+    def load(self):
+        """
+        Načte (předehřeje) cache ze souboru. Neplatný nebo neexistující soubor je ignorován.
+        """
+        try:
+            with open(self.cacheFile, "r", encoding="utf-8") as f:
+                stored=json.load(f)
+        except (IOError, ValueError):
+            return
+
+        if not isinstance(stored, dict) or stored.get("version")!=self.VERSION or stored.get("dict")!=self.dictIdentity:
+            logging.info("uložená cache lemmatizátoru neodpovídá slovníku: "+self.cacheFile)
+            return
+
+        #uloženo od nejdéle nepoužitého
+        for form, lemma, pos in stored["forms"][-self.maxSize:]:
+            self.__forms[form]=(lemma, pos)
+
+        logging.info("načtena cache lemmatizátoru ("+str(len(self))+" tvarů): "+self.cacheFile)
+
+    def save(self):
+        """
+        Uloží cache do souboru. Tvary z již uloženého souboru, které nejsou v cache, jsou zachovány
+        (mají nižší prioritu), takže se do souboru mohou postupně ukládat cache více běhů (například dílů).
+        """
+        if self.cacheFile is None:
+            return
+
+        forms=OrderedDict()
+        try:
+            with open(self.cacheFile, "r", encoding="utf-8") as f:
+                stored=json.load(f)
+            if isinstance(stored, dict) and stored.get("version")==self.VERSION and stored.get("dict")==self.dictIdentity:
+                for form, lemma, pos in stored["forms"]:
+                    forms[form]=(lemma, pos)
+        except (IOError, ValueError):
+            pass
+
+        for form, analysis in self.__forms.items():
+            forms.pop(form, None)
+            forms[form]=analysis
+
+        while len(forms)>self.maxSize:
+            forms.popitem(last=False)
+
+        tmpFile=self.cacheFile+".tmp"+str(os.getpid())
+        try:
+            with open(tmpFile, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "dict": self.dictIdentity,
+                           "forms": [[form, lemma, pos] for form, (lemma, pos) in forms.items()]}, f, ensure_ascii=False)
+            os.replace(tmpFile, self.cacheFile)
+        except (IOError, OSError):
+            logging.info("cache lemmatizátoru nelze uložit: "+self.cacheFile)
+            if os.path.isfile(tmpFile):
+                os.remove(tmpFile)
+
+class SignsSeparator(object):
+    """
+    Oddělení znaků od slov (např. ,.:;?!) pouze pomocí tokenizátoru morphodity, bez morfologické analýzy.
+    
+    Pokud je k dispozici slovník morphodity, tak je použit jeho tokenizátor (viz dictionaryTokenizer), aby výsledek
+    odpovídal lemmatizaci a anotovanému vertikálu. Jinak je použit český tokenizátor, který slovník nepotřebuje.
+    Oproti tokenizátoru ze slovníku pouze neslučuje slova se spojovníkem podle slovníku (například Rakousko-Uhersko
+    je rozděleno na tři tokeny).
+    """
+    
+    def __init__(self, tokenizer=None):
+        """
+        Konstrukce objektu.
+        
+        :param tokenizer: Tokenizátor morphodity. None => český tokenizátor bez slovníku.
+        """
+        self.tokenizer=Tokenizer.newCzechTokenizer() if tokenizer is None else tokenizer
+        self.forms = Forms()
+        self.tokens = TokenRanges()
+        
+    @staticmethod
+    def dictionaryTokenizer(dictMorpho):
+        """
+        Vytvoří tokenizátor ze slovníku morphodity.
+        
+        :param dictMorpho: Cesta k souboru se slovníkem morphodity.
+        :returns: Tokenizátor morphodity.
+        :raises LemmatizerException: Nevalidní slovník, nebo pro něj není definovaný tokenizer.
+        """
+        morpho=MorphoDictionaries.get(dictMorpho)
+        if morpho is None:
+            raise LemmatizerException("Chybný DICT.")
+        tokenizer = morpho.newTokenizer()
+        if tokenizer is None:
+            raise LemmatizerException("Není definovaný tokenizer pro dodaný model.")
+        
+        return tokenizer
+        
+    def tokenize(self, text):
+        """
+        Rozdělí text na tokeny (slova a znaky).
+        
+        :param text: Text pro zpracování.
+        :returns:  list -- tokenů
+        """
+        self.tokenizer.setText(text)
+        words=[]
+        while self.tokenizer.nextSentence(self.forms, self.tokens):
+            words.extend(self.forms)
+            
+        return words
+    
+    def cacheState(self):
+        """
+        Tokenizace nepoužívá cache.
+        
+        :returns: None
+        """
+        return None
+    
+    def mergeCache(self, state):
+        """
+        Tokenizace nepoužívá cache, není co slučovat.
+        """
+        pass
+    
+    def logCacheStats(self):
+        """
+        Tokenizace nepoužívá cache, není co logovat.
+        """
+        pass
+    
+    def saveCache(self):
+        """
+        Tokenizace nepoužívá cache, není co ukládat.
+        """
+        pass
+
+class Lemmatizer(SignsSeparator):
     """
     Třída pro lemmatizaci slov a extrakci vybraných slovních druhů. Používá nástroj morphodita.
 
@@ -879,29 +1631,76 @@ class Lemmatizer(object):
         10 : "I"
         }
     
-    def __init__(self, dictMorpho):
+    def __init__(self, dictMorpho, cacheSize=0, cacheFile=None):
         """
         Konstrukce objektu.
         
         :param dictMorpho: Cesta k souboru pro dictMorpho morphodity.
+        :param cacheSize: Maximální počet slovních tvarů v cache výsledků analýzy. 0 => bez cache.
+        :param cacheFile: Cesta k souboru, do kterého je cache ukládána a ze kterého je předehřáta. None => neukládá se.
         :raises LemmatizerException: Když není definovaný tokenizer pro dodaný model. Nebo nevalidní slovník.
         """
 
-        self.morpho=Morpho.load(dictMorpho)
-        if self.morpho is None:
-            raise LemmatizerException("Chybný DICT.")
-        self.tokenizer = self.morpho.newTokenizer()
-        if self.tokenizer is None:
-            raise LemmatizerException("Není definovaný tokenizer pro dodaný model.")
-
+        super(Lemmatizer, self).__init__(self.dictionaryTokenizer(dictMorpho))
+        self.morpho=MorphoDictionaries.get(dictMorpho)
         
-        self.forms = Forms()
-        self.tokens = TokenRanges()
         self.lemmas = TaggedLemmas()
         self.converter=TagsetConverter.newPdtToConll2009Converter()
         
+        self.cache=LemmatizerCache(cacheSize, dictMorpho, cacheFile) if cacheSize>0 else None
+        
+    def analyze(self, word):
+        """
+        Morfologická analýza jednoho slovního tvaru. Výsledek je brán z cache, pokud je k dispozici.
+        
+        :param word: str -- slovní tvar
+        :returns: tuple -- (lemma, slovní druh)
+        """
+        if self.cache is not None:
+            res=self.cache.get(word)
+            if res is not None:
+                return res
+        
+        self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
+        pos=self.lemmas[0].tag[0]
+        self.converter.convert(self.lemmas[0])
+        res=(self.lemmas[0].lemma, pos)
+        
+        if self.cache is not None:
+            self.cache.put(word, res)
+            
+        return res
+    
+    def cacheState(self):
+        """
+        Stav cache pro předání rodičovskému procesu (viz mergeCache).
         
+        :returns: tuple|None -- stav cache (viz LemmatizerCache.state). None => bez cache.
+        """
+        return self.cache.state() if self.cache is not None else None
+    
+    def mergeCache(self, state):
+        """
+        Sloučí cache s cache pracujícího procesu.
         
+        :param state: tuple|None -- stav cache pracujícího procesu (viz cacheState).
+        """
+        if self.cache is not None and state is not None:
+            self.cache.merge(state)
+    
+    def logCacheStats(self):
+        """
+        Zaloguje statistiky cache.
+        """
+        if self.cache is not None:
+            logging.info(self.cache.statsInfo())
+    
+    def saveCache(self):
+        """
+        Uloží cache, pokud je nastaven soubor pro uložení.
+        """
+        if self.cache is not None:
+            self.cache.save()
 
     def lemmatize(self, text):
         """
@@ -914,12 +1713,28 @@ class Lemmatizer(object):
         words=[]
         while self.tokenizer.nextSentence(self.forms, self.tokens):
             for word in self.forms:
-                self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
-                self.converter.convert(self.lemmas[0])
-                words.append(self.lemmas[0].lemma)
+                words.append(self.analyze(word)[0])
             
         return words
     
+    def annotate(self, text):
+        """
+        Tokenizace a morfologická analýza textu pro anotovaný vertikál.
+        
+        :param text: Text pro zpracování.
+        :returns:  str -- anotované tokeny v textové podobě (viz AnnotatedVertical)
+        """
+        self.tokenizer.setText(text)
+        annotated=[]
+        end=None
+        while self.tokenizer.nextSentence(self.forms, self.tokens):
+            for word, token in zip(self.forms, self.tokens):
+                lemma, pos=self.analyze(word)
+                annotated.append((" " if end is None or token.start>end else "")+word+"\t"+lemma+"\t"+pos+"\t")
+                end=token.start+token.length
+                
+        return "".join(annotated)
+    
     def getWordsPOS(self, text):
         """
         Získá slovní druhy k jednotlivým slovům v parametru text.
@@ -932,8 +1747,7 @@ class Lemmatizer(object):
         words=[]
         while self.tokenizer.nextSentence(self.forms, self.tokens):
             for word in self.forms:
-                self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
-                words.append((word, self.lemmas[0].tag[0]))
+                words.append((word, self.analyze(word)[1]))
                     
         return words
         
@@ -952,17 +1766,17 @@ class Lemmatizer(object):
         
         while self.tokenizer.nextSentence(self.forms, self.tokens):
             for word in self.forms:
-                self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
-                if self.lemmas[0].tag[0] in only:
+                lemma, pos=self.analyze(word)
+                if pos in only:
                     if lemmatized:
-                        self.converter.convert(self.lemmas[0])
-                        words.append(self.lemmas[0].lemma)
+                        words.append(lemma)
                     else:
                         words.append(word)
  
         return words
     
-    def translateNumericPOS(self, POS):
+    @classmethod
+    def translateNumericPOS(cls, POS):
         """
         Přeloží slovní druh z číselné reprezentace do příslušné značky slovního druhu.
         
@@ -976,8 +1790,8 @@ class Lemmatizer(object):
             except ValueError:
                 pass
             
-            if x in self.__class__.__POSTranslaterNum:
-                translated.append(self.__class__.__POSTranslaterNum[x])
+            if x in cls.__POSTranslaterNum:
+                translated.append(cls.__POSTranslaterNum[x])
             else:
                 translated.append(x)
                 
@@ -0,0 +1,138 @@
+# -*- coding: UTF-8 -*-
+"""
+Obsahuje třídu pro kontrolní body předzpracování do výstupního souboru.
+
+:author:     Martin Dočekal
+:contact:    xdocek09@stud.fit.vubtr.cz
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from ..utils.BlockCompressedFile import BlockCompressedFile
+
+class PreprocessingCheckpoint(object):
+    """
+    Kontrolní bod předzpracování do výstupního souboru.
+
+    Je uložen ve formátu json vedle výstupního souboru (výstupní soubor + EXTENSION) a obsahuje offset ve vstupním
+    souboru, od kterého se pokračuje (vždy začátek řádku), počet již vypsaných řádků, offset ve výstupním souboru,
+    za kterým je výstup zahozen a znovu vytvořen, a příznak dokončení běhu. Dále obsahuje velikost, čas poslední
+    modifikace a hash konce zpracované části vstupního souboru, aby bylo možné poznat, že vstupní soubor byl
+    od posledního běhu pouze rozšířen o další řádky.
+    """
+
+    EXTENSION=".checkpoint"
+    VERSION=1
+    TAIL_SIZE=4096     #kolik bajtů před offsetem ve vstupním souboru je použito pro kontrolu, jestli byl pouze rozšířen
+
+    def __init__(self, outputFile, inputFile, settings):
+        """
+        Inicializace.
+
+        :param outputFile: Cesta k výstupnímu souboru.
+        :param inputFile: Cesta ke vstupnímu souboru.
+        :param settings: str -- nastavení předzpracování. Pokud se liší od nastavení uloženého kontrolního bodu,
+            je kontrolní bod neplatný.
+        """
+        self.outputFile=outputFile
+        self.inputFile=inputFile
+        self.checkpointFile=outputFile+self.EXTENSION
+        self.settings=settings
+
+    def load(self, incremental=False):
+        """
+        Načte kontrolní bod, od kterého lze pokračovat.
+
+        Pokud se vstupní soubor od uložení kontrolního bodu změnil, tak je kontrolní bod platný pouze
+        v inkrementálním režimu a to jen tehdy, když byl vstupní soubor pouze rozšířen.
+
+        :param incremental: True => inkrementální režim
+        :returns: dict|None -- None => neexistuje, nebo není platný
+        """
+        try:
+            with open(self.checkpointFile, "r", encoding="utf-8") as f:
+                stored=json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if not isinstance(stored, dict) or stored.get("version")!=self.VERSION or stored.get("settings")!=self.settings:
+            logging.info("kontrolní bod neodpovídá nastavení předzpracování: "+self.checkpointFile)
+            return None
+
+        try:
+            if os.path.getsize(self.outputFile)<stored["outputOffset"]:
+                logging.info("výstupní soubor je kratší než v kontrolním bodu: "+self.outputFile)
+                return None
+        except OSError:
+            return None
+
+        if stored["input"]!=self.__inputFileIdentity():
+            if not incremental or not self.__onlyAppended(stored):
+                logging.info("vstupní soubor se od kontrolního bodu změnil: "+self.inputFile)
+                return None
+            stored["finished"]=False
+
+        return stored
+
+    def save(self, inputOffset, lines, outputOffset, finished=False):
+        """
+        Uloží kontrolní bod. Výstupní soubor musí být do outputOffset již zapsán na disk.
+
+        :param inputOffset: Offset ve vstupním souboru, od kterého se pokračuje (začátek řádku).
+        :param lines: Počet řádků výstupu před outputOffset.
+        :param outputOffset: Offset ve výstupním souboru odpovídající inputOffset.
+        :param finished: True => vstupní soubor byl celý zpracován
+        """
+        stored={"version": self.VERSION, "settings": self.settings, "input": self.__inputFileIdentity(),
+                "tail": self.__tailHash(inputOffset), "inputOffset": inputOffset, "lines": lines,
+                "outputOffset": outputOffset, "finished": finished}
+
+        tmpFile=self.checkpointFile+".tmp"+str(os.getpid())
+        with open(tmpFile, "w", encoding="utf-8") as f:
+            json.dump(stored, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpFile, self.checkpointFile)
+
+    def __onlyAppended(self, stored):
+        """
+        Zjistí, jestli byl vstupní soubor od uložení kontrolního bodu pouze rozšířen o další řádky.
+
+        :param stored: dict -- uložený kontrolní bod
+        :returns: bool -- True => stačí zpracovat připojené řádky
+        """
+        if BlockCompressedFile.isCompressed(self.inputFile):
+            return False
+
+        if os.path.getsize(self.inputFile)<stored["inputOffset"]:
+            return False
+
+        return self.__tailHash(stored["inputOffset"])==stored["tail"]
+
+    def __tailHash(self, offset):
+        """
+        Hash konce zpracované části vstupního souboru (před daným offsetem).
+
+        :param offset: Offset konce.
+        :returns: str|None -- hash, None => komprimovaný vstupní soubor
+        """
+        if BlockCompressedFile.isCompressed(self.inputFile):
+            return None
+
+        with open(self.inputFile, "rb") as f:
+            start=max(0, offset-self.TAIL_SIZE)
+            f.seek(start)
+            return hashlib.sha1(f.read(offset-start)).hexdigest()
+
+    def __inputFileIdentity(self):
+        """
+        Získá údaje identifikující verzi vstupního souboru.
+
+        :returns: list -- [velikost, čas modifikace v ns]
+        """
+        st=os.stat(self.inputFile)
+        return [st.st_size, st.st_mtime_ns]
@@ -0,0 +1,537 @@
+# -*- coding: UTF-8 -*-
+"""
+Obsahuje třídu pro čtení komprimovaných souborů (gzip, bz2, xz) s náhodným přístupem.
+
+:author:     Martin Dočekal
+:contact:    xdocek09@stud.fit.vubtr.cz
+
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+class BlockCompressedFileInvalidIndex(Exception):
+    """
+    Soubor s indexem bloků je poškozený nebo nepatří k danému komprimovanému souboru.
+    """
+    pass
+
+class BlockCompressedFile(io.RawIOBase):
+    """
+    Čtení komprimovaného souboru s náhodným přístupem (seek) podle offsetu v dekomprimovaných datech.
+
+    Soubor je posloupnost nezávisle komprimovaných bloků (členů gzip, proudů bz2 nebo xz). Takový soubor je stále
+    platným souborem daného formátu (lze jej dekomprimovat běžnými nástroji) a vytvoří jej metoda compress.
+    Soubor, který obsahuje jediný blok (běžný soubor .gz/.xz), lze také číst. Blok větší než MAX_BLOCK_SIZE však
+    není dekomprimován celý, ale postupně po částech (STREAM_CHUNK), takže efektivní je pouze postupné čtení. Při návratu
+    zpět v takovém bloku je nutné dekomprimovat blok znovu od začátku. Pro náhodný přístup je vhodné soubor převést
+    metodou compress.
+
+    Index bloků (offsety bloků v komprimovaném a dekomprimovaném souboru) je uložen vedle komprimovaného souboru
+    (soubor + EXTENSION). Hlavička obsahuje velikost a čas poslední modifikace komprimovaného souboru. Pokud neodpovídají,
+    je index vytvořen znovu jedním průchodem souborem.
+
+    Najednou je dekomprimován pouze jeden blok (nebo jeho část). Naposledy použité bloky jsou uchovávány v malé cache (CACHE_BLOCKS).
+    Pokud je soubor čten postupně, tak je další blok dekomprimován dopředu v pomocném vlákně.
+    """
+
+    EXTENSION=".bidx"
+    MAGIC=b"CPKBIDX\x00"
+    VERSION=1
+
+    #magic, verze, metoda komprese, velikost komprimovaného souboru, čas modifikace (ns), počet bloků
+    HEADER=struct.Struct("<8sIIQQQ")
+
+    #název metody -> (identifikátor v indexu, magické bajty na začátku souboru)
+    METHODS=OrderedDict([
+        ("gzip", (1, b"\x1f\x8b")),
+        ("bz2", (2, b"BZh")),
+        ("xz", (3, b"\xfd7zXZ\x00"))
+        ])
+
+    BLOCK_SIZE=2**22   #velikost nekomprimovaného bloku při vytváření souboru metodou compress
+    READ_SIZE=2**24    #kolik bajtů se bude naráz číst při vytváření indexu
+    CACHE_BLOCKS=2     #maximální počet dekomprimovaných bloků v cache
+    MAX_BLOCK_SIZE=2**26   #větší nekomprimované bloky jsou dekomprimovány postupně po částech
+    STREAM_CHUNK=2**22     #velikost části dekomprimované naráz u velkého bloku
+
+    def __init__(self, filename, persist=True):
+        """
+        Otevře komprimovaný soubor pro čtení. Pokud neexistuje index bloků, nebo je neplatný, tak jej vytvoří.
+
+        :param filename: Cesta ke komprimovanému souboru.
+        :param persist: True => pokusí se nově vytvořený index uložit vedle komprimovaného souboru.
+        """
+        super().__init__()
+
+        self.__file=None
+        self.__executor=None
+        self.__executorPid=None
+
+        self.filename=filename
+        self.indexFile=filename+self.EXTENSION
+        self.compression=self.method(filename)
+
+        if self.compression is None:
+            raise ValueError("Soubor není komprimovaný: "+filename)
+
+        try:
+            self.blocks=self.__load()
+        except (BlockCompressedFileInvalidIndex, IOError, ValueError):
+            self.blocks=self.__build()
+            if persist:
+                self.__save(self.blocks)
+
+        self.size=int(self.blocks[1][-1])
+        self.pos=0
+
+        self.__file=open(filename, "rb")
+        self.__cache=OrderedDict()    #identifikátor bloku -> dekomprimovaná data
+        self.__lastBlock=None
+        self.__prefetched=None        #(identifikátor bloku, Future)
+        self.__stream=None            #stav postupné dekomprese velkého bloku (viz __streamData)
+
+        if np.any(np.diff(self.blocks[1])>self.MAX_BLOCK_SIZE):
+            logging.warning("komprimovaný soubor obsahuje velké bloky, které lze číst pouze postupně. Pro náhodný přístup "
+                            +"jej převeďte pomocí BlockCompressedFile.compress: "+self.filename)
+
+    @classmethod
+    def method(cls, filename):
+        """
+        Zjistí metodu komprese souboru podle magických bajtů na jeho začátku.
+
+        :param filename: Cesta k souboru.
+        :returns: str|None -- název metody. None => soubor není komprimovaný.
+        """
+        with open(filename, "rb") as f:
+            start=f.read(max(len(m) for _, m in cls.METHODS.values()))
+
+        for name, (_, magic) in cls.METHODS.items():
+            if start.startswith(magic):
+                return name
+        return None
+
+    @classmethod
+    def isCompressed(cls, filename):
+        """
+        Zjistí, jestli je soubor komprimovaný.
+
+        :param filename: Cesta k souboru.
+        :returns: bool -- True => komprimovaný
+        """
+        return cls.method(filename) is not None
+
+    @classmethod
+    def open(cls, filename, mode="r", buffering=-1):
+        """
+        Otevře soubor pro čtení. Komprimovaný soubor je transparentně dekomprimován a podporuje seek
+        podle offsetu v dekomprimovaných datech. Nekomprimovaný soubor je otevřen běžně.
+
+        :param filename: Cesta k souboru.
+        :param mode: "r" textový režim | "rb" binární režim
+        :param buffering: Velikost bufferu v bajtech. -1 => výchozí
+        :returns: Souborový objekt.
+        """
+        if not cls.isCompressed(filename):
+            return open(filename, mode, buffering)
+
+        buffered=io.BufferedReader(cls(filename), buffering if buffering>0 else io.DEFAULT_BUFFER_SIZE)
+        if "b" in mode:
+            return buffered
+        return io.TextIOWrapper(buffered)
+
+    @classmethod
+    def compress(cls, source, target, method="gzip", blockSize=None):
+        """
+        Vytvoří komprimovaný soubor složený z nezávisle komprimovaných bloků a jeho index.
+        Bloky končí na hranicích řádků (pokud řádek není delší než velikost bloku).
+
+        :param source: Cesta ke zdrojovému (nekomprimovanému) souboru.
+        :param target: Cesta k výslednému souboru.
+        :param method: Metoda komprese (gzip, bz2, xz).
+        :param blockSize: Velikost nekomprimovaného bloku v bajtech. None => BLOCK_SIZE
+        """
+        compressor={"gzip": gzip.compress, "bz2": bz2.compress, "xz": lzma.compress}[method]
+        blockSize=cls.BLOCK_SIZE if blockSize is None else blockSize
+
+        with open(source, "rb") as fSource, open(target, "wb") as fTarget:
+            rest=b""
+            written=False
+            while True:
+                data=fSource.read(blockSize)
+                block=rest+data
+                if not block:
+                    if not written:
+                        #i prázdný soubor musí obsahovat alespoň jeden blok
+                        fTarget.write(compressor(b""))
+                    break
+
+                end=block.rfind(b"\n")+1 if data else len(block)
+                if end==0:
+                    end=len(block)
+
+                fTarget.write(compressor(block[:end]))
+                written=True
+                rest=block[end:]
+
+        #index vytvoří první otevření
+        cls(target).close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Nastaví pozici v dekomprimovaných datech.
+
+        :param offset: Offset.
+        :param whence: Vztažný bod (io.SEEK_SET, io.SEEK_CUR, io.SEEK_END).
+        :returns: int -- nová pozice
+        """
+        if whence==io.SEEK_SET:
+            self.pos=offset
+        elif whence==io.SEEK_CUR:
+            self.pos+=offset
+        elif whence==io.SEEK_END:
+            self.pos=self.size+offset
+        else:
+            raise ValueError("Nevalidní hodnota whence: "+str(whence))
+
+        if self.pos<0:
+            raise ValueError("Záporná pozice v souboru.")
+        return self.pos
+
+    def readinto(self, b):
+        """
+        Přečte data od aktuální pozice.
+
+        :param b: Buffer pro přečtená data.
+        :returns: int -- počet přečtených bajtů
+        """
+        if self.pos>=self.size:
+            return 0
+
+        data, start=self.__dataAt(self.pos)
+        n=min(len(b), len(data)-start)
+        b[:n]=data[start:start+n]
+        self.pos+=n
+        return n
+
+    def line(self, offset, length=None):
+        """
+        Získá řádek začínající na daném offsetu v dekomprimovaných datech (bez znaku konce řádku).
+        Aktuální pozice pro čtení se nemění.
+
+        :param offset: int -- offset řádku
+        :param length: int -- délka řádku v bajtech (případně jen jeho požadované části). None => konec řádku je hledán.
+        :returns: bytes -- řádek
+        """
+        parts=[]
+        while offset<self.size:
+            data, start=self.__dataAt(offset)
+            if length is not None:
+                parts.append(data[start:start+length])
+                length-=len(parts[-1])
+                if length<=0:
+                    break
+                offset+=len(parts[-1])
+                continue
+
+            end=data.find(b"\n", start)
+            if end!=-1:
+                parts.append(data[start:end])
+                break
+
+            #řádek pokračuje v dalším bloku (nebo další části velkého bloku)
+            parts.append(data[start:])
+            offset+=len(data)-start
+
+        return parts[0] if len(parts)==1 else b"".join(parts)
+
+    def close(self):
+        """
+        Uzavře soubor a ukončí pomocné vlákno.
+        """
+        if not self.closed and self.__file is not None:
+            if self.__executor is not None and self.__executorPid==os.getpid():
+                self.__executor.shutdown(wait=True)
+            self.__executor=None
+            self.__file.close()
+            self.__cache.clear()
+            self.__stream=None
+        super().close()
+
+    def __dataAt(self, offset):
+        """
+        Získá dekomprimovaná data, která obsahují daný offset.
+
+        :param offset: int -- offset v dekomprimovaných datech (menší než velikost souboru)
+        :returns: (bytes, int) -- dekomprimovaný blok (nebo část velkého bloku) a pozice offsetu v něm
+        """
+        blockId=self.__blockId(offset)
+        if self.__isLarge(blockId):
+            return self.__streamData(blockId, offset)
+
+        return self.__block(blockId), offset-int(self.blocks[1][blockId])
+
+    def __isLarge(self, blockId):
+        """
+        Zjistí, jestli je blok dekomprimován postupně po částech.
+
+        :param blockId: int -- identifikátor bloku
+        :returns: bool -- True => nekomprimovaný blok je větší než MAX_BLOCK_SIZE
+        """
+        return int(self.blocks[1][blockId+1])-int(self.blocks[1][blockId])>self.MAX_BLOCK_SIZE
+
+    def __streamData(self, blockId, offset):
+        """
+        Získá část velkého bloku, která obsahuje daný offset. Blok je dekomprimován postupně od začátku,
+        v paměti je vždy pouze aktuální část. Při návratu před aktuální část je dekomprese zahájena znovu.
+
+        :param blockId: int -- identifikátor bloku
+        :param offset: int -- offset v dekomprimovaných datech
+        :returns: (bytes, int) -- část bloku a pozice offsetu v ní
+        """
+        stream=self.__stream
+        if stream is None or stream["block"]!=blockId or offset<stream["start"]:
+            stream={"block": blockId, "decompressor": self.__decompressor(), "tail": b"",
+                    "compressedPos": int(self.blocks[0][blockId]), "start": int(self.blocks[1][blockId]), "data": b""}
+            self.__stream=stream
+
+        while offset>=stream["start"]+len(stream["data"]):
+            stream["start"]+=len(stream["data"])
+            stream["data"]=b""
+            stream["data"]=self.__streamChunk(stream)
+
+        return stream["data"], offset-stream["start"]
+
+    def __streamChunk(self, stream):
+        """
+        Dekomprimuje další část velkého bloku.
+
+        :param stream: dict -- stav postupné dekomprese
+        :returns: bytes -- nejvýše STREAM_CHUNK bajtů dekomprimovaných dat
+        """
+        decompressor=stream["decompressor"]
+        blockEnd=int(self.blocks[0][stream["block"]+1])
+        while True:
+            if self.compression=="gzip":
+                data=stream["tail"]
+                if not data:
+                    data=self.__readCompressed(stream, blockEnd)
+                chunk=decompressor.decompress(data, self.STREAM_CHUNK)
+                stream["tail"]=decompressor.unconsumed_tail
+            else:
+                chunk=decompressor.decompress(self.__readCompressed(stream, blockEnd) if decompressor.needs_input else b"",
+                                              self.STREAM_CHUNK)
+
+            if chunk:
+                return chunk
+
+            if decompressor.eof:
+                raise IOError("Poškozený blok komprimovaného souboru: "+self.filename)
+
+    def __readCompressed(self, stream, blockEnd):
+        """
+        Přečte další komprimovaná data bloku pro postupnou dekompresi.
+
+        :param stream: dict -- stav postupné dekomprese
+        :param blockEnd: int -- offset konce bloku v komprimovaném souboru
+        :returns: bytes -- komprimovaná data
+        """
+        size=min(self.READ_SIZE, blockEnd-stream["compressedPos"])
+        if size<=0:
+            raise IOError("Poškozený blok komprimovaného souboru: "+self.filename)
+
+        data=os.pread(self.__file.fileno(), size, stream["compressedPos"])
+        stream["compressedPos"]+=len(data)
+        return data
+
+    def __blockId(self, offset):
+        """
+        Najde blok obsahující daný offset v dekomprimovaných datech.
+
+        :param offset: int -- offset
+        :returns: int -- identifikátor bloku
+        """
+        return int(np.searchsorted(self.blocks[1], offset, side="right"))-1
+
+    def __block(self, blockId):
+        """
+        Získá dekomprimovaný blok. Při postupném čtení naplánuje dekomprimaci dalšího bloku.
+
+        :param blockId: int -- identifikátor bloku
+        :returns: bytes -- dekomprimovaný blok
+        """
+        try:
+            data=self.__cache[blockId]
+            self.__cache.move_to_end(blockId)
+        except KeyError:
+            if self.__prefetched is not None and self.__prefetched[0]==blockId and self.__executorPid==os.getpid():
+                data=self.__prefetched[1].result()
+                self.__prefetched=None
+            else:
+                data=self.__decompressBlock(blockId)
+
+            self.__cache[blockId]=data
+            while len(self.__cache)>self.CACHE_BLOCKS:
+                self.__cache.popitem(last=False)
+
+        if self.__lastBlock is not None and blockId==self.__lastBlock+1 and self.__prefetched is None \
+                and blockId+1<len(self.blocks[0])-1 and blockId+1 not in self.__cache and not self.__isLarge(blockId+1):
+            #postupné čtení, další blok dekomprimujeme dopředu (dekomprese uvolňuje GIL)
+            if self.__executor is None or self.__executorPid!=os.getpid():
+                #vlákno nepřežije fork, v novém procesu je nutné vytvořit nové
+                self.__executor=ThreadPoolExecutor(max_workers=1)
+                self.__executorPid=os.getpid()
+            self.__prefetched=(blockId+1, self.__executor.submit(self.__decompressBlock, blockId+1))
+
+        self.__lastBlock=blockId
+        return data
+
+    def __decompressBlock(self, blockId):
+        """
+        Přečte a dekomprimuje blok.
+
+        :param blockId: int -- identifikátor bloku
+        :returns: bytes -- dekomprimovaný blok
+        """
+        start, end=int(self.blocks[0][blockId]), int(self.blocks[0][blockId+1])
+        compressed=os.pread(self.__file.fileno(), end-start, start)
+
+        decompressor=self.__decompressor()
+        data=decompressor.decompress(compressed)
+        if not decompressor.eof:
+            raise IOError("Poškozený blok komprimovaného souboru: "+self.filename)
+        return data
+
+    def __decompressor(self):
+        """
+        Vytvoří dekompresor pro jeden blok.
+
+        :returns: Dekompresor s metodou decompress a atributy eof a unused_data.
+        """
+        if self.compression=="gzip":
+            return zlib.decompressobj(16+zlib.MAX_WBITS)
+        if self.compression=="bz2":
+            return bz2.BZ2Decompressor()
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+    def __fileIdentity(self):
+        """
+        Získá údaje identifikující verzi komprimovaného souboru.
+
+        :returns: (velikost, čas modifikace v ns)
+        """
+        st=os.stat(self.filename)
+        return (st.st_size, st.st_mtime_ns)
+
+    def __load(self):
+        """
+        Načte uložený index bloků. Kontroluje, jestli odpovídá komprimovanému souboru.
+
+        :returns: numpy.array -- 2 x (počet bloků+1) offsety začátků bloků v komprimovaném a dekomprimovaném souboru.
+            Poslední sloupec obsahuje velikosti souborů.
+        :raises BlockCompressedFileInvalidIndex: Neplatný index.
+        """
+        with open(self.indexFile, "rb") as f:
+            header=f.read(self.HEADER.size)
+            if len(header)!=self.HEADER.size:
+                raise BlockCompressedFileInvalidIndex()
+
+            magic, version, method, size, mtime, blocksCnt=self.HEADER.unpack(header)
+
+            if magic!=self.MAGIC or version!=self.VERSION or method!=self.METHODS[self.compression][0]:
+                raise BlockCompressedFileInvalidIndex()
+
+            if (size, mtime)!=self.__fileIdentity():
+                logging.info("index bloků neodpovídá komprimovanému souboru: "+self.filename)
+                raise BlockCompressedFileInvalidIndex()
+
+            blocks=np.frombuffer(f.read(), dtype="<u8")
+
+        if blocks.shape[0]!=2*(blocksCnt+1):
+            raise BlockCompressedFileInvalidIndex()
+
+        return blocks.reshape((2, blocksCnt+1))
+
+    def __save(self, blocks):
+        """
+        Uloží index bloků vedle komprimovaného souboru.
+
+        :param blocks: numpy.array -- index bloků
+        :returns: bool -- True uloženo. False nelze uložit.
+        """
+        tmpFile=self.indexFile+".tmp"+str(os.getpid())
+        try:
+            size, mtime=self.__fileIdentity()
+            with open(tmpFile, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.METHODS[self.compression][0], size, mtime, blocks.shape[1]-1))
+                f.write(np.ascontiguousarray(blocks, dtype="<u8").tobytes())
+
+            os.replace(tmpFile, self.indexFile)
+        except (IOError, OSError):
+            logging.info("index bloků nelze uložit: "+self.indexFile)
+            if os.path.isfile(tmpFile):
+                os.remove(tmpFile)
+            return False
+
+        return True
+
+    def __build(self):
+        """
+        Projde komprimovaný soubor a vytvoří index bloků.
+
+        :returns: numpy.array -- index bloků
+        """
+        logging.info("začátek vytváření indexu bloků: "+self.filename)
+
+        compressedOffsets=[0]
+        uncompressedOffsets=[0]
+        compressedPos=0
+        uncompressedPos=0
+
+        decompressor=self.__decompressor()
+        with open(self.filename, "rb") as f:
+            data=b""
+            while True:
+                if not data:
+                    data=f.read(self.READ_SIZE)
+                    if not data:
+                        break
+
+                uncompressedPos+=len(decompressor.decompress(data))
+
+                if decompressor.eof:
+                    #konec bloku, zbytek dat patří dalšímu bloku
+                    unused=decompressor.unused_data
+                    compressedPos+=len(data)-len(unused)
+                    data=unused
+                    compressedOffsets.append(compressedPos)
+                    uncompressedOffsets.append(uncompressedPos)
+                    decompressor=self.__decompressor()
+                else:
+                    compressedPos+=len(data)
+                    data=b""
+
+        if compressedOffsets[-1]!=compressedPos:
+            raise IOError("Neúplný komprimovaný soubor: "+self.filename)
+
+        logging.info("konec vytváření indexu bloků: "+self.filename)
+        return np.array([compressedOffsets, uncompressedOffsets], dtype="<u8")
@@ -8,6 +8,7 @@ Obsahuje třídu pro získání dat k trénování/testování klasifikátoru.
 """
 
 from .DocReader import DocReader, DocReaderMetadata, DocReaderInvalidMetadataFields, DocReaderNeedDataFile, DocReaderInvalidDataFileForMetadata
+from .TokensArray import TokensArray, TokensVocabulary
 import csv
 
 import logging
@@ -44,7 +45,8 @@ class DataSet(object):
 
     def __init__(self, metadata, data=None, getMetaFields=None, getFulltext=None, targetField=None, 
                  lazyEvalData=None, nonEmpty=None, empty=None, fieldRegex=None, minPerField=None, maxPerField=None, 
-                 itemDelimiter=None, selectWords=None, selectItems=None, copyAndRen={}, fulltextName="fulltext"):
+                 itemDelimiter=None, selectWords=None, selectItems=None, copyAndRen={}, fulltextName="fulltext", workers=1,
+                 additionalMetaFields=None, cacheDir=None, readahead=None, ids=None, idField=None, tokenIds=False):
         """
         Konstruktor. Připraví nástroje pro čtení dat.
         
@@ -70,6 +72,19 @@ class DataSet(object):
         :param selectItems: dict -- klíč je název pole a hodnota je slice/integer pro vybrání položek.
         :param fulltextName: Název dat s plným textem
         :param copyAndRen: dict -- klíč tuple název/y dat, který má být zkopírován a přejmenován na název, který se vyskytuje pod daným klíčem.
+        :param workers: Počet procesů pro čtení souboru s metadaty. -1 => Automaticky dle počtu CPU.
+        :param additionalMetaFields: Názvy dalších metadatových polí, která mají být načtena (například pro pozdější změnu metaFields).
+            Ze souboru s metadaty jsou načtena pouze potřebná pole.
+        :param cacheDir: Adresář pro snímky vyfiltrovaných dat. None => snímky nejsou používány.
+            Při opakovaném použití stejných vstupních souborů a parametrů filtrů jsou načtena již vyfiltrovaná metadata
+            (indexy vybraných řádků, položky potřebných polí a cíle) a soubor s metadaty není znovu čten ani filtrován.
+        :param readahead: Počet dokumentů v okně, ve kterém jsou plné texty čteny seřazené podle pozice v datovém souboru.
+            None => plné texty jsou čteny v pořadí dokumentů.
+        :param ids: list -- identifikátory dokumentů (hodnoty pole idField), které budou vybrány (v daném pořadí).
+            Dokumenty jsou vyhledány pomocí indexu záznamů, takže vstupní soubory nejsou celé čteny. None => všechny dokumenty.
+        :param idField: Název pole s identifikátorem dokumentu. Povinné pokud je zadáno ids.
+        :param tokenIds: True => plné texty jsou vráceny jako TokensArray (slova převedená na identifikátory společného slovníku
+            v jednom poli int32). Pouze bez líného vyhodnocení a pokud selectWords nevybírá jediné slovo.
         :raises: DataSetInvalidMetadataFields
         """
         
@@ -78,13 +93,23 @@ class DataSet(object):
         self.__targetField=targetField
         self.__fulltextName=fulltextName
         self.__copyAndRen=copyAndRen
+        
+        #společný slovník pro všechny části dat
+        self.__tokensVocabulary=TokensVocabulary() if tokenIds and not lazyEvalData and not isinstance(selectWords, int) else None
 
         #získání objektu pro čtení
         logging.info("začátek čtení dat")
         
+        #pole, která je nutné načíst
+        loadFields=set(getMetaFields) | set(additionalMetaFields if additionalMetaFields else [])
+        for origNames, cNames in self.__copyAndRen.items():
+            loadFields=(loadFields-set(cNames)) | set(origNames)
+        if targetField:
+            loadFields.add(targetField)
+        
         try:
             self.reader=self.__getDataReader(metadata, data, lazyEvalData, nonEmpty, empty, fieldRegex, minPerField, maxPerField, 
-                 itemDelimiter, selectWords, selectItems)
+                 itemDelimiter, selectWords, selectItems, workers, loadFields, cacheDir, readahead, ids, idField)
         except DocReaderNeedDataFile:
             raise DataSetNoDataPath()
         except DocReaderInvalidMetadataFields:
@@ -98,9 +123,11 @@ class DataSet(object):
         
         #Musime zkontrolovat zda-li mame vsechna data.
         self.__fNames=set(self.reader.fieldNames)
+        self.__loadedNames=set(self.reader.loadedFields)
         #k temto vstupnim datum pridame jeste data, ktera ziskame kopirovanim
         for _, names in self.__copyAndRen.items():
             self.__fNames=self.__fNames | set(names)
+            self.__loadedNames=self.__loadedNames | set(names)
         
         
         if not set(self.__getMetaFields).issubset(self.__fNames):
@@ -121,11 +148,12 @@ class DataSet(object):
         Změna metadat, které mají výt vybrány.
         
         :param newMetaFields: Názvy nových metadatových polí.
-        :raises: DataSetInvalidMetadataFields - Pokud nejsou dané pole v metadatovém souboru.
+        :raises: DataSetInvalidMetadataFields - Pokud nejsou dané pole v metadatovém souboru nebo nebyly načteny.
         """
 
         self.__getMetaFields=newMetaFields
-        if not set(self.__getMetaFields).issubset(self.__fNames):
+        if not set(self.__getMetaFields).issubset(self.__loadedNames):
+            #pole musí existovat a musí být načtené (viz additionalMetaFields)
             raise DataSetInvalidMetadataFields()
         
     def enableFulltext(self):
@@ -169,6 +197,14 @@ class DataSet(object):
         
         if self.__getFulltext:
             
+            if self.reader.rawFulltextCopyable():
+                #řádky lze kopírovat přímo z datového souboru
+                with open(fileName, "wb") as fWrite:
+                    logging.info("začátek zápisu plného textu (kopírování řádků)")
+                    self.reader.writeRawFulltext(fWrite)
+                    logging.info("konec zápisu plného textu (kopírování řádků)")
+                return
+            
             with open(fileName, "w") as fWrite:
                 
                 logging.info("začátek zápisu plného textu")
@@ -184,15 +220,23 @@ class DataSet(object):
         """
         
         if self.__getMetaFields:
+            if self.__rawMetadataCopyable():
+                #záznamy lze kopírovat přímo ze souboru s metadaty
+                with open(fileName, "wb") as fWrite:
+                    logging.info("začátek zápisu metadat (kopírování záznamů): "+", ".join(self.__getMetaFields))
+                    self.reader.writeRawMetadata(fWrite)
+                    logging.info("konec zápisu metadat (kopírování záznamů): "+", ".join(self.__getMetaFields))
+                return
+            
+            #plný text nepotřebujeme, proto čteme jen metadata
+            reader=self.reader.toMetaData() if type(self.reader) is DocReader else self.reader
+            
             with open(fileName, "w") as fWrite:
                 logging.info("začátek zápisu metadat: "+", ".join(self.__getMetaFields))
                 writerMeta = csv.DictWriter(fWrite, fieldnames=self.__getMetaFields)
                 writerMeta.writeheader()
                 
-                for doc in self.reader:
-                    if self.__getFulltext:
-                        doc=doc[1]
-                    
+                for doc in reader:
                     self.copyData(doc)    
                     
                     writerMeta.writerow(self.__transMetaToWriteFormat(doc))
@@ -208,6 +252,12 @@ class DataSet(object):
         """
         
         if self.__getMetaFields and self.__getFulltext:
+            if self.reader.rawFulltextCopyable() or self.__rawMetadataCopyable():
+                #alespoň jeden soubor lze zapsat kopírováním, proto každý soubor zapíšeme zvlášť
+                self.writeFullText(fulltextDataFileName)
+                self.writeMetadata(metadataFileName)
+                return
+            
             with open(fulltextDataFileName, "w") as fWrite, open(metadataFileName, "w") as fMetaWrite:
                 logging.info("začátek zápisu plného textu a metadat: "+", ".join(self.__getMetaFields))
                 writerMeta = csv.DictWriter(fMetaWrite, fieldnames=self.__getMetaFields)
@@ -220,6 +270,16 @@ class DataSet(object):
                     writerMeta.writerow(self.__transMetaToWriteFormat(doc[1]))
                 logging.info("konec zápisu plného textu a metadat: "+", ".join(self.__getMetaFields))
         
+    def __rawMetadataCopyable(self):
+        """
+        Zjistí, jestli lze metadata zapsat kopírováním záznamů souboru s metadaty.
+        Zapisovaná pole nesmí vznikat kopírováním (copyAndRen).
+        
+        :returns: bool
+        """
+        copied=set(cName for cNames in self.__copyAndRen.values() for cName in cNames)
+        return not (copied & set(self.__getMetaFields)) and self.reader.rawMetadataCopyable(self.__getMetaFields)
+        
     def __transMetaToWriteFormat(self, metaData):
         """
         Transformuje metadata dokumentu, do formátu pro zápis do souboru.
@@ -273,6 +333,21 @@ class DataSet(object):
         logging.info("konec získávání dat pro trénování: "+allDataNames)
         return result
     
+    def iterBatches(self, batchSize, targets=False):
+        """
+        Získává data po částech. Paměťová náročnost je tak omezena velikostí části a ne velikostí celé množiny dat.
+        
+        :param batchSize: Maximální počet dokumentů v jedné části. None => všechny dokumenty v jedné části.
+        :param targets: I cíle
+        :returns: Generátor částí dat. Pokud targets True generuje dvojice (data, cíle).
+        :raises: DataSetInvalidTarget
+        """
+        
+        if targets and (not self.__targetField or not set([self.__targetField]).issubset(self.reader.fieldNames)):
+            raise DataSetInvalidTarget()
+        
+        return self.__getDataBatches(batchSize, targets)
+    
     def __getData(self, targets=False):
         """
         Získá data.
@@ -280,18 +355,32 @@ class DataSet(object):
         :param targets: I cíle
         :returns: data pokud target True získá i cíle (data, cíle)
         """
-        data=dict( (kind, []) for kind in self.__getMetaFields)
+        for batch in self.__getDataBatches(None, targets):
+            return batch
         
-        targetsData=[]
+    def __getDataBatches(self, batchSize, targets=False):
+        """
+        Generuje data po částech.
         
-        if self.__getFulltext:
-            data[self.__fulltextName]=[]
-        elif type(self.reader) is DocReader:
+        :param batchSize: Maximální počet dokumentů v jedné části. None => všechny dokumenty v jedné části.
+        :param targets: I cíle
+        :returns: Generátor částí. Pokud targets True generuje dvojice (data, cíle).
+        """
+        
+        def newBatch():
+            data=dict( (kind, []) for kind in self.__getMetaFields)
+            if self.__getFulltext:
+                data[self.__fulltextName]=[] if self.__tokensVocabulary is None else TokensArray(self.__tokensVocabulary)
+            return (data, [])
+        
+        if not self.__getFulltext and type(self.reader) is DocReader:
             #nechceme plný text, ale dostávali bychom jej
             #proto provedeme převod
             self.reader=self.reader.toMetaData()
             
-            
+        data, targetsData=newBatch()
+        docsInBatch=0
+        
         for doc in self.reader:
             if self.__getFulltext:
                 data[self.__fulltextName].append(doc[0])
@@ -305,13 +394,19 @@ class DataSet(object):
             if targets:
                 targetsData.append(doc[self.__targetField][0])
             
-        if targets:
-            return (data, targetsData)
-        else:
-            return data
+            docsInBatch+=1
+            if batchSize and docsInBatch>=batchSize:
+                yield (data, targetsData) if targets else data
+                data, targetsData=newBatch()
+                docsInBatch=0
+        
+        if docsInBatch>0 or not batchSize:
+            #Bez dělení na části vracíme vždy (i prázdná data).
+            yield (data, targetsData) if targets else data
         
     def __getDataReader(self, metadata, data, lazyEvalData=None, nonEmpty=None, empty=None, fieldRegex=None, minPerField=None, maxPerField=None, 
-                 itemDelimiter=None, selectWords=None, selectItems=None):
+                 itemDelimiter=None, selectWords=None, selectItems=None, workers=1, fields=None, cacheDir=None, readahead=None,
+                 ids=None, idField=None):
         """
         Na základě konfiguračního souboru, a argumentů metadata/data, vytvoří DocReader nebo DocReaderMetadata.
         
@@ -331,6 +426,12 @@ class DataSet(object):
         :param itemDelimiter: Oddělovač (řetězec), který separuje položky v poli.
         :param selectWords: slice/integer -- pro vybrání slov v každém dokumentu
         :param selectItems: dict -- klíč je název pole a hodnota je slice/integer pro vybrání položek.
+        :param workers: Počet procesů pro čtení souboru s metadaty.
+        :param fields: Názvy polí metadat, která mají být načtena. None => všechna.
+        :param cacheDir: Adresář pro snímky vyfiltrovaných metadat. None => snímky nejsou používány.
+        :param readahead: Počet dokumentů v okně pro čtení seřazené podle offsetů. None => čtení v pořadí dokumentů.
+        :param ids: list -- identifikátory vybraných dokumentů. None => všechny dokumenty.
+        :param idField: Název pole s identifikátorem dokumentu.
         
         :returns: DocReader|DocReaderMetadata
         """
@@ -349,7 +450,13 @@ class DataSet(object):
                              itemDelimiter=itemDelimiter, 
                              selectWords=selectWords, 
                              selectItems=selectItems,
-                             fulltextName=self.__fulltextName)
+                             fulltextName=self.__fulltextName,
+                             workers=workers,
+                             fields=fields,
+                             cacheDir=cacheDir,
+                             readahead=readahead,
+                             ids=ids,
+                             idField=idField)
         else:
             return DocReaderMetadata(metadata, 
                                      nonEmpty=nonEmpty, 
@@ -358,7 +465,12 @@ class DataSet(object):
                                      minPerField=minPerField, 
                                      maxPerField=maxPerField,
                                      itemDelimiter=itemDelimiter, 
-                                     selectItems=selectItems)
+                                     selectItems=selectItems,
+                                     workers=workers,
+                                     fields=fields,
+                                     cacheDir=cacheDir,
+                                     ids=ids,
+                                     idField=idField)
             
 class DataTypeSelector(object):
     """
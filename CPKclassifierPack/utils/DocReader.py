@@ -7,11 +7,25 @@ Obsahuje třídu pro čtení dokumentů z datového souboru a souboru metadat.
 """
 
 from random import shuffle
-import copy
+from collections import OrderedDict
+import codecs
 import csv
+import hashlib
+import io
+import locale
 import logging
+import mmap
+import multiprocessing
+import os
 import re
 
+import numpy as np
+
+from .BlockCompressedFile import BlockCompressedFile
+from .LinesIndex import LinesIndex
+from .MetadataStore import MetadataStore
+from .RecordIndex import RecordIndex
+
 class DocReaderInvalidMetadataFields(Exception):
     """
     Některá pole nejsou ve vstupním souboru s metadaty.
@@ -37,8 +51,22 @@ class DocReader(object):
     Dokumenty mohou být čteny v řádkovém pořadí nebo náhodném.
     Umožňuje také filtrovat dokumenty na základě polí v metadatech.
     """
+    
+    PARALLEL_MIN_SIZE=2**20   #minimální velikost souboru s metadaty (v bajtech) pro paralelní čtení
+    SNAPSHOT_VERSION=3        #verze formátu snímku vyfiltrovaných metadat (součást klíče)
+    SNAPSHOT_TAIL_SIZE=4096   #kolik bajtů před koncem souboru je použito pro kontrolu, jestli byl pouze rozšířen
+    READAHEAD_MAX_BYTES=2**26 #maximální součet délek dokumentů v jednom okně při čtení s readahead
+    READAHEAD_BUFFER=2**20    #velikost bufferu pro čtení datového souboru s readahead
+    RAW_COPY_CHUNK=2**24      #maximální velikost jednoho čtení při kopírování surových řádků/záznamů
+    
+    #bílé znaky (str.split/str.strip) v utf-8 kromě znaku konce řádku
+    RAW_WHITESPACE=re.compile(rb"(?:[\t\r\x0b\x0c\x1c-\x1f ]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80)")
+    #řádek plného textu, který není ve tvaru " ".join(line.split())
+    RAW_NOT_NORMALIZED=re.compile(rb"(?m)^ | $|  |"+RAW_WHITESPACE.pattern.replace(b" ]", b"]"))
+    
     def __init__(self, dataFile, metadataFile, lazyEvalData=False, nonEmpty=None, empty=None, fieldRegex=None, minPerField=None, maxPerField=None,
-                  initMetadata=None, initLinesOffsets=None, itemDelimiter=None, selectWords=None, selectItems=None, fulltextName="fulltext"):
+                  initMetadata=None, initLinesOffsets=None, itemDelimiter=None, selectWords=None, selectItems=None, fulltextName="fulltext", workers=1,
+                  fields=None, cacheDir=None, readahead=None, ids=None, idField=None):
         """
         Konstruktor DocReader.
         
@@ -56,14 +84,40 @@ class DocReader(object):
             Filtr definuje maximální počet dokumentů na položku v poli.
             Pokud je hodnota float v intervalu <0,1>, maximálně x procent (int((numberOfDcuments*x)+0.5)) dokumentů v poli bude přečteno.
         :param initMetadata: Inicializuje metadata aniž by četl soubor s metadaty. Pomocí předaných hodnot v tomto parametru.
+            Očekává MetadataStore (případně list dvojic (index řádku, {pole: [položky]})).
             Když je tento parametr použitý: nonEmpty, minPerField a maxPerField jsou ignorovány.
         :param initLinesOffsets: Inicializuje offsety datového souboru, aniž by jej četl. Pomocí předaných hodnot v tomto parametru.
         :param itemDelimiter: Oddělovač (řetězec), který separuje položky v poli.
         :param selectWords: slice/integer -- pro vybrání slov v každém dokumentu
         :param selectItems: dict -- klíč je název pole a hodnota je slice/integer pro vybrání položek.
-        """
-        
-        self.fieldNames=None
+        :param fulltextName: Název dat s plným textem
+        :param workers: Počet procesů pro čtení souboru s metadaty. -1 => Automaticky dle počtu CPU.
+            Soubor je rozdělen na části (na hranicích řádků), které jsou zpracovány paralelně.
+        :param fields: Názvy polí metadat, která budou načtena. Pole potřebná pro filtry jsou přidána automaticky.
+            Ostatní sloupce nejsou při čtení csv vůbec zpracovávány. None => všechna pole.
+        :param cacheDir: Adresář pro snímky vyfiltrovaných metadat. None => snímky nejsou používány.
+            Snímek obsahuje metadata po filtrech non empty, empty a regex (včetně počtů položek) a je uložen pod klíčem,
+            který je hashem cest ke vstupním souborům a parametrů filtrů. Pokud se vstupní soubory od uložení snímku
+            nezměnily, je snímek načten (mapován do paměti) a soubor s metadaty není vůbec čten. Pokud byly pouze
+            rozšířeny o další řádky, jsou přečteny jen připojené řádky a snímek je aktualizován. Filtry max a min jsou
+            aplikovány nad předpočítanými počty ze snímku.
+        :param readahead: Počet dokumentů v okně pro čtení seřazené podle offsetů. None => dokumenty jsou čteny
+            v pořadí metadat (například po shuffle náhodně po souboru). Jinak jsou dokumenty v každém okně přečteny
+            postupně podle pozice v datovém souboru a vráceny v pořadí metadat. Velikost okna je navíc omezena součtem
+            délek dokumentů (READAHEAD_MAX_BYTES). Nepoužije se pro lazyEvalData.
+        :param ids: list -- identifikátory dokumentů (hodnoty pole idField), které budou načteny (v daném pořadí).
+            Záznamy jsou vyhledány pomocí perzistentního indexu (RecordIndex), takže soubor s metadaty není celý čten.
+            Filtry jsou aplikovány pouze na vybrané dokumenty. None => všechny dokumenty.
+        :param idField: Název pole s identifikátorem dokumentu. Povinné pokud je zadáno ids.
+        """
+        
+        self.fieldNames=None    #všechna pole v souboru s metadaty
+        self.fields=fields
+        self.workers=multiprocessing.cpu_count() if workers==-1 else workers
+        self.cacheDir=cacheDir
+        self.readahead=readahead
+        self.ids=ids
+        self.idField=idField
         
         self.lazyEvalData=lazyEvalData
         self.nonEmpty=nonEmpty
@@ -84,11 +138,27 @@ class DocReader(object):
         self.dataLinesOffsets=initLinesOffsets
         if initLinesOffsets is None and self.dataFile is not None:
             self.__dataFileLinesOffsets()
+            #datový soubor mohl být od posledního čtení v tomto procesu změněn
+            DocReaderDataFileMap.refresh(self.dataFile)
     
         self.metadataFile = metadataFile
         self.metadata=initMetadata
         if initMetadata is None:
-            self.__filter()
+            if self.ids is not None:
+                self.__filterIds()
+            else:
+                self.__filter()
+        else:
+            if not isinstance(initMetadata, MetadataStore):
+                self.metadata=MetadataStore.fromRows(initMetadata[0][1].keys() if initMetadata else [], initMetadata)
+            self.fieldNames=self.metadata.fields
+    
+    @property
+    def loadedFields(self):
+        """
+        Názvy načtených polí metadat.
+        """
+        return self.metadata.fields
         
         
         
@@ -113,19 +183,70 @@ class DocReader(object):
         
         :returns: list -- (data, metadata)
         """
-        with open(self.dataFile, "r") as fileToRead:
+        if self.readahead and not self.lazyEvalData:
+            for doc in self.__readWindows():
+                yield doc
+            return
+        
+        #počty slov v indexu řádků odpovídají bílým znakům utf-8, pro jiné kódování je řádek dekódován a rozdělen
+        utf8=codecs.lookup(DocReaderDataFileMap.ENCODING).name=="utf-8"
+        
+        with BlockCompressedFile.open(self.dataFile, "rb") as fileToRead:
             for docIndex, mData in self.metadata:
                 line=None
                 if self.lazyEvalData:
-                    line=DocReaderDataString(self.dataFile, self.dataLinesOffsets[docIndex], None, None, self.selectWords)
+                    if utf8:
+                        line=DocReaderDataString(self.dataFile, self.dataLinesOffsets[docIndex], None, None, self.selectWords,
+                                                 tokensCount=int(self.dataLinesOffsets.tokens[docIndex]),
+                                                 lineLength=int(self.dataLinesOffsets.lengths[docIndex]))
+                    else:
+                        line=DocReaderDataString(self.dataFile, self.dataLinesOffsets[docIndex], None, None, self.selectWords)
+                elif self.selectWords:
+                    #čteme jen část řádku potřebnou pro vybraná slova
+                    line=DocReaderWordsSelector.fromFile(fileToRead, self.dataLinesOffsets[docIndex], 
+                                                         self.dataLinesOffsets.lengths[docIndex], self.selectWords)
                 else:
                     fileToRead.seek(self.dataLinesOffsets[docIndex])
-                    line=fileToRead.readline().rstrip('\n').split()
-                    if self.selectWords:
-                        line=line[self.selectWords]
+                    line=str(fileToRead.readline(), DocReaderDataFileMap.ENCODING).split()
 
                         
-                yield (line, mData.copy())
+                yield (line, mData)
+        
+    def __readWindows(self):
+        """
+        Přečte dokumenty po oknech. Dokumenty v okně jsou čteny podle pozice v datovém souboru (postupně, s velkým bufferem)
+        a vráceny v pořadí metadat.
+        
+        :returns: list -- (data, metadata)
+        """
+        offsets=self.dataLinesOffsets.offsets
+        lengths=self.dataLinesOffsets.lengths
+        
+        with BlockCompressedFile.open(self.dataFile, "rb", self.READAHEAD_BUFFER) as fileToRead:
+            start=0
+            while start<len(self.metadata):
+                rows=self.metadata.rows[start:start+self.readahead]
+                #omezení paměti pro přečtené dokumenty
+                docsCnt=max(1, int(np.searchsorted(np.cumsum(lengths[rows]), self.READAHEAD_MAX_BYTES, side="right")))
+                rows=rows[:docsCnt]
+                
+                rowsOffsets=offsets[rows]
+                lines=[None]*docsCnt
+                for i in np.argsort(rowsOffsets, kind="stable"):
+                    if self.selectWords:
+                        #čteme jen část řádku potřebnou pro vybraná slova
+                        lines[i]=DocReaderWordsSelector.fromFile(fileToRead, rowsOffsets[i], lengths[rows[i]], self.selectWords)
+                    else:
+                        fileToRead.seek(int(rowsOffsets[i]))
+                        lines[i]=fileToRead.readline()
+                
+                for i in range(docsCnt):
+                    line=lines[i] if self.selectWords else str(lines[i], DocReaderDataFileMap.ENCODING).split()
+                    lines[i]=None
+                    
+                    yield (line, self.metadata.row(start+i))
+                
+                start+=docsCnt
         
     def toData(self):
         """
@@ -133,7 +254,7 @@ class DocReader(object):
         
         :returns:  DocReaderData -- Obalí tento DocReader.
         """
-        return DocReaderData(
+        reader=DocReaderData(
             dataFile=self.dataFile, 
             metadataFile=self.metadataFile, 
             lazyEvalData=self.lazyEvalData, 
@@ -142,12 +263,18 @@ class DocReader(object):
             fieldRegex=self.fieldRegex, 
             minPerField=self.minPerField, 
             maxPerField=self.maxPerField,
-            initMetadata=copy.deepcopy(self.metadata), 
-            initLinesOffsets=copy.deepcopy(self.dataLinesOffsets), 
+            initMetadata=self.metadata,     #MetadataStore se nemění, lze sdílet
+            initLinesOffsets=self.dataLinesOffsets,     #offsety jsou jen pro čtení, lze sdílet
             itemDelimiter=self.itemDelimiter, 
             selectWords=self.selectWords, 
             selectItems=self.selectItems,
-            fulltextName=self.__fulltextName)
+            fulltextName=self.__fulltextName,
+            workers=self.workers,
+            fields=self.fields,
+            cacheDir=self.cacheDir,
+            readahead=self.readahead)
+        reader.fieldNames=self.fieldNames
+        return reader
             
     def toMetaData(self):
         """
@@ -155,16 +282,21 @@ class DocReader(object):
         
         :returns:  DocReaderMetadata -- Obalí tento DocReader.
         """
-        return DocReaderMetadata(
+        reader=DocReaderMetadata(
             metadataFile=self.metadataFile, 
             nonEmpty=self.nonEmpty, 
             empty=self.empty, 
             fieldRegex=self.fieldRegex, 
             minPerField=self.minPerField, 
             maxPerField=self.maxPerField,
-            initMetadata=copy.deepcopy(self.metadata),
+            initMetadata=self.metadata,
             itemDelimiter=self.itemDelimiter,
-            selectItems=self.selectItems)
+            selectItems=self.selectItems,
+            workers=self.workers,
+            fields=self.fields,
+            cacheDir=self.cacheDir)
+        reader.fieldNames=self.fieldNames
+        return reader
     
     def toList(self):
         """
@@ -176,158 +308,342 @@ class DocReader(object):
         
     def __dataFileLinesOffsets(self):
         """
-        Hledá offsety řádků
+        Hledá offsety řádků. Využívá perzistentní index uložený vedle datového souboru (LinesIndex),
+        takže při opakovaném použití stejného datového souboru není nutné soubor znovu procházet.
         
-        :returns:  list -- řádkových offsetů.
+        :returns:  LinesIndex -- řádkových offsetů.
         """
         logging.info("začátek hledání offsetů řádků v datovém souboru")
         if self.dataLinesOffsets is None:
-            self.dataLinesOffsets=[]
-            with open(self.dataFile, "r") as f:
-                self.dataLinesOffsets.append(0)
-                while f.readline():
-                    self.dataLinesOffsets.append(f.tell())
-                    
-                del self.dataLinesOffsets[len(self.dataLinesOffsets)-1]
+            self.dataLinesOffsets=LinesIndex(self.dataFile)
                 
         logging.info("konec hledání offsetů řádků v datovém souboru")
         return self.dataLinesOffsets
     
-    def __maxFilter(self):
+    def __snapshotPath(self):
+        """
+        Získá cestu ke snímku vyfiltrovaných metadat.
+        Název snímku je hash cest ke vstupním souborům a parametrů filtrů. Identita vstupních souborů
+        (velikost, čas modifikace, hash konce) je uložena ve snímku, aby jej bylo možné aktualizovat o připojené řádky.
+        
+        :returns: str|None -- cesta ke snímku. None => snímky nejsou používány.
+        """
+        if self.cacheDir is None:
+            return None
+        
+        def sortedDict(d):
+            return sorted((k, repr(v)) for k, v in d.items()) if d else None
+        
+        key=(self.SNAPSHOT_VERSION,
+             os.path.abspath(self.metadataFile),
+             os.path.abspath(self.dataFile) if self.dataFile is not None else None,
+             sorted(self.nonEmpty) if self.nonEmpty else None,
+             sorted(self.empty) if self.empty else None,
+             sorted((k, getattr(r, "pattern", r), flags) for k, (r, flags) in self.fieldRegex.items()) if self.fieldRegex else None,
+             sortedDict(self.minPerField),
+             sortedDict(self.maxPerField),
+             self.itemDelimiter,
+             sortedDict(self.selectItems),
+             self.__fulltextName,
+             sorted(self.fields) if self.fields is not None else None)
+        
+        return os.path.join(self.cacheDir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest())
+    
+    def __snapshotStates(self):
         """
-        Filtrování dokumentů na základě parametru maxPerField.
+        Získá údaje identifikující verze vstupních souborů pro snímek.
+        
+        :returns: (metadata, data)|None -- údaje pro soubor s metadaty a datový soubor
+            (viz __fileState). None => snímky nejsou používány.
         """
-        if not self.maxPerField:
-            return
+        if self.cacheDir is None:
+            return None
         
-        #vytvoření statistik
-        fieldsStats=self.fieldsStats(self.maxPerField.keys())
-        restToRead={}
-
-        for fName, maxV in self.maxPerField.items():
-            if fName not in restToRead:
-                restToRead[fName]={}
-            
-            for item in fieldsStats[fName]:
-                restToRead[fName][item]=fieldsStats[fName][item]
-                
-                if isinstance(maxV, float) and maxV<=1:
-                    restToRead[fName][item]=int((fieldsStats[fName][item]*maxV)+0.5)
-                elif restToRead[fName][item]>maxV:
-                    restToRead[fName][item]=maxV
-                    
+        return (self.__fileState(self.metadataFile), self.__fileState(self.dataFile))
+    
+    def __fileState(self, filename):
+        """
+        Získá údaje identifikující verzi souboru.
         
-        #spuštění max filtru
-        newMeta=[]
-        for i, mData in self.metadata:
-            skipDoc=False
-            rowA=dict([ (x, None) for x in mData])
-            
-            for fName, fVal in mData.items():
-                if not fVal:
-                    #prázdné pole
-                    continue
-                #filtrování položek
-                filteredItems=[]
-                maxControl=(restToRead and (fName in self.maxPerField))
-                for ite in fVal:
-                    if maxControl:
-                        if restToRead[fName][ite]<=0:
-                            #přeskoč max
-                            continue
-                        #nepřeskočené dokumenty budou přečteny => sniž hodnotu
-                        restToRead[fName][ite]=restToRead[fName][ite]-1
-                        
-                    filteredItems.append(ite)
-                    
-                if len(filteredItems)==0:
-                    skipDoc=True
-                    break;
-                
-                rowA[fName]=filteredItems
-                
-            if skipDoc:
-                continue
-                  
-            newMeta.append((i, rowA))
-            
-        self.metadata=newMeta
+        :param filename: Cesta k souboru.
+        :returns: list|None -- [velikost, čas modifikace v ns, hash konce souboru]. None => soubor není zadán
+        """
+        if filename is None:
+            return None
         
-    def __minFilter(self):
+        st=os.stat(filename)
+        return [st.st_size, st.st_mtime_ns, self.__tailHash(filename, st.st_size)]
+    
+    def __tailHash(self, filename, size):
         """
-        Filtrování dokumentů na základě parametru minPerField.
+        Hash konce souboru (před danou pozicí).
+        
+        :param filename: Cesta k souboru.
+        :param size: Pozice konce.
+        :returns: str -- hash
         """
-        #začítek min filteru
-        if not self.minPerField:
+        with open(filename, "rb") as f:
+            start=max(0, size-self.SNAPSHOT_TAIL_SIZE)
+            f.seek(start)
+            return hashlib.sha1(f.read(size-start)).hexdigest()
+    
+    def __onlyAppended(self, filename, state):
+        """
+        Zjistí, jestli byl soubor od uložení snímku pouze rozšířen o další řádky.
+        
+        :param filename: Cesta k souboru.
+        :param state: list -- údaje o souboru uložené ve snímku (viz __fileState)
+        :returns: bool -- True => stačí přečíst připojené řádky
+        """
+        if BlockCompressedFile.isCompressed(filename):
+            return False
+        
+        size=state[0]
+        if size<=0 or os.path.getsize(filename)<=size:
+            return False
+        
+        with open(filename, "rb") as f:
+            f.seek(size-1)
+            if f.read(1)!=b"\n":
+                #poslední řádek nebyl ukončen, připojená data jej mohou prodlužovat
+                return False
+        
+        return self.__tailHash(filename, size)==state[2]
+    
+    def __loadSnapshot(self, checkFulltext):
+        """
+        Pokusí se načíst snímek vyfiltrovaných metadat.
+        Pokud byl soubor s metadaty od uložení snímku pouze rozšířen, jsou přečteny a vyfiltrovány jen připojené
+        řádky, které jsou přidány do snímku (včetně počtů položek), a snímek je uložen znovu.
+        
+        :param checkFulltext: True => kontroluje prázdnost/plnost souboru s plnými texty.
+        :returns: bool -- True snímek byl načten. False snímek neexistuje, nebo jej nelze načíst či aktualizovat.
+        :raise DocReaderInvalidDataFileForMetadata: 
+        """
+        path=self.__snapshotPath()
+        if path is None or not os.path.isdir(path):
+            return False
+        
+        try:
+            store, info=MetadataStore.load(path)
+            fieldNames, rowsCnt, metadataState, dataState=info["fieldNames"], info["rowsCnt"], info["metadata"], info["data"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            logging.info("snímek vyfiltrovaných metadat nelze načíst: "+path)
+            return False
+        
+        states=self.__snapshotStates()
+        
+        if dataState is not None and dataState[:2]!=states[1][:2] and not self.__onlyAppended(self.dataFile, dataState):
+            logging.info("datový soubor se od uložení snímku změnil: "+path)
+            return False
+        
+        if metadataState[:2]==states[0][:2]:
+            self.metadata=store
+            self.fieldNames=fieldNames
+            logging.info("načten snímek vyfiltrovaných metadat: "+path)
+            return True
+        
+        if not self.__onlyAppended(self.metadataFile, metadataState):
+            logging.info("soubor s metadaty se od uložení snímku změnil: "+path)
+            return False
+        
+        with BlockCompressedFile.open(self.metadataFile, "r") as metadata:
+            if next(csv.reader(metadata), None)!=fieldNames:
+                return False
+        
+        logging.info("aktualizace snímku vyfiltrovaných metadat o připojené řádky: "+path)
+        self.fieldNames=fieldNames
+        appended, appendedCnt=self._readMetadataPart((metadataState[0], states[0][0]))
+        
+        if self.dataLinesOffsets is not None and rowsCnt+appendedCnt>len(self.dataLinesOffsets):
+            raise DocReaderInvalidDataFileForMetadata()
+        
+        #počty položek jsou sečteny, není nutné je počítat znovu
+        self.metadata=MetadataStore.concatenate([store, appended], [0, rowsCnt])
+        if checkFulltext:
+            #původní řádky datového souboru se nezměnily, filtr jim ponechá stejné dokumenty
+            self.__fulltextFilterStore()
+        
+        self.__saveSnapshot(states, rowsCnt+appendedCnt)
+        return True
+    
+    def __saveSnapshot(self, states, rowsCnt):
+        """
+        Uloží snímek vyfiltrovaných metadat, pokud jsou snímky používány.
+        
+        :param states: (metadata, data) -- údaje identifikující verze vstupních souborů, ze kterých byla metadata
+            přečtena (viz __snapshotStates). None => snímky nejsou používány.
+        :param rowsCnt: Počet přečtených řádků souboru s metadaty.
+        """
+        path=self.__snapshotPath()
+        if path is None:
             return
-        fieldsStats=self.fieldsStats(self.minPerField.keys())
-        newMeta=[]
         
-        for i, mData in self.metadata:
-            skipDoc=False
-            rowA=dict([ (x, None) for x in mData])
-            
-            for fName, fVal in mData.items():
-                if not fVal:
-                    #prázdné pole
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            self.metadata.save(path, {"fieldNames": self.fieldNames, "rowsCnt": rowsCnt,
+                                      "metadata": states[0], "data": states[1]})
+        except (IOError, OSError):
+            logging.info("snímek vyfiltrovaných metadat nelze uložit: "+path)
+    
+    def __countsFilter(self):
+        """
+        Filtrování dokumentů na základě parametrů maxPerField a minPerField.
+        Prvně je aplikován max filtr a poté min filtr, který pracuje s výsledkem max filtru.
+        
+        Pracuje nad identifikátory položek v MetadataStore. Počty jsou převzaty z předpočítaných počtů v MetadataStore,
+        pokud je předchozí filtr nezměnil, jinak jsou získány pomocí bincount. Výsledek obou filtrů je nakonec aplikován
+        najednou pomocí masek.
+        """
+        if not self.maxPerField and not self.minPerField:
+            return
+        
+        store=self.metadata
+        vocabularySize=len(store.vocabulary)
+        docs=np.arange(len(store))
+        
+        keep={}     #název pole -> bool maska položek, které zůstanou
+        keepRows=np.ones(len(store), dtype=np.bool_)
+        
+        if self.maxPerField:
+            #Maximum pro položku je vypočteno jednou ze všech dokumentů.
+            #Položka je ponechána, pokud je počet jejích předchozích zpracovaných výskytů menší než maximum.
+            #Zpracované výskyty jsou ty, které jsou v dokumentech, které nebyly vynechány kvůli předchozímu poli (pořadí polí
+            #odpovídá pořadí v dokumentu).
+            for fName in store.fields:
+                if fName not in self.maxPerField:
                     continue
+                maxV=self.maxPerField[fName]
                 
-                #filtrování položek
-                filteredItems=[]
+                offsets, items=store.fieldItems(fName)
+                counts=store.fieldCounts(fName)
                 
-                minControl=(self.minPerField and (fName in self.minPerField))
-                for ite in fVal:
-                    if minControl and (fieldsStats[fName][ite] < self.minPerField[fName]):
-                        #přeskoč min
-                        continue
-                    filteredItems.append(ite)
-                    
-                if len(filteredItems)==0:
-                    skipDoc=True
-                    break;
+                if isinstance(maxV, float) and maxV<=1:
+                    caps=((counts*maxV)+0.5).astype(np.int64)
+                else:
+                    caps=np.minimum(counts, maxV)
                 
-                rowA[fName]=filteredItems
+                processed=keepRows[np.repeat(docs, np.diff(offsets))]
+                processedItems=items[processed]
                 
-            if skipDoc:
-                continue
-                  
-            newMeta.append((i, rowA))
+                fieldKeep=np.ones(items.shape[0], dtype=np.bool_)
+                fieldKeep[processed]=self.__occurrencesRanks(processedItems)<caps[processedItems]
+                
+                keepRows&=~self.__emptiedDocs(offsets, np.ones(items.shape[0], dtype=np.bool_), fieldKeep)
+                keep[fName]=fieldKeep
+        
+        if self.minPerField:
+            #statistiky jsou počítány pouze z výsledku max filtru
+            afterMaxRows=keepRows.copy()
+            for fName, minV in self.minPerField.items():
+                offsets, items=store.fieldItems(fName)
+                
+                before=keep[fName] if fName in keep else np.ones(items.shape[0], dtype=np.bool_)
+                
+                if fName not in keep and afterMaxRows.all():
+                    #max filtr pole nezměnil
+                    counts=store.fieldCounts(fName)
+                else:
+                    counted=before & afterMaxRows[np.repeat(docs, np.diff(offsets))]
+                    counts=np.bincount(items[counted], minlength=vocabularySize)
+                
+                after=before & (counts[items]>=minV)
+                
+                keepRows&=~self.__emptiedDocs(offsets, before, after)
+                keep[fName]=after
+        
+        for fName, fieldKeep in keep.items():
+            offsets, items=store.fieldItems(fName)
+            keptCum=np.concatenate(([0], np.cumsum(fieldKeep)))
+            store=store.replaceItems(fName, keptCum[offsets], items[fieldKeep])
+        
+        #po filtrování jsou prázdná pole reprezentována jako None
+        self.metadata=store.select(keepRows).withEmptyAsNone()
+        
+    @staticmethod
+    def __occurrencesRanks(items):
+        """
+        Pro každý výskyt položky zjistí kolik výskytů téže položky mu předchází.
+        
+        :param items: numpy.array -- identifikátory položek
+        :returns: numpy.array -- pořadí výskytu (od nuly)
+        """
+        order=np.argsort(items, kind="mergesort")
+        sortedItems=items[order]
+        
+        groupsStarts=np.flatnonzero(np.concatenate(([True], sortedItems[1:]!=sortedItems[:-1])))
+        groupsLengths=np.diff(np.concatenate((groupsStarts, [sortedItems.shape[0]])))
+        
+        ranks=np.empty(items.shape[0], dtype=np.int64)
+        ranks[order]=np.arange(items.shape[0])-np.repeat(groupsStarts, groupsLengths)
+        return ranks
+    
+    @staticmethod
+    def __emptiedDocs(offsets, before, after):
+        """
+        Najde dokumenty, kterým filtrování vyprázdnilo pole. Takové dokumenty budou vynechány.
+        
+        :param offsets: numpy.array -- offsety položek pole
+        :param before: bool maska položek před filtrováním
+        :param after: bool maska položek po filtrování
+        :returns: bool maska dokumentů
+        """
+        beforeCnt=np.diff(np.concatenate(([0], np.cumsum(before)))[offsets])
+        afterCnt=np.diff(np.concatenate(([0], np.cumsum(after)))[offsets])
+        return (beforeCnt>0) & (afterCnt==0)
+        
+    def __fulltextFilter(self, rowIndex):
+        """
+        Filtr dokumentů na základě prázdnosti/plnosti plného textu.
+        Využívá počty slov z indexu řádků, takže datový soubor není čten.
+        
+        :param rowIndex: Index řádku dokumentu.
+        :returns: bool -- True => dokument vyhovuje
+        """
+        emptyLine=self.dataLinesOffsets.tokens[rowIndex]==0
+            
+        if self.__fulltextName in self.nonEmpty and emptyLine:
+            #musí mít neprázdný plný text
+            return False 
             
-        self.metadata=newMeta     
+        if self.__fulltextName in self.empty and not emptyLine:
+            #musí mít prázdný plný text
+            return False
         
-    def __nonEmptyRegexRowFilter(self, row, rowIndex, openedDataFile=None):
+        return True
+        
+    def __nonEmptyRegexRowFilter(self, row, rowIndex, checkFulltext=False, regexCache=None):
         """
         Filtr dokumentů na základě non empty filtru a regexRowFilter.
         
         :param row: Řádek metadat.
         :param rowIndex: Udává kolikáty je toto řádek.
-        :param openedDataFile: Volitelný argument. Pokud chceme kontroloval prázdnost/plnost souboru s plnými texty.
+        :param checkFulltext: True => kontroluje prázdnost/plnost souboru s plnými texty.
+        :param regexCache: dict -- pro uchování výsledků regulárních výrazů. Klíč je název pole a hodnota dict položka -> bool.
         :returns: dict -- konvertovaný dokument | None => dokument by měl být vynechán
         """
         
         
         #kontrola pro plný text
-        if openedDataFile is not None:
-            openedDataFile.seek(self.dataLinesOffsets[rowIndex])
-            words=openedDataFile.readline().rstrip('\n').split()
-                
-            if self.__fulltextName in self.nonEmpty and len(words)==0:
-                #musí mít neprázdný plný text
-                return None 
-                
-            if self.__fulltextName in self.empty and len(words)>0:
-                #musí mít prázdný plný text
-                return None 
+        if checkFulltext and not self.__fulltextFilter(rowIndex):
+            return None
+        
         doc=dict([ (x, None) for x in row])
         for fName, fVal in row.items():
             fItems=self.__getFieldItems(fVal, fName)
             
             if self.fieldRegex and fName in self.fieldRegex:
                 reg, fl =self.fieldRegex[fName]
+                matches=regexCache.setdefault(fName, {}) if regexCache is not None else {}
                 newItems=[]
                 for ite in fItems:
-                    
-                    if re.match(reg, ite, fl):
+                    try:
+                        match=matches[ite]
+                    except KeyError:
+                        #položky se často opakují, stačí vyhodnotit jednou
+                        match=matches[ite]=re.match(reg, ite, fl) is not None
+                        
+                    if match:
                         newItems.append(ite)
                         
                 fItems=newItems
@@ -350,62 +666,290 @@ class DocReader(object):
     def __filter(self):
         """
         Filtr pro požadované dokumenty.
+        Metadata jsou přečtena v jednom průchodu, během kterého jsou aplikovány filtry non empty, empty a regex.
+        Výsledek je uložen do snímku, takže při dalším čtení stejných (případně pouze rozšířených) souborů je
+        převzat ze snímku. Poté jsou nad položkami v MetadataStore aplikovány filtry max a min.
         
         :raise DocReaderInvalidDataFileForMetadata: 
         """
         
         logging.info("začátek čtení metadat a filtrování dokumentů")
         
-        self.metadata=[]
-        with open(self.metadataFile, "r") as metadata:
-            reader = csv.DictReader(metadata)
-            self.fieldNames=reader.fieldnames
-            self.__validateFields()
-            #prvně čti a použij non empty a regex filter 
-            lineCnt=0
-            openedDataFile=None
-            if self.dataFile is not None and (self.__fulltextName in self.nonEmpty or  self.__fulltextName in self.empty):
-                #budeme potřebovat pro filtr otevřit soubor
-                openedDataFile=open(self.dataFile, "r")
+        checkFulltext=self.dataFile is not None and (self.__fulltextName in self.nonEmpty or  self.__fulltextName in self.empty)
+        
+        if not self.__loadSnapshot(checkFulltext):
+            states=self.__snapshotStates()
             
-            for row in reader:
-
-                if self.dataLinesOffsets is not None and lineCnt>=len(self.dataLinesOffsets):
+            #komprimovaný soubor s metadaty je čten postupně (bloky jsou dekomprimovány dopředu)
+            if self.workers>1 and os.path.getsize(self.metadataFile)>=self.PARALLEL_MIN_SIZE \
+                    and not BlockCompressedFile.isCompressed(self.metadataFile):
+                rowsCnt=self.__readMetadataParallel(checkFulltext)
+            else:
+                rowsCnt=self.__readMetadata(checkFulltext)
+            
+            self.__saveSnapshot(states, rowsCnt)
+        
+        #prvně čti maximální počet dokumentů a pak odsekni zbytek, který nedosáhne na minimální hodnoty
+        self.__countsFilter()
+                
+        logging.info("konec čtení metadat a filtrování dokumentů")
+        
+    def __filterIds(self):
+        """
+        Filtr pro požadované dokumenty se zadanými identifikátory.
+        Záznamy jsou přečteny přímo ze souboru s metadaty podle indexu záznamů. Poté jsou aplikovány filtry
+        non empty, empty, regex a nad vybranými dokumenty i filtry max a min.
+        
+        :raise DocReaderInvalidMetadataFields: 
+        :raise DocReaderInvalidDataFileForMetadata: 
+        """
+        
+        logging.info("začátek čtení metadat vybraných dokumentů")
+        
+        with BlockCompressedFile.open(self.metadataFile, "r") as metadata:
+            self.fieldNames=next(csv.reader(metadata), None)
+        
+        self.__validateFields()
+        if self.idField is None or self.idField not in self.fieldNames:
+            raise DocReaderInvalidMetadataFields()
+        
+        checkFulltext=self.dataFile is not None and (self.__fulltextName in self.nonEmpty or  self.__fulltextName in self.empty)
+        index=RecordIndex(self.metadataFile, self.idField)
+        
+        #kandidáti (offset záznamu, číslo řádku, pořadí požadavku)
+        candidates=[]
+        for order, recordId in enumerate(OrderedDict.fromkeys(self.ids)):
+            for rowIndex, offset in index.find(recordId):
+                candidates.append((offset, rowIndex, order, recordId))
+        
+        idPosition=max(i for i, f in enumerate(self.fieldNames) if f==self.idField)
+        regexCache={}
+        found=[]
+        
+        #záznamy čteme v pořadí souboru
+        with BlockCompressedFile.open(self.metadataFile, "rb") as metadata:
+            for offset, rowIndex, order, recordId in sorted(candidates):
+                metadata.seek(offset)
+                row=next(csv.reader(str(line, DocReaderDataFileMap.ENCODING) for line in metadata))
+                if idPosition>=len(row) or row[idPosition]!=recordId:
+                    #shoda hashe jiného identifikátoru
+                    continue
+                
+                if self.dataLinesOffsets is not None and rowIndex>=len(self.dataLinesOffsets):
                     raise DocReaderInvalidDataFileForMetadata()
                 
-                rowA=self.__nonEmptyRegexRowFilter(row, lineCnt, openedDataFile)
-                if rowA:
-                    self.metadata.append((lineCnt, rowA))
+                rowA=self.__nonEmptyRegexRowFilter(next(self.__projectRows([row])), rowIndex, checkFulltext, regexCache)
+                if rowA is not None:
+                    found.append((order, rowIndex, rowA))
+        
+        logging.info("	počet nalezených dokumentů: "+str(len(found))+" z "+str(len(self.ids)))
+        
+        found.sort(key=lambda x: (x[0], x[1]))
+        self.metadata=MetadataStore.fromRows(self.__storedFields(), ((rowIndex, rowA) for _, rowIndex, rowA in found))
+        
+        self.__countsFilter()
                 
-                lineCnt=lineCnt+1
+        logging.info("konec čtení metadat vybraných dokumentů")
+        
+    def __readMetadata(self, checkFulltext):
+        """
+        Přečte soubor s metadaty a aplikuje filtry non empty, empty a regex.
+        
+        :param checkFulltext: True => kontroluje prázdnost/plnost souboru s plnými texty.
+        :returns: int -- počet přečtených řádků
+        :raise DocReaderInvalidDataFileForMetadata: 
+        """
+        rowsCnt=[0]
+        with BlockCompressedFile.open(self.metadataFile, "r") as metadata:
+            reader = csv.reader(metadata)
+            self.fieldNames=next(reader, None)
+            self.__validateFields()
+            #prvně čti a použij non empty a regex filter 
+            regexCache={}
+            
+            def filtered():
+                lineCnt=0
+                for row in self.__projectRows(reader):
+    
+                    if self.dataLinesOffsets is not None and lineCnt>=len(self.dataLinesOffsets):
+                        raise DocReaderInvalidDataFileForMetadata()
+                    
+                    rowA=self.__nonEmptyRegexRowFilter(row, lineCnt, checkFulltext, regexCache)
+                    if rowA is not None:
+                        yield (lineCnt, rowA)
+                    
+                    lineCnt=lineCnt+1
+                    rowsCnt[0]=lineCnt
+                
+            self.metadata=MetadataStore.fromRows(self.__storedFields(), filtered())
             
-            if openedDataFile:
-                openedDataFile.close()
+        return rowsCnt[0]
             
-            self.__maxFilter()  #prvně čti maximální počet dokumentů
-            self.__minFilter()  #pak odsekni zbytek, který nedosáhne na minimální hodnoty
+    def __readMetadataParallel(self, checkFulltext):
+        """
+        Přečte soubor s metadaty paralelně a aplikuje filtry non empty, empty a regex.
+        Soubor je rozdělen na části na hranicích řádků csv. Každou část zpracuje jeden z procesů a výsledky jsou
+        spojeny v pořadí řádků, takže indexy řádků odpovídají řádkům v datovém souboru.
+        
+        :param checkFulltext: True => kontroluje prázdnost/plnost souboru s plnými texty.
+        :returns: int -- počet přečtených řádků
+        :raise DocReaderInvalidDataFileForMetadata: 
+        """
+        with open(self.metadataFile, "rb") as f:
+            mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                headerEnd=self.__csvRowEnd(mm, 0)
+                self.fieldNames=next(csv.reader(io.StringIO(str(mm[:headerEnd], DocReaderDataFileMap.ENCODING), newline=None)))
+                self.__validateFields()
                 
-        logging.info("konec čtení metadat a filtrování dokumentů")
+                #více částí než procesů, kvůli rovnoměrnějšímu rozložení práce
+                partsCnt=self.workers*4
+                step=max(1, (len(mm)-headerEnd)//partsCnt)
+                bounds=[headerEnd]
+                while bounds[-1]<len(mm):
+                    bounds.append(self.__csvRowEnd(mm, bounds[-1], bounds[-1]+step))
+            finally:
+                mm.close()
+        
+        logging.info("	počet podílejících se procesů na čtení metadat: "+ str(self.workers))
+        with multiprocessing.Pool(self.workers) as pool:
+            results=pool.map(self._readMetadataPart, zip(bounds[:-1], bounds[1:]))
+        
+        rowsShifts=[0]
+        for _, rowsCnt in results:
+            rowsShifts.append(rowsShifts[-1]+rowsCnt)
+        
+        if self.dataLinesOffsets is not None and rowsShifts[-1]>len(self.dataLinesOffsets):
+            raise DocReaderInvalidDataFileForMetadata()
+        
+        if results:
+            self.metadata=MetadataStore.concatenate([store for store, _ in results], rowsShifts[:-1])
+        else:
+            self.metadata=MetadataStore.fromRows(self.__storedFields(), [])
+        
+        if checkFulltext:
+            self.__fulltextFilterStore()
+            
+        return rowsShifts[-1]
+    
+    def __fulltextFilterStore(self):
+        """
+        Filtr dokumentů v MetadataStore na základě prázdnosti/plnosti plného textu.
+        Využívá počty slov z indexu řádků, takže datový soubor není čten.
+        """
+        emptyLines=self.dataLinesOffsets.tokens[self.metadata.rows]==0
+        keep=np.ones(len(self.metadata), dtype=np.bool_)
+        if self.__fulltextName in self.nonEmpty:
+            keep&=~emptyLines
+        if self.__fulltextName in self.empty:
+            keep&=emptyLines
+        self.metadata=self.metadata.select(keep)
+    
+    def _readMetadataPart(self, part):
+        """
+        Přečte část souboru s metadaty a aplikuje filtry non empty, empty a regex.
+        Prázdnost/plnost plného textu není kontrolována, protože nejsou známy globální indexy řádků.
+        Metoda je volána v jiném procesu, proto nemůže být privátní (pickle).
         
-    def __validateFields(self):
+        :param part: (začátek, konec) -- části v bajtech
+        :returns: (MetadataStore, počet řádků v části) -- indexy řádků v MetadataStore jsou vztaženy k začátku části
         """
-        Zjistí jestli daný soubor obshauje potřebná pole.
+        start, end=part
+        with open(self.metadataFile, "rb") as f:
+            f.seek(start)
+            chunk=str(f.read(end-start), DocReaderDataFileMap.ENCODING)
         
-        :raises DocReaderInvalidMetadataFields:
+        reader=csv.reader(io.StringIO(chunk, newline=None))
+        regexCache={}
+        rowsCnt=[0]
+        
+        def filtered():
+            for lineCnt, row in enumerate(self.__projectRows(reader)):
+                rowsCnt[0]=lineCnt+1
+                rowA=self.__nonEmptyRegexRowFilter(row, lineCnt, False, regexCache)
+                if rowA is not None:
+                    yield (lineCnt, rowA)
+        
+        store=MetadataStore.fromRows(self.__storedFields(), filtered())
+        return (store, rowsCnt[0])
+    
+    def __storedFields(self):
+        """
+        Získá názvy polí, která budou načtena. Jsou to pole z parametru fields a pole potřebná pro filtry.
+        
+        :returns: list -- názvy polí v pořadí, v jakém jsou v souboru s metadaty
+        """
+        if self.fields is None:
+            needFields=set(self.fieldNames)
+        else:
+            needFields=set(self.fields) | self.__filterFields()
+            
+        stored=[]
+        for f in self.fieldNames:
+            if f in needFields and f not in stored:
+                stored.append(f)
+        return stored
+    
+    def __projectRows(self, reader):
+        """
+        Převede řádky z csv.reader na dict pouze s načítanými poli.
+        Chová se stejně jako csv.DictReader (prázdné řádky přeskakuje a chybějícím hodnotám přiřadí None), ale
+        nevytváří položky pro nepotřebná pole.
+        
+        :param reader: csv.reader -- za hlavičkou
+        :returns: Generátor dict pro každý řádek.
+        """
+        #pokud se název pole opakuje, tak je použit poslední výskyt (stejně jako u csv.DictReader)
+        positions=dict((f, i) for i, f in enumerate(self.fieldNames))
+        columns=[(f, positions[f]) for f in self.__storedFields()]
+        
+        for row in reader:
+            if not row:
+                continue
+            rowLen=len(row)
+            yield dict((f, row[i] if i<rowLen else None) for f, i in columns)
+        
+    @staticmethod
+    def __csvRowEnd(mm, rowStart, fromPos=None):
+        """
+        Najde konec řádku csv (pozici za znakem konce řádku), který není uvnitř položky v uvozovkách.
+        
+        :param mm: mmap -- soubor s metadaty
+        :param rowStart: Pozice, na které začíná řádek csv (mimo uvozovky).
+        :param fromPos: Pozice, od které se hledá konec řádku. None => rowStart
+        :returns: int -- pozice za koncem řádku | velikost souboru
+        """
+        if fromPos is None or fromPos<rowStart:
+            fromPos=rowStart
+        if fromPos>=len(mm):
+            return len(mm)
+        
+        #lichý počet uvozovek => jsme uvnitř položky v uvozovkách
+        quotes=mm[rowStart:fromPos].count(b'"')
+        pos=fromPos
+        while True:
+            newLine=mm.find(b"\n", pos)
+            if newLine==-1:
+                return len(mm)
+            quotes+=mm[pos:newLine].count(b'"')
+            pos=newLine+1
+            if quotes%2==0:
+                return pos
+        
+    def __filterFields(self):
+        """
+        Získá názvy polí, která jsou potřebná pro filtry.
+        
+        :returns: set -- názvy polí
         """
         needFields=set()
         
         if self.nonEmpty:
             needFields.update(set(self.nonEmpty)-set([self.__fulltextName]))
-            if (self.__fulltextName is not None and self.__fulltextName in self.nonEmpty) and not self.dataFile:
-                raise DocReaderNeedDataFile();
         
         if self.empty:
             needFields.update(set(self.empty)-set([self.__fulltextName]))
             
-            if (self.__fulltextName is not None and self.__fulltextName in self.empty) and not self.dataFile:
-                raise DocReaderNeedDataFile();
-            
         if self.fieldRegex:
             needFields.update(self.fieldRegex)
             
@@ -417,11 +961,203 @@ class DocReader(object):
             
         if self.selectItems:
             needFields.update(self.selectItems)
+            
+        return needFields
+    
+    def __validateFields(self):
+        """
+        Zjistí jestli daný soubor obshauje potřebná pole.
+        
+        :raises DocReaderInvalidMetadataFields:
+        """
         
-        if not needFields.issubset(set(self.fieldNames)):
+        if self.nonEmpty and (self.__fulltextName is not None and self.__fulltextName in self.nonEmpty) and not self.dataFile:
+            raise DocReaderNeedDataFile();
+            
+        if self.empty and (self.__fulltextName is not None and self.__fulltextName in self.empty) and not self.dataFile:
+            raise DocReaderNeedDataFile();
+        
+        if not self.__filterFields().issubset(set(self.fieldNames)):
             raise DocReaderInvalidMetadataFields()
             
         
+    def rawFulltextCopyable(self):
+        """
+        Zjistí, jestli lze plné texty vybraných dokumentů zapsat kopírováním řádků datového souboru (writeRawFulltext).
+        Nelze při výběru slov a pro jiné kódování než utf-8.
+        
+        :returns: bool
+        """
+        return self.dataFile is not None and not self.selectWords and \
+            codecs.lookup(DocReaderDataFileMap.ENCODING).name=="utf-8"
+        
+    def writeRawFulltext(self, fWrite):
+        """
+        Zapíše plné texty vybraných dokumentů (v pořadí dokumentů) kopírováním řádků datového souboru.
+        Za sebou jdoucí řádky jsou čteny a zapsány najednou (nejvýše RAW_COPY_CHUNK bajtů). Výstup je stejný jako
+        " ".join(line.split()), řádky, které nejsou v této podobě (například obsahují tabulátor nebo více mezer),
+        jsou upraveny.
+        
+        :param fWrite: Soubor otevřený pro binární zápis.
+        """
+        rows=np.asarray(self.metadata.rows)
+        if rows.shape[0]==0:
+            return
+        
+        starts=self.dataLinesOffsets.offsets[rows].astype(np.int64)
+        ends=starts+self.dataLinesOffsets.lengths[rows].astype(np.int64)
+        
+        #hranice úseků řádků, které v datovém souboru následují bezprostředně za sebou
+        breaks=np.flatnonzero(starts[1:]!=ends[:-1]+1)+1
+        runs=zip(np.concatenate(([0], breaks)).tolist(), np.concatenate((breaks, [rows.shape[0]])).tolist())
+        
+        with BlockCompressedFile.open(self.dataFile, "rb") as fileToRead:
+            for runStart, runEnd in runs:
+                while runStart<runEnd:
+                    #řádky, které se vejdou do jednoho čtení (alespoň jeden)
+                    chunkEnd=max(runStart+1, runStart+int(np.searchsorted(ends[runStart:runEnd], starts[runStart]+self.RAW_COPY_CHUNK, side="right")))
+                    fileToRead.seek(int(starts[runStart]))
+                    chunk=fileToRead.read(int(ends[chunkEnd-1]-starts[runStart]))
+                    
+                    if self.RAW_NOT_NORMALIZED.search(chunk) is not None:
+                        chunk=b"\n".join(" ".join(str(line, "utf-8").split()).encode("utf-8") for line in chunk.split(b"\n"))
+                    
+                    fWrite.write(chunk)
+                    fWrite.write(b"\n")
+                    runStart=chunkEnd
+        
+    def rawMetadataCopyable(self, fields):
+        """
+        Zjistí, jestli lze metadata vybraných dokumentů zapsat kopírováním záznamů souboru s metadaty (writeRawMetadata).
+        Zapisována pole musí být všechna pole souboru s metadaty ve stejném pořadí a položky nesmí být upravovány
+        filtry (fieldRegex, minPerField, maxPerField) ani výběrem položek.
+        
+        :param fields: list -- názvy zapisovaných polí
+        :returns: bool
+        """
+        return list(fields)==list(self.fieldNames) and len(set(self.fieldNames))==len(self.fieldNames) and \
+            set(fields).issubset(self.metadata.fields) and \
+            not self.fieldRegex and not self.minPerField and not self.maxPerField and not self.selectItems and \
+            not BlockCompressedFile.isCompressed(self.metadataFile) and \
+            codecs.lookup(DocReaderDataFileMap.ENCODING).name=="utf-8"
+            
+    def writeRawMetadata(self, fWrite):
+        """
+        Zapíše metadata vybraných dokumentů (v pořadí dokumentů) kopírováním záznamů souboru s metadaty.
+        Záznam je zkopírován, pokud by jeho zápis přes csv dal stejné hodnoty polí (správný počet polí a položky
+        beze změny po rozdělení oddělovačem a odstranění bílých znaků). Ostatní záznamy jsou zapsány z načtených položek.
+        
+        :param fWrite: Soubor otevřený pro binární zápis.
+        """
+        starts, ends=self.__metadataRecords()
+        if starts.shape[0]==0:
+            return
+        
+        rows=np.asarray(self.metadata.rows)
+        fieldsCnt=len(self.fieldNames)
+        delimiter=self.itemDelimiter
+        dirty=None
+        if delimiter:
+            delimiterBytes=re.escape(delimiter.encode("utf-8"))
+            ws=self.RAW_WHITESPACE.pattern
+            dirty=re.compile(b"(?:^|,|"+delimiterBytes+b")"+ws+b"|"+ws+b"(?:$|,|"+delimiterBytes+b")")
+        
+        def transform(value):
+            if not value:
+                return ""
+            if delimiter:
+                return delimiter.join(x.strip() for x in value.split(delimiter))
+            return value
+        
+        with open(self.metadataFile, "rb") as f:
+            header=f.read(int(ends[0]))
+            terminator="\r\n" if header.endswith(b"\r\n") else "\n"
+            fWrite.write(header if header.endswith(b"\n") else header+terminator.encode("utf-8"))
+            
+            #první záznam je hlavička
+            recStarts=starts[rows+1]
+            recEnds=ends[rows+1]
+            
+            breaks=np.flatnonzero(recStarts[1:]!=recEnds[:-1])+1
+            runs=zip(np.concatenate(([0], breaks)).tolist(), np.concatenate((breaks, [rows.shape[0]])).tolist())
+            for runStart, runEnd in runs:
+                while runStart<runEnd:
+                    chunkEnd=max(runStart+1, runStart+int(np.searchsorted(recEnds[runStart:runEnd], recStarts[runStart]+self.RAW_COPY_CHUNK, side="right")))
+                    base=int(recStarts[runStart])
+                    f.seek(base)
+                    chunk=f.read(int(recEnds[chunkEnd-1])-base)
+                    
+                    out=[]
+                    for i in range(runStart, chunkEnd):
+                        record=chunk[int(recStarts[i])-base:int(recEnds[i])-base]
+                        body=record.rstrip(b"\r\n")
+                        
+                        if b"\r" in body:
+                            #konce řádků uvnitř hodnot jsou při čtení v textovém režimu převedeny na \n
+                            raw=False
+                        elif b'"' not in body:
+                            raw=body.count(b",")==fieldsCnt-1 and (dirty is None or dirty.search(body) is None)
+                        else:
+                            row=next(csv.reader([str(body, "utf-8")]), [])
+                            raw=len(row)==fieldsCnt and all(v==transform(v) for v in row)
+                        
+                        if raw:
+                            out.append(body)
+                        else:
+                            mData=self.metadata.row(i)
+                            rowStr=io.StringIO()
+                            #s prázdným zakončením by csv nedával do uvozovek hodnoty se znaky konce řádku
+                            csv.writer(rowStr, lineterminator=terminator).writerow(
+                                [(delimiter if delimiter else "").join(mData[k]) if mData[k] is not None else "" for k in self.fieldNames])
+                            out.append(rowStr.getvalue()[:-len(terminator)].encode("utf-8"))
+                    
+                    out.append(b"")
+                    fWrite.write(terminator.encode("utf-8").join(out))
+                    runStart=chunkEnd
+    
+    def __metadataRecords(self):
+        """
+        Najde záznamy csv v souboru s metadaty (záznam může mít více řádků, pokud obsahuje položku v uvozovkách
+        se znakem konce řádku). Prázdné řádky jsou přeskočeny stejně jako při čtení metadat.
+        
+        :returns: (numpy.array, numpy.array) -- začátky a konce (za znakem konce řádku) záznamů. První záznam je hlavička.
+        """
+        with open(self.metadataFile, "rb") as f:
+            try:
+                mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                #prázdný soubor
+                return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+            
+        try:
+            endsParts=[]
+            parity=0    #počet uvozovek před aktuální částí (mod 2)
+            for pos in range(0, len(mm), self.RAW_COPY_CHUNK):
+                buffer=np.frombuffer(mm, dtype=np.uint8, count=min(self.RAW_COPY_CHUNK, len(mm)-pos), offset=pos)
+                newLines=np.flatnonzero(buffer==ord("\n"))
+                quotes=np.cumsum(buffer==ord('"'), dtype=np.int64)
+                #konec záznamu je pouze znak konce řádku mimo uvozovky
+                endsParts.append(newLines[(quotes[newLines]+parity)%2==0]+pos+1)
+                parity=(parity+int(quotes[-1]))%2
+                del buffer
+                
+            ends=np.concatenate(endsParts) if endsParts else np.zeros(0, dtype=np.int64)
+            if len(mm)>0 and (ends.shape[0]==0 or ends[-1]!=len(mm)):
+                ends=np.append(ends, len(mm))
+            starts=np.concatenate(([0], ends[:-1])).astype(np.int64)
+            
+            #prázdné řádky (jen znak konce řádku)
+            short=np.flatnonzero(ends-starts<=2)
+            blank=[i for i in short.tolist() if i>0 and mm[int(starts[i]):int(ends[i])] in (b"\n", b"\r\n")]
+            if blank:
+                keep=np.ones(starts.shape[0], dtype=np.bool_)
+                keep[blank]=False
+                starts, ends=starts[keep], ends[keep]
+        finally:
+            mm.close()
+            
+        return (starts, ends)
+        
     def fieldsStatsNonFiltered(self, fields):
         """
         Počítá dokumenty odpovídající položkám v polích. (bez filtrů)
@@ -430,7 +1166,7 @@ class DocReader(object):
         :returns: dict -- se statistikami
         """
 
-        with open(self.metadataFile, "r") as metadata:
+        with BlockCompressedFile.open(self.metadataFile, "r") as metadata:
             reader = csv.DictReader(metadata)
             
             fieldsCnt=dict([(f, {}) for f in fields])
@@ -450,17 +1186,7 @@ class DocReader(object):
         :param fields: list -- jmén polí
         :returns: dict -- se statistikami
         """
-        fieldsCnt=dict([(f, {}) for f in fields])
-        
-        for mData in self.metadata:
-            for f in fields:
-                if mData[1][f] is not None:
-                    for ite in mData[1][f]:
-                        if ite not in fieldsCnt[f]:
-                            fieldsCnt[f][ite]=0
-                        fieldsCnt[f][ite]=fieldsCnt[f][ite]+1
-                    
-        return fieldsCnt
+        return self.metadata.fieldsStats(fields)
     
     def __getFieldItems(self, field, name):
         """
@@ -490,7 +1216,9 @@ class DocReader(object):
         Zamíchá dokumenty.
         """
         logging.info("začátek míchání dokumentů")
-        shuffle(self.metadata)
+        order=list(range(len(self.metadata)))
+        shuffle(order)
+        self.metadata=self.metadata.select(np.array(order, dtype=np.int64))
         logging.info("konec míchání dokumentů")
 
 class DocReaderData(DocReader):
@@ -518,7 +1246,7 @@ class DocReaderMetadata(DocReader):
     Třída pro čtení metadat dokumentů ze souboru.
     """  
     def __init__(self, metadataFile, nonEmpty=None, empty=None, fieldRegex=None, minPerField=None, maxPerField=None,
-                  initMetadata=None, itemDelimiter=None, selectItems=None):
+                  initMetadata=None, itemDelimiter=None, selectItems=None, workers=1, fields=None, cacheDir=None, ids=None, idField=None):
         """
         Konstruktor DocReaderMetadata.
         
@@ -537,10 +1265,16 @@ class DocReaderMetadata(DocReader):
             Když je tento parametr použitý: nonEmpty, minPerField a maxPerField jsou ignorovány.
         :param itemDelimiter: Oddělovač (řetězec), který separuje položky v poli.
         :param selectItems dict -- klíč je název pole a hodnota je slice/integer pro vybrání položek.
+        :param workers: Počet procesů pro čtení souboru s metadaty. -1 => Automaticky dle počtu CPU.
+        :param fields: Názvy polí metadat, která budou načtena. Pole potřebná pro filtry jsou přidána automaticky. None => všechna pole.
+        :param cacheDir: Adresář pro snímky vyfiltrovaných metadat. None => snímky nejsou používány.
+        :param ids: list -- identifikátory dokumentů (hodnoty pole idField), které budou načteny. None => všechny dokumenty.
+        :param idField: Název pole s identifikátorem dokumentu. Povinné pokud je zadáno ids.
         """
         
         super().__init__(None, metadataFile, nonEmpty=nonEmpty, empty=empty, fieldRegex=fieldRegex, minPerField=minPerField, maxPerField=maxPerField,
-                  initMetadata=initMetadata, itemDelimiter=itemDelimiter,  selectItems=selectItems)
+                  initMetadata=initMetadata, itemDelimiter=itemDelimiter,  selectItems=selectItems, workers=workers, fields=fields, cacheDir=cacheDir,
+                  ids=ids, idField=idField)
         
     def __iter__(self):
         """
@@ -556,7 +1290,7 @@ class DocReaderMetadata(DocReader):
         :returns: list -- metadata
         """
         for _, mData in self.metadata:
-            yield mData.copy()
+            yield mData
             
     def toData(self):
         """
@@ -574,11 +1308,295 @@ class DocReaderMetadata(DocReader):
         """
         return [doc for doc in self.read()]
 
+class DocReaderDataFileMap(object):
+    """
+    Sdílený přístup k datovému souboru pomocí mmap.
+    V rámci jednoho procesu je každý soubor namapován jen jednou a sdílen všemi DocReaderDataString, které z něj čtou.
+    Řádky jsou vraceny jako memoryview do namapovaného souboru, takže nedochází ke kopírování dat.
+    Komprimovaný soubor nelze namapovat, proto je čten pomocí BlockCompressedFile (dekomprimován je pouze blok s řádkem).
+    """
+    
+    __maps={}   #cesta k souboru -> (mmap, memoryview, (velikost, čas modifikace))
+    
+    ENCODING=locale.getpreferredencoding(False)   #stejné kódování, jaké používá open v textovém režimu
+    
+    @classmethod
+    def line(cls, filename, lineOffset, length=None):
+        """
+        Získá řádek začínající na daném offsetu (bez znaku konce řádku).
+        
+        :param filename: string -- cesta k souboru pro čtení
+        :param lineOffset: int -- offset řádku
+        :param length: int -- délka řádku v bajtech (například z LinesIndex), případně jen jeho požadované části.
+            None => konec řádku je hledán v souboru.
+        :returns: memoryview -- řádek
+        """
+        mapped=cls.__getMap(filename)
+        if mapped is None:
+            return memoryview(b"")
+        
+        mm, view, _ = mapped
+        lineOffset=int(lineOffset)
+        if isinstance(mm, BlockCompressedFile):
+            return memoryview(mm.line(lineOffset, None if length is None else int(length)))
+        
+        if length is not None:
+            return view[lineOffset:lineOffset+int(length)]
+        
+        end=mm.find(b"\n", lineOffset)
+        if end==-1:
+            end=len(mm)
+        
+        return view[lineOffset:end]
+    
+    @classmethod
+    def lineStr(cls, filename, lineOffset, length=None):
+        """
+        Získá řádek začínající na daném offsetu (bez znaku konce řádku) jako string.
+        
+        :param filename: string -- cesta k souboru pro čtení
+        :param lineOffset: int -- offset řádku
+        :param length: int -- délka řádku v bajtech. None => konec řádku je hledán v souboru.
+        :returns: string -- řádek
+        """
+        return str(cls.line(filename, lineOffset, length), cls.ENCODING)
+    
+    @classmethod
+    def refresh(cls, filename):
+        """
+        Zkontroluje, zda-li se namapovaný soubor nezměnil. Pokud ano, uvolní jej (při dalším čtení bude namapován znovu)
+        a vyprázdní cache slov v DocReaderDataString.
+        
+        :param filename: string -- cesta k souboru
+        """
+        if filename in cls.__maps and cls.__maps[filename][2]!=cls.__identity(filename):
+            cls.release(filename)
+            DocReaderDataString.clearTokensCache()
+    
+    @classmethod
+    def release(cls, filename=None):
+        """
+        Uvolní namapovaný soubor.
+        
+        :param filename: string -- cesta k souboru. None => uvolní všechny.
+        """
+        for f in ([filename] if filename is not None else list(cls.__maps)):
+            if f in cls.__maps:
+                mm, view, _=cls.__maps.pop(f)
+                if isinstance(mm, BlockCompressedFile):
+                    mm.close()
+                elif view is not None:
+                    try:
+                        view.release()
+                        mm.close()
+                    except BufferError:
+                        #někdo stále drží část řádku, soubor bude uzavřen až garbage collectorem
+                        pass
+    
+    @classmethod
+    def __getMap(cls, filename):
+        """
+        Získá namapovaný soubor. Pokud ještě není namapován, tak jej namapuje.
+        
+        :param filename: string -- cesta k souboru
+        :returns: (mmap, memoryview) | (BlockCompressedFile, BlockCompressedFile) | None -- prázdný soubor nelze namapovat
+        """
+        try:
+            mapped=cls.__maps[filename]
+        except KeyError:
+            if BlockCompressedFile.isCompressed(filename):
+                identity=cls.__identity(filename)
+                compressed=BlockCompressedFile(filename)
+                mapped=(compressed, compressed, identity) if compressed.size>0 else (None, None, identity)
+                cls.__maps[filename]=mapped
+                return mapped if mapped[1] is not None else None
+            
+            with open(filename, "rb") as f:
+                identity=cls.__identity(filename)
+                try:
+                    mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    mapped=(mm, memoryview(mm), identity)
+                except ValueError:
+                    #prázdný soubor
+                    mapped=(None, None, identity)
+            cls.__maps[filename]=mapped
+            
+        if mapped[1] is None:
+            return None
+        return mapped
+    
+    @staticmethod
+    def __identity(filename):
+        """
+        Získá údaje identifikující verzi souboru.
+        
+        :param filename: string -- cesta k souboru
+        :returns: (velikost, čas modifikace v ns)
+        """
+        st=os.stat(filename)
+        return (st.st_size, st.st_mtime_ns)
+    
+class DocReaderWordsSelector(object):
+    """
+    Výběr slov (SELECT_WORDS) z řádku datového souboru bez čtení a dělení celého řádku.
+    
+    Pokud výběr potřebuje pouze prvních k slov (nezáporný slice s koncem, nezáporný index), je řádek čten od začátku
+    po částech, dokud není přečteno alespoň k slov. Pokud potřebuje pouze posledních k slov (záporný začátek slice
+    a záporný/žádný konec, záporný index), je řádek čten od konce. Ostatní výběry přečtou celý řádek.
+    Části řádku jsou děleny pouze na ASCII bílých znacích, takže žádné slovo (ani vícebajtový znak) není rozděleno.
+    """
+    
+    MIN_CHUNK=2**12         #minimální počet bajtů přečtených najednou
+    BYTES_PER_WORD=8        #odhad průměrné délky slova (včetně oddělovače) pro první čtení
+    WHITESPACES=b" \t\n\r\x0b\x0c"
+    
+    @staticmethod
+    def needed(selectWords):
+        """
+        Zjistí, kolik slov ze začátku nebo konce řádku výběr potřebuje.
+        
+        :param selectWords: slice/integer -- výběr slov
+        :returns: (bool, int)|None -- (True => od začátku False => od konce, počet slov). None => je nutné číst celý řádek.
+        """
+        if isinstance(selectWords, int):
+            return (True, selectWords+1) if selectWords>=0 else (False, -selectWords)
+        
+        if isinstance(selectWords, slice) and (selectWords.step is None or selectWords.step>0):
+            start, stop=selectWords.start, selectWords.stop
+            if (start is None or start>=0) and stop is not None and stop>=0:
+                return (True, stop)
+            if start is not None and start<0 and (stop is None or stop<0):
+                return (False, -start)
+        
+        return None
+    
+    @classmethod
+    def select(cls, read, length, selectWords, encoding):
+        """
+        Vybere slova z řádku.
+        
+        :param read: Funkce (začátek, konec) -> bytes, která přečte část řádku (pozice jsou relativní k začátku řádku).
+        :param length: int -- délka řádku v bajtech (bez znaku konce řádku)
+        :param selectWords: slice/integer -- výběr slov
+        :param encoding: Kódování datového souboru.
+        :returns: Vybraná slova (stejně jako line.split()[selectWords]).
+        """
+        needed=cls.needed(selectWords) if "a".encode(encoding)==b"a" else None
+        
+        if needed is None or needed[1]<=0:
+            return str(read(0, length), encoding).split()[selectWords]
+        
+        fromStart, wordsCnt=needed
+        size=max(cls.MIN_CHUNK, wordsCnt*cls.BYTES_PER_WORD)
+        buffer=b""
+        while True:
+            size=min(size, length)
+            if fromStart:
+                buffer+=read(len(buffer), size)
+                if size>=length:
+                    words=str(buffer, encoding).split()
+                else:
+                    cut=cls.__lastWhitespace(buffer)
+                    words=str(buffer[:cut], encoding).split() if cut!=-1 else []
+            else:
+                buffer=read(length-size, length-len(buffer))+buffer
+                if size>=length:
+                    words=str(buffer, encoding).split()
+                else:
+                    cut=cls.__firstWhitespace(buffer)
+                    words=str(buffer[cut+1:], encoding).split() if cut!=-1 else []
+            
+            if len(words)>=wordsCnt or size>=length:
+                return words[selectWords]
+            
+            size*=2
+    
+    @classmethod
+    def __lastWhitespace(cls, buffer):
+        """
+        Najde poslední ASCII bílý znak.
+        
+        :param buffer: bytes
+        :returns: int -- pozice. -1 => nenalezen
+        """
+        pos=-1
+        for w in cls.WHITESPACES:
+            pos=max(pos, buffer.rfind(w, pos+1))
+        return pos
+    
+    @classmethod
+    def __firstWhitespace(cls, buffer):
+        """
+        Najde první ASCII bílý znak.
+        
+        :param buffer: bytes
+        :returns: int -- pozice. -1 => nenalezen
+        """
+        pos=len(buffer)
+        for w in cls.WHITESPACES:
+            found=buffer.find(w, 0, pos)
+            if found!=-1:
+                pos=found
+        return pos if pos<len(buffer) else -1
+    
+    @classmethod
+    def fromFile(cls, f, lineOffset, length, selectWords):
+        """
+        Vybere slova z řádku binárního souboru.
+        
+        :param f: Soubor otevřený pro binární čtení (podporující seek).
+        :param lineOffset: int -- offset řádku
+        :param length: int -- délka řádku v bajtech (bez znaku konce řádku)
+        :param selectWords: slice/integer -- výběr slov
+        :returns: Vybraná slova.
+        """
+        lineOffset=int(lineOffset)
+        
+        def read(start, end):
+            f.seek(lineOffset+start)
+            return f.read(end-start)
+        
+        return cls.select(read, int(length), selectWords, DocReaderDataFileMap.ENCODING)
+    
+    @classmethod
+    def fromBuffer(cls, line, selectWords):
+        """
+        Vybere slova z řádku v paměti (například memoryview do namapovaného souboru).
+        
+        :param line: memoryview|bytes -- řádek bez znaku konce řádku
+        :param selectWords: slice/integer -- výběr slov
+        :returns: Vybraná slova.
+        """
+        return cls.select(lambda start, end: bytes(line[start:end]), len(line), selectWords, DocReaderDataFileMap.ENCODING)
+    
+    @classmethod
+    def fromMap(cls, filename, lineOffset, length, selectWords):
+        """
+        Vybere slova z řádku souboru sdíleného přes DocReaderDataFileMap. Čtou se pouze potřebné části řádku, takže
+        ani u komprimovaného souboru není nutné získat celý řádek.
+        
+        :param filename: string -- cesta k souboru pro čtení
+        :param lineOffset: int -- offset řádku
+        :param length: int -- délka řádku v bajtech (bez znaku konce řádku)
+        :param selectWords: slice/integer -- výběr slov
+        :returns: Vybraná slova.
+        """
+        lineOffset=int(lineOffset)
+        return cls.select(lambda start, end: bytes(DocReaderDataFileMap.line(filename, lineOffset+start, end-start)),
+                          int(length), selectWords, DocReaderDataFileMap.ENCODING)
+    
 class DocReaderDataString(object):
     """
     Třída pro líné vyhodnocení. Je vhodná pro úsporu paměti.
+    Data čte přes sdílený DocReaderDataFileMap.
+    Naposledy rozdělené řádky jsou uchovávány v malé cache (TOKENS_CACHE_SIZE), takže například zavolání len() a následná
+    iterace nerozděluje řádek dvakrát.
     """
     
+    TOKENS_CACHE_SIZE=64    #maximální počet dokumentů v cache slov. 0 => cache se nepoužívá
+    
+    __tokensCache=OrderedDict()
+    
     def __init__(self, *args, **kwargs):
         """
         Konstruktor.
@@ -588,6 +1606,9 @@ class DocReaderDataString(object):
         :param offsetOnLine: list -- offset na řádku, který by měl být přečtený
         :param readLength: list -- maximální délka řetězce
         :param selectWords: slice -- pro výběr slov v dokumentu
+        :param tokensCount: int -- počet slov na celém řádku (například z LinesIndex). Pokud je znám, tak len() nečte soubor.
+        :param lineLength: int -- délka celého řádku v bajtech (například z LinesIndex). Pokud je známa, tak se v souboru
+            nehledá konec řádku a pro výběr slov se čtou jen potřebné části řádku.
         """
         self.filename=args[0]
         self.lineOffset = args[1]
@@ -597,7 +1618,15 @@ class DocReaderDataString(object):
         
         self.selectWords=args[4] if len(args)>4 else None
             
+        self.lineLength=kwargs.get("lineLength")
+            
         self.len=None
+        tokensCount=kwargs.get("tokensCount")
+        if tokensCount is not None and self.offsetOnLine is None and self.readLength is None:
+            if not self.selectWords:
+                self.len=tokensCount
+            elif isinstance(self.selectWords, slice):
+                self.len=len(range(tokensCount)[self.selectWords])
         
         
     def __len__(self):
@@ -610,35 +1639,83 @@ class DocReaderDataString(object):
             self.len=len(self.__readMyWords())
         return self.len
     
+    @classmethod
+    def clearTokensCache(cls):
+        """
+        Vyprázdní cache slov.
+        """
+        DocReaderDataString.__tokensCache.clear()
+    
     def __readMyLinePart(self):
         """
         Čte definovanou část z definovaného řádku.
         
         :returns: definovanou část řádku
         """
-        with open(self.filename, "r") as fileToRead:
-            fileToRead.seek(self.lineOffset)
-            line=fileToRead.readline().rstrip('\n')
+        line=DocReaderDataFileMap.lineStr(self.filename, self.lineOffset, self.lineLength)
+        
+        if self.offsetOnLine and self.readLength:
+            line=line[self.offsetOnLine:(self.offsetOnLine+self.readLength)]
+        elif self.offsetOnLine:
+            line=line[self.offsetOnLine:]
+        elif self.readLength:
+            line=line[:self.readLength]
             
-            if self.offsetOnLine and self.readLength:
-                line=line[self.offsetOnLine:(self.offsetOnLine+self.readLength)]
-            elif self.offsetOnLine:
-                line=line[self.offsetOnLine:]
-            elif self.readLength:
-                line=line[:self.readLength]
-                
-            return line
+        return line
         
     def __readMyWords(self):
         """
         Přečtení jenom vybraných slov.
+        Pokud se čte celý řádek, tak je výběr slov proveden již při čtení (viz DocReaderWordsSelector).
         
         :returns: vybraná slova
         """
-        if self.selectWords:
-            return self.__readMyLinePart().split()[self.selectWords]
-        return self.__readMyLinePart().split()
+        if self.selectWords and self.offsetOnLine is None and self.readLength is None:
+            sel=self.selectWords
+            if self.lineLength is None:
+                read=lambda: DocReaderWordsSelector.fromBuffer(DocReaderDataFileMap.line(self.filename, self.lineOffset), sel)
+            else:
+                read=lambda: DocReaderWordsSelector.fromMap(self.filename, self.lineOffset, self.lineLength, sel)
+                
+            return self.__cachedWords((self.filename, self.lineOffset, sel.start, sel.stop, sel.step) if isinstance(sel, slice) \
+                                        else (self.filename, self.lineOffset, sel), read)
             
+        words=self.__readMyAllWords()
+        if self.selectWords:
+            return words[self.selectWords]
+        return words
+    
+    def __readMyAllWords(self):
+        """
+        Přečtení všech slov z definované části řádku. Využívá cache slov.
+        
+        :returns: slova
+        """
+        return self.__cachedWords((self.filename, self.lineOffset, self.offsetOnLine, self.readLength), 
+                                  lambda: self.__readMyLinePart().split())
+    
+    def __cachedWords(self, key, read):
+        """
+        Získá slova z cache slov. Pokud v ní nejsou, tak je přečte a uloží.
+        
+        :param key: Klíč v cache.
+        :param read: Funkce pro přečtení slov.
+        :returns: slova
+        """
+        if self.TOKENS_CACHE_SIZE<=0:
+            return read()
+        
+        cache=DocReaderDataString.__tokensCache
+        try:
+            words=cache[key]
+            cache.move_to_end(key)
+        except KeyError:
+            words=read()
+            cache[key]=words
+            while len(cache)>self.TOKENS_CACHE_SIZE:
+                cache.popitem(last=False)
+                
+        return words
         
     def __getitem__(self, ind):
         """
@@ -684,7 +1761,8 @@ class DocReaderDataString(object):
         chunks=[]
         for x in range(0, len(words), maxWords):
             lastWord=words[x: x + maxWords][-1]
-            chunks.append(DocReaderDataString(self.filename, self.lineOffset, words[x][0], lastWord[0]+lastWord[1]-words[x][0]))
+            chunks.append(DocReaderDataString(self.filename, self.lineOffset, words[x][0], lastWord[0]+lastWord[1]-words[x][0],
+                                              lineLength=self.lineLength))
 
         return chunks
     
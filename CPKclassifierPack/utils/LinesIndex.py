@@ -0,0 +1,317 @@
+# -*- coding: UTF-8 -*-
+"""
+Obsahuje třídu pro perzistentní index offsetů řádků datového souboru.
+
+:author:     Martin Dočekal
+:contact:    xdocek09@stud.fit.vubtr.cz
+
+"""
+
+import os
+import struct
+import logging
+
+import numpy as np
+
+from .BlockCompressedFile import BlockCompressedFile
+
+class LinesIndexInvalidFile(Exception):
+    """
+    Soubor s indexem je poškozený nebo nepatří k danému datovému souboru.
+    """
+    pass
+
+class LinesIndex(object):
+    """
+    Index offsetů řádků datového souboru (jeden dokument na řádek).
+    U komprimovaného datového souboru (BlockCompressedFile) jsou offsety vztaženy k dekomprimovaným datům.
+
+    Kromě offsetů obsahuje pro každý řádek počet slov (tokens) a délku v bajtech bez znaku konce řádku (lengths).
+    Obojí je spočítáno ve stejném průchodu souborem jako offsety. Za oddělovače slov jsou považovány stejné bílé znaky
+    jako u str.split() (soubor je v utf-8), tedy i nezlomitelná mezera a další unicode mezery.
+
+    Index je uložen vedle datového souboru (datový soubor + EXTENSION) jako hlavička a pole uint64
+    (všechny offsety, poté všechny počty slov a nakonec všechny délky).
+    Hlavička obsahuje velikost a čas poslední modifikace datového souboru. Pokud neodpovídají,
+    je index považován za neplatný a je vytvořen znovu.
+
+    Uložený index je mapován do paměti (jen pro čtení), takže jej více procesů sdílí přes cache
+    operačního systému. Při serializaci (např. předání do jiného procesu) se předává pouze cesta
+    k indexu a ten je v cílovém procesu znovu namapován.
+    """
+
+    EXTENSION=".lidx"
+    MAGIC=b"CPKLIDX\x00"
+    VERSION=3
+    COLUMNS=3      #offsety, počty slov, délky řádků
+
+    #magic, verze, počet sloupců, velikost datového souboru, čas modifikace (ns), počet řádků
+    HEADER=struct.Struct("<8sIIQQQ")
+
+    READ_SIZE=2**24    #kolik bajtů se bude naráz číst při vytváření indexu
+
+    #tabulka jednobajtových znaků, které oddělují slova
+    WHITESPACES=np.zeros(256, dtype=np.bool_)
+    WHITESPACES[list(b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f")]=True
+    
+    #první bajty vícebajtových bílých znaků v utf-8 (viz __markUnicodeWhitespaces)
+    UNICODE_WHITESPACES_LEADS=(b"\xc2", b"\xe1", b"\xe2", b"\xe3")
+
+    def __init__(self, dataFile, persist=True):
+        """
+        Otevře index k datovému souboru. Pokud neexistuje, nebo je neplatný, tak jej vytvoří.
+
+        :param dataFile: Cesta k datovému souboru.
+        :param persist: True => pokusí se nově vytvořený index uložit vedle datového souboru.
+        """
+
+        self.dataFile=dataFile
+        self.indexFile=dataFile+self.EXTENSION
+
+        self.columns=None
+
+        try:
+            self.columns=self.__load()
+        except (LinesIndexInvalidFile, IOError, ValueError):
+            self.columns=None
+
+        if self.columns is None:
+            columns=self.__build()
+
+            if persist and self.__save(columns):
+                self.columns=self.__load()
+            else:
+                self.columns=columns
+
+    @property
+    def offsets(self):
+        """
+        Offsety řádků.
+        """
+        return self.columns[0]
+
+    @property
+    def tokens(self):
+        """
+        Počty slov na řádcích.
+        """
+        return self.columns[1]
+
+    @property
+    def lengths(self):
+        """
+        Délky řádků v bajtech (bez znaku konce řádku).
+        """
+        return self.columns[2]
+
+    def __len__(self):
+        """
+        Počet řádků.
+        """
+        return self.offsets.shape[0]
+
+    def __getitem__(self, ind):
+        """
+        Offset řádku na daném indexu.
+
+        :param ind: Index řádku (int) nebo slice.
+        :returns: int -- offset | numpy.array -- offsety pro slice
+        """
+        if isinstance(ind, slice):
+            return self.offsets[ind]
+
+        return int(self.offsets[ind])
+
+    def __iter__(self):
+        """
+        Iteruje přes offsety řádků.
+        """
+        for x in self.offsets:
+            yield int(x)
+
+    def __getstate__(self):
+        """
+        Při serializaci předáváme pouze cestu, pokud je index uložený.
+        """
+        state=self.__dict__.copy()
+        if isinstance(self.columns, np.memmap):
+            state["columns"]=None
+        return state
+
+    def __setstate__(self, state):
+        """
+        Obnovení ze serializované podoby. Uložený index je znovu namapován.
+        """
+        self.__dict__.update(state)
+        if self.columns is None:
+            self.columns=self.__load()
+
+    def __deepcopy__(self, memo):
+        """
+        Index je pouze pro čtení, proto není nutné vytvářet kopii.
+        """
+        return self
+
+    def __dataFileIdentity(self):
+        """
+        Získá údaje identifikující verzi datového souboru.
+
+        :returns: (velikost, čas modifikace v ns)
+        """
+        st=os.stat(self.dataFile)
+        return (st.st_size, st.st_mtime_ns)
+
+    def __load(self):
+        """
+        Načte uložený index. Kontroluje, jestli odpovídá datovému souboru.
+
+        :returns: numpy.memmap|numpy.array -- sloupce indexu (COLUMNS x počet řádků)
+        :raises LinesIndexInvalidFile: Neplatný index.
+        """
+
+        with open(self.indexFile, "rb") as f:
+            header=f.read(self.HEADER.size)
+
+        if len(header)!=self.HEADER.size:
+            raise LinesIndexInvalidFile()
+
+        magic, version, columns, dataSize, dataMtime, lines=self.HEADER.unpack(header)
+
+        if magic!=self.MAGIC or version!=self.VERSION or columns!=self.COLUMNS:
+            raise LinesIndexInvalidFile()
+
+        if (dataSize, dataMtime)!=self.__dataFileIdentity():
+            logging.info("index offsetů řádků neodpovídá datovému souboru: "+self.dataFile)
+            raise LinesIndexInvalidFile()
+
+        if lines==0:
+            return np.zeros((self.COLUMNS, 0), dtype="<u8")
+
+        return np.memmap(self.indexFile, dtype="<u8", mode="r", offset=self.HEADER.size, shape=(self.COLUMNS, lines))
+
+    def __save(self, columns):
+        """
+        Uloží index vedle datového souboru.
+
+        :param columns: numpy.array -- sloupce indexu (COLUMNS x počet řádků)
+        :returns: bool -- True uloženo. False nelze uložit.
+        """
+        tmpFile=self.indexFile+".tmp"+str(os.getpid())
+        try:
+            dataSize, dataMtime=self.__dataFileIdentity()
+            with open(tmpFile, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.COLUMNS, dataSize, dataMtime, columns.shape[1]))
+                f.write(np.ascontiguousarray(columns, dtype="<u8").tobytes())
+
+            os.replace(tmpFile, self.indexFile)
+        except (IOError, OSError):
+            logging.info("index offsetů řádků nelze uložit: "+self.indexFile)
+            if os.path.isfile(tmpFile):
+                os.remove(tmpFile)
+            return False
+
+        return True
+
+    def __build(self):
+        """
+        Projde datový soubor a vytvoří index offsetů řádků, počtů slov a délek řádků.
+
+        :returns: numpy.array -- sloupce indexu (COLUMNS x počet řádků)
+        """
+        logging.info("začátek vytváření indexu offsetů řádků: "+self.dataFile)
+
+        parts=[np.zeros(1, dtype="<u8")]
+        tokensParts=[]
+        lineTokens=0        #počet slov rozpracovaného řádku
+        prevWhitespace=True #předchozí bajt (z minulého bloku) byl bílý znak
+        fileSize=0
+        carry=b""           #nedokončený vícebajtový znak z konce minulého bloku
+        with BlockCompressedFile.open(self.dataFile, "rb") as f:
+            while True:
+                data=f.read(self.READ_SIZE)
+                chunk=carry+data
+                if not chunk:
+                    break
+                
+                carry=b""
+                if data:
+                    #blok nesmí končit uprostřed vícebajtového znaku
+                    cut=self.__incompleteCharStart(chunk)
+                    chunk, carry=chunk[:cut], chunk[cut:]
+                    if not chunk:
+                        continue
+
+                chunkBytes=np.frombuffer(chunk, dtype=np.uint8)
+                newLines=np.flatnonzero(chunkBytes==10)
+                parts.append(newLines.astype("<u8")+(fileSize+1))
+
+                #slovo začíná znakem, který není bílý a předchází mu bílý znak
+                whitespaces=self.WHITESPACES[chunkBytes]
+                if any(lead in chunk for lead in self.UNICODE_WHITESPACES_LEADS):
+                    self.__markUnicodeWhitespaces(chunkBytes, whitespaces)
+                starts=~whitespaces
+                starts[1:]&=whitespaces[:-1]
+                starts[0]&=prevWhitespace
+                prevWhitespace=whitespaces[-1]
+
+                #přiřazení začátků slov k řádkům, první přihrádka patří rozpracovanému řádku
+                counts=np.bincount(np.searchsorted(newLines, np.flatnonzero(starts), side="right"), minlength=newLines.shape[0]+1)
+                counts[0]+=lineTokens
+                tokensParts.append(counts[:-1].astype("<u8"))
+                lineTokens=int(counts[-1])
+
+                fileSize+=len(chunk)
+
+        offsets=np.concatenate(parts)
+        tokens=np.concatenate(tokensParts+[np.array([lineTokens], dtype="<u8")])
+        #řádek končí znakem konce řádku před dalším řádkem, poslední řádek koncem souboru
+        lengths=np.append(offsets[1:]-1, np.uint64(fileSize))-offsets
+
+        columns=np.stack((offsets, tokens, lengths))
+
+        if offsets[-1]>=fileSize:
+            #za posledním znakem konce řádku už není žádný řádek (nebo je soubor prázdný)
+            columns=columns[:, :-1]
+
+        logging.info("konec vytváření indexu offsetů řádků: "+self.dataFile)
+        return columns
+
+    @staticmethod
+    def __incompleteCharStart(chunk):
+        """
+        Najde začátek vícebajtového znaku utf-8, který není na konci bloku dokončen.
+
+        :param chunk: bytes -- blok dat
+        :returns: int -- pozice začátku nedokončeného znaku. Délka bloku, pokud blok končí celým znakem.
+        """
+        for i in range(len(chunk)-1, max(len(chunk)-4, -1), -1):
+            byte=chunk[i]
+            if byte & 0xC0!=0x80:
+                #první bajt znaku
+                length=4 if byte>=0xF0 else 3 if byte>=0xE0 else 2 if byte>=0xC0 else 1
+                return i if i+length>len(chunk) else len(chunk)
+
+        return len(chunk)
+
+    @staticmethod
+    def __markUnicodeWhitespaces(chunkBytes, whitespaces):
+        """
+        Označí všechny bajty vícebajtových bílých znaků (str.split) v utf-8:
+        U+0085, U+00A0, U+1680, U+2000-U+200A, U+2028, U+2029, U+202F, U+205F a U+3000.
+
+        :param chunkBytes: numpy.array -- bajty bloku
+        :param whitespaces: numpy.array -- příznaky bílých znaků pro bajty bloku, do kterých se označuje
+        """
+        b0, b1=chunkBytes[:-1], chunkBytes[1:]
+        two=(b0==0xC2) & ((b1==0x85) | (b1==0xA0))
+        whitespaces[:-1]|=two
+        whitespaces[1:]|=two
+
+        b0, b1, b2=chunkBytes[:-2], chunkBytes[1:-1], chunkBytes[2:]
+        three=((b0==0xE1) & (b1==0x9A) & (b2==0x80)) \
+            | ((b0==0xE2) & (b1==0x80) & (((b2>=0x80) & (b2<=0x8A)) | (b2==0xA8) | (b2==0xA9) | (b2==0xAF))) \
+            | ((b0==0xE2) & (b1==0x81) & (b2==0x9F)) \
+            | ((b0==0xE3) & (b1==0x80) & (b2==0x80))
+        whitespaces[:-2]|=three
+        whitespaces[1:-1]|=three
+        whitespaces[2:]|=three
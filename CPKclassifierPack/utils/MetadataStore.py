@@ -0,0 +1,359 @@
+# -*- coding: UTF-8 -*-
+"""
+Obsahuje třídu pro sloupcové uložení metadat dokumentů.
+
+:author:     Martin Dočekal
+:contact:    xdocek09@stud.fit.vubtr.cz
+
+"""
+
+from array import array
+import json
+import os
+import shutil
+
+import numpy as np
+
+class MetadataStore(object):
+    """
+    Sloupcové uložiště metadat dokumentů.
+
+    Namísto listu dvojic (index řádku, {pole: [položky]}) jsou metadata uložena takto:
+        rows        -- numpy.array int32 s indexy řádků (dokumentů) v datovém souboru
+        vocabulary  -- list internovaných řetězců položek (položky se v metadatech často opakují)
+        pro každé pole:
+            offsets -- numpy.array int64 délky len(rows)+1. Položky i-tého dokumentu jsou items[offsets[i]:offsets[i+1]].
+            items   -- numpy.array int32 s identifikátory položek (indexy do vocabulary)
+            counts  -- numpy.array int64 s počty výskytů položek (podle identifikátoru). Jsou spočítány při vytvoření,
+                       při spojování uložišť jsou sečteny a ukládají se spolu s uložištěm.
+
+    Uložiště se po vytvoření nemění. Všechny operace (výběr, míchání, filtrování) vrací nové uložiště, které
+    sdílí slovník. Díky tomu lze uložiště předávat mezi DocReadery bez kopírování.
+    """
+
+    def __init__(self, fields, rows, offsets, items, vocabulary, vocabularyIds, emptyAsNone=False, counts=None):
+        """
+        Inicializace uložiště. Pro vytvoření z řádků metadat použijte fromRows.
+
+        :param fields: list -- názvy polí
+        :param rows: numpy.array int32 -- indexy řádků dokumentů
+        :param offsets: dict -- klíč je název pole a hodnota numpy.array int64 s offsety položek
+        :param items: dict -- klíč je název pole a hodnota numpy.array int32 s identifikátory položek
+        :param vocabulary: list -- řetězce položek
+        :param vocabularyIds: dict -- řetězec položky -> identifikátor
+        :param emptyAsNone: True => prázdné pole bude vráceno jako None. Jinak jako prázdný list.
+        :param counts: dict -- klíč je název pole a hodnota numpy.array int64 s počty výskytů položek.
+            Pole, která chybí, budou spočítána při prvním použití.
+        """
+        self.fields=fields
+        self.rows=rows
+        self.offsets=offsets
+        self.items=items
+        self.vocabulary=vocabulary
+        self.vocabularyIds=vocabularyIds
+        self.emptyAsNone=emptyAsNone
+        self.counts={} if counts is None else counts
+
+    @classmethod
+    def fromRows(cls, fields, rows, emptyAsNone=False):
+        """
+        Vytvoří uložiště z řádků metadat.
+
+        :param fields: list -- názvy polí
+        :param rows: iterable -- dvojic (index řádku, {pole: [položky]|None})
+        :param emptyAsNone: True => prázdné pole bude vráceno jako None. Jinak jako prázdný list.
+        :returns: MetadataStore
+        """
+        fields=list(fields)
+        vocabulary=[]
+        vocabularyIds={}
+
+        rowsIndexes=array("i")
+        offsets=dict((f, array("q", [0])) for f in fields)
+        items=dict((f, array("i")) for f in fields)
+
+        for rowIndex, row in rows:
+            rowsIndexes.append(rowIndex)
+            for f in fields:
+                fItems=items[f]
+                fVal=row[f]
+                if fVal:
+                    for ite in fVal:
+                        try:
+                            fItems.append(vocabularyIds[ite])
+                        except KeyError:
+                            vocabularyIds[ite]=len(vocabulary)
+                            fItems.append(len(vocabulary))
+                            vocabulary.append(ite)
+
+                offsets[f].append(len(fItems))
+
+        items=dict((f, np.frombuffer(i, dtype=np.int32).copy() if i else np.zeros(0, dtype=np.int32)) for f, i in items.items())
+
+        return cls(fields,
+                   np.frombuffer(rowsIndexes, dtype=np.int32).copy() if rowsIndexes else np.zeros(0, dtype=np.int32),
+                   dict((f, np.frombuffer(o, dtype=np.int64).copy()) for f, o in offsets.items()),
+                   items,
+                   vocabulary, vocabularyIds, emptyAsNone,
+                   dict((f, np.bincount(i, minlength=len(vocabulary)).astype(np.int64)) for f, i in items.items()))
+
+    @classmethod
+    def concatenate(cls, stores, rowsShifts=None):
+        """
+        Spojí uložiště (se stejnými poli) do jednoho. Slovníky jednotlivých uložišť jsou sloučeny.
+
+        :param stores: list -- MetadataStore ve výsledném pořadí
+        :param rowsShifts: list -- posun indexů řádků pro každé uložiště. None => bez posunu
+        :returns: MetadataStore
+        """
+        if rowsShifts is None:
+            rowsShifts=[0]*len(stores)
+
+        fields=stores[0].fields
+        vocabulary=[]
+        vocabularyIds={}
+
+        rows=[]
+        offsets=dict((f, [np.zeros(1, dtype=np.int64)]) for f in fields)
+        items=dict((f, []) for f in fields)
+        itemsCnt=dict((f, 0) for f in fields)
+        mappings=[]
+
+        for store, shift in zip(stores, rowsShifts):
+            #převod lokálních identifikátorů položek na globální
+            mapping=np.empty(len(store.vocabulary), dtype=np.int32)
+            for i, ite in enumerate(store.vocabulary):
+                try:
+                    mapping[i]=vocabularyIds[ite]
+                except KeyError:
+                    vocabularyIds[ite]=len(vocabulary)
+                    mapping[i]=len(vocabulary)
+                    vocabulary.append(ite)
+            mappings.append(mapping)
+
+            rows.append(store.rows+np.int32(shift))
+            for f in fields:
+                items[f].append(mapping[store.items[f]])
+                offsets[f].append(store.offsets[f][1:]+itemsCnt[f])
+                itemsCnt[f]+=store.items[f].shape[0]
+
+        #počty výskytů není nutné počítat znovu, stačí sečíst počty jednotlivých uložišť
+        counts={}
+        for f in fields:
+            if all(f in store.counts for store in stores):
+                counts[f]=np.zeros(len(vocabulary), dtype=np.int64)
+                for store, mapping in zip(stores, mappings):
+                    np.add.at(counts[f], mapping, store.counts[f][:mapping.shape[0]])
+
+        return cls(fields,
+                   np.concatenate(rows).astype(np.int32) if rows else np.zeros(0, dtype=np.int32),
+                   dict((f, np.concatenate(o)) for f, o in offsets.items()),
+                   dict((f, np.concatenate(i).astype(np.int32) if i else np.zeros(0, dtype=np.int32)) for f, i in items.items()),
+                   vocabulary, vocabularyIds, stores[0].emptyAsNone, counts)
+
+    def save(self, path, info=None):
+        """
+        Uloží uložiště do adresáře. Pole jsou uložena ve formátu npy, takže je lze při načítání mapovat do paměti.
+        Adresář je vytvořen atomicky (nejprve je vytvořen dočasný adresář, který je poté přejmenován).
+        Pokud adresář již existuje, je nahrazen (lze jej nahradit i když je z něj uložiště načteno).
+
+        :param path: Cesta k adresáři, který bude vytvořen.
+        :param info: dict -- dodatečné informace (musí být serializovatelné do json), které budou uloženy spolu s uložištěm.
+        """
+        tmpPath=path+".tmp"+str(os.getpid())
+        os.makedirs(tmpPath)
+        try:
+            np.save(os.path.join(tmpPath, "rows.npy"), self.rows)
+            for i, f in enumerate(self.fields):
+                np.save(os.path.join(tmpPath, "offsets_"+str(i)+".npy"), self.offsets[f])
+                np.save(os.path.join(tmpPath, "items_"+str(i)+".npy"), self.items[f])
+                np.save(os.path.join(tmpPath, "counts_"+str(i)+".npy"), self.fieldCounts(f))
+
+            with open(os.path.join(tmpPath, "store.json"), "w", encoding="utf-8") as f:
+                json.dump({"fields": self.fields, "vocabulary": self.vocabulary, "emptyAsNone": self.emptyAsNone, "info": info}, f)
+
+            if os.path.isdir(path):
+                #neprázdný adresář nelze přejmenováním přepsat, původní je odsunut a smazán
+                oldPath=path+".old"+str(os.getpid())
+                os.replace(path, oldPath)
+                os.replace(tmpPath, path)
+                shutil.rmtree(oldPath, ignore_errors=True)
+            else:
+                os.replace(tmpPath, path)
+        except:
+            shutil.rmtree(tmpPath, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Načte uložiště z adresáře vytvořeného pomocí save. Pole jsou mapována do paměti (pouze pro čtení).
+
+        :param path: Cesta k adresáři.
+        :returns: (MetadataStore, info) -- info jsou dodatečné informace předané v save
+        """
+        with open(os.path.join(path, "store.json"), "r", encoding="utf-8") as f:
+            stored=json.load(f)
+
+        fields=stored["fields"]
+        vocabulary=stored["vocabulary"]
+
+        offsets={}
+        items={}
+        counts={}
+        for i, f in enumerate(fields):
+            offsets[f]=np.load(os.path.join(path, "offsets_"+str(i)+".npy"), mmap_mode="r")
+            items[f]=np.load(os.path.join(path, "items_"+str(i)+".npy"), mmap_mode="r")
+            counts[f]=np.load(os.path.join(path, "counts_"+str(i)+".npy"), mmap_mode="r")
+
+        store=cls(fields, np.load(os.path.join(path, "rows.npy"), mmap_mode="r"), offsets, items,
+                  vocabulary, dict((ite, i) for i, ite in enumerate(vocabulary)), stored["emptyAsNone"], counts)
+        return (store, stored["info"])
+
+    def __len__(self):
+        """
+        Počet dokumentů.
+        """
+        return self.rows.shape[0]
+
+    def __iter__(self):
+        """
+        Iteruje přes dokumenty.
+
+        :returns: (index řádku, {pole: [položky]})
+        """
+        for i in range(len(self)):
+            yield (int(self.rows[i]), self.row(i))
+
+    def __getitem__(self, i):
+        """
+        Dokument na daném indexu.
+
+        :param i: int -- index dokumentu v uložišti
+        :returns: (index řádku, {pole: [položky]})
+        """
+        return (int(self.rows[i]), self.row(i))
+
+    def __deepcopy__(self, memo):
+        """
+        Uložiště se nemění, proto není nutné vytvářet kopii.
+        """
+        return self
+
+    def row(self, i):
+        """
+        Metadata dokumentu na daném indexu.
+
+        :param i: int -- index dokumentu v uložišti
+        :returns: dict -- {pole: [položky]}
+        """
+        res={}
+        for f in self.fields:
+            offsets=self.offsets[f]
+            s, e=offsets[i], offsets[i+1]
+            if s==e:
+                res[f]=None if self.emptyAsNone else []
+            else:
+                res[f]=[self.vocabulary[x] for x in self.items[f][s:e]]
+        return res
+
+    def fieldItems(self, field):
+        """
+        Položky pole ve sloupcové podobě.
+
+        :param field: Název pole.
+        :returns: (offsets, items) -- numpy.array offsetů a identifikátorů položek
+        """
+        return (self.offsets[field], self.items[field])
+
+    def fieldCounts(self, field):
+        """
+        Počty výskytů položek v poli.
+
+        :param field: Název pole.
+        :returns: numpy.array -- počet výskytů pro každý identifikátor položky
+        """
+        try:
+            return self.counts[field]
+        except KeyError:
+            self.counts[field]=np.bincount(self.items[field], minlength=len(self.vocabulary)).astype(np.int64)
+            return self.counts[field]
+
+    def fieldsStats(self, fields):
+        """
+        Počítá dokumenty korespondující k položkám. Využívá předpočítané počty výskytů.
+
+        :param fields: list -- jmén polí
+        :returns: dict -- se statistikami
+        """
+        fieldsCnt={}
+        for f in fields:
+            counts=self.fieldCounts(f)
+            fieldsCnt[f]=dict((self.vocabulary[x], int(counts[x])) for x in np.flatnonzero(counts))
+
+        return fieldsCnt
+
+    def select(self, selected):
+        """
+        Vytvoří nové uložiště pouze s vybranými dokumenty.
+
+        :param selected: numpy.array -- indexy dokumentů (v požadovaném pořadí) nebo bool maska
+        :returns: MetadataStore
+        """
+        selected=np.asarray(selected)
+        if selected.dtype==np.bool_:
+            selected=np.flatnonzero(selected)
+
+        newOffsets={}
+        newItems={}
+        for f in self.fields:
+            newOffsets[f], newItems[f]=self.__gather(self.offsets[f], self.items[f], selected)
+
+        return MetadataStore(self.fields, self.rows[selected], newOffsets, newItems, self.vocabulary, self.vocabularyIds, self.emptyAsNone)
+
+    def replaceItems(self, field, offsets, items):
+        """
+        Vytvoří nové uložiště, kde má dané pole nové položky. Ostatní pole jsou sdílena.
+
+        :param field: Název pole.
+        :param offsets: numpy.array int64 -- offsety položek
+        :param items: numpy.array int32 -- identifikátory položek
+        :returns: MetadataStore
+        """
+        newOffsets=dict(self.offsets)
+        newItems=dict(self.items)
+        newOffsets[field]=offsets
+        newItems[field]=items
+
+        return MetadataStore(self.fields, self.rows, newOffsets, newItems, self.vocabulary, self.vocabularyIds, self.emptyAsNone,
+                             dict((f, c) for f, c in self.counts.items() if f!=field))
+
+    def withEmptyAsNone(self, emptyAsNone=True):
+        """
+        Vytvoří nové uložiště (sdílí data) se změněnou reprezentací prázdných polí.
+
+        :param emptyAsNone: True => prázdné pole bude vráceno jako None. Jinak jako prázdný list.
+        :returns: MetadataStore
+        """
+        return MetadataStore(self.fields, self.rows, self.offsets, self.items, self.vocabulary, self.vocabularyIds, emptyAsNone, self.counts)
+
+    @staticmethod
+    def __gather(offsets, items, selected):
+        """
+        Vybere položky daných dokumentů.
+
+        :param offsets: numpy.array -- offsety položek
+        :param items: numpy.array -- identifikátory položek
+        :param selected: numpy.array -- indexy vybraných dokumentů
+        :returns: (offsets, items) -- nové
+        """
+        starts=offsets[:-1][selected]
+        lengths=offsets[1:][selected]-starts
+
+        newOffsets=np.zeros(selected.shape[0]+1, dtype=np.int64)
+        np.cumsum(lengths, out=newOffsets[1:])
+
+        positions=np.repeat(starts-newOffsets[:-1], lengths)+np.arange(newOffsets[-1], dtype=np.int64)
+
+        return (newOffsets, items[positions])
+
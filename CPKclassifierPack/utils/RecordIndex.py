@@ -0,0 +1,225 @@
+# -*- coding: UTF-8 -*-
+"""
+Obsahuje třídu pro perzistentní index záznamů souboru s metadaty podle identifikátoru.
+
+:author:     Martin Dočekal
+:contact:    xdocek09@stud.fit.vubtr.cz
+
+"""
+
+import csv
+import hashlib
+import locale
+import logging
+import os
+import struct
+
+import numpy as np
+
+from .BlockCompressedFile import BlockCompressedFile
+
+class RecordIndexInvalidFile(Exception):
+    """
+    Soubor s indexem je poškozený nebo nepatří k danému souboru s metadaty.
+    """
+    pass
+
+class RecordIndexMissingField(Exception):
+    """
+    Pole s identifikátorem není v souboru s metadaty.
+    """
+    pass
+
+class RecordIndex(object):
+    """
+    Index záznamů souboru s metadaty podle hodnoty pole s identifikátorem (například dedup_record_id).
+
+    Pro každý záznam obsahuje hash identifikátoru, číslo řádku (dokumentu) a offset záznamu v souboru s metadaty.
+    Číslo řádku je zároveň indexem řádku s plným textem v datovém souboru (viz LinesIndex).
+    Záznamy jsou seřazeny podle hashe, takže vyhledání je binární vyhledávání. Hashe se mohou shodovat, proto je nutné
+    identifikátor nalezeného záznamu ověřit.
+
+    Index je uložen vedle souboru s metadaty (soubor s metadaty + "." + název pole + EXTENSION) jako hlavička a pole uint64
+    (všechny hashe, poté všechna čísla řádků a nakonec všechny offsety). Hlavička obsahuje velikost a čas poslední
+    modifikace souboru s metadaty. Pokud neodpovídají, je index považován za neplatný a je vytvořen znovu.
+    """
+
+    EXTENSION=".ridx"
+    MAGIC=b"CPKRIDX\x00"
+    VERSION=1
+    COLUMNS=3      #hashe, čísla řádků, offsety
+
+    #magic, verze, počet sloupců, velikost souboru s metadaty, čas modifikace (ns), počet záznamů
+    HEADER=struct.Struct("<8sIIQQQ")
+
+    ENCODING=locale.getpreferredencoding(False)   #stejné kódování, jaké používá open v textovém režimu
+
+    def __init__(self, metadataFile, field, persist=True):
+        """
+        Otevře index k souboru s metadaty. Pokud neexistuje, nebo je neplatný, tak jej vytvoří.
+
+        :param metadataFile: Cesta k souboru s metadaty.
+        :param field: Název pole s identifikátorem.
+        :param persist: True => pokusí se nově vytvořený index uložit vedle souboru s metadaty.
+        :raises RecordIndexMissingField: Pole není v souboru s metadaty.
+        """
+
+        self.metadataFile=metadataFile
+        self.field=field
+        self.indexFile=metadataFile+"."+field+self.EXTENSION
+
+        self.columns=None
+
+        try:
+            self.columns=self.__load()
+        except (RecordIndexInvalidFile, IOError, ValueError):
+            self.columns=None
+
+        if self.columns is None:
+            columns=self.__build()
+
+            if persist and self.__save(columns):
+                self.columns=self.__load()
+            else:
+                self.columns=columns
+
+    def __len__(self):
+        """
+        Počet záznamů.
+        """
+        return self.columns.shape[1]
+
+    @staticmethod
+    def hash(recordId):
+        """
+        Hash identifikátoru.
+
+        :param recordId: str -- identifikátor
+        :returns: int -- 64 bitový hash
+        """
+        return int.from_bytes(hashlib.blake2b(recordId.encode("utf-8"), digest_size=8).digest(), "little")
+
+    def find(self, recordId):
+        """
+        Najde kandidáty na záznamy s daným identifikátorem.
+
+        :param recordId: str -- identifikátor
+        :returns: list -- dvojic (číslo řádku, offset záznamu v souboru s metadaty) se shodným hashem identifikátoru
+        """
+        hashes=self.columns[0]
+        h=np.uint64(self.hash(recordId))
+        start=int(np.searchsorted(hashes, h, side="left"))
+        end=int(np.searchsorted(hashes, h, side="right"))
+
+        return [(int(self.columns[1][i]), int(self.columns[2][i])) for i in range(start, end)]
+
+    def __metadataFileIdentity(self):
+        """
+        Získá údaje identifikující verzi souboru s metadaty.
+
+        :returns: (velikost, čas modifikace v ns)
+        """
+        st=os.stat(self.metadataFile)
+        return (st.st_size, st.st_mtime_ns)
+
+    def __load(self):
+        """
+        Načte uložený index. Kontroluje, jestli odpovídá souboru s metadaty.
+
+        :returns: numpy.memmap|numpy.array -- sloupce indexu (COLUMNS x počet záznamů)
+        :raises RecordIndexInvalidFile: Neplatný index.
+        """
+
+        with open(self.indexFile, "rb") as f:
+            header=f.read(self.HEADER.size)
+
+        if len(header)!=self.HEADER.size:
+            raise RecordIndexInvalidFile()
+
+        magic, version, columns, metadataSize, metadataMtime, records=self.HEADER.unpack(header)
+
+        if magic!=self.MAGIC or version!=self.VERSION or columns!=self.COLUMNS:
+            raise RecordIndexInvalidFile()
+
+        if (metadataSize, metadataMtime)!=self.__metadataFileIdentity():
+            logging.info("index záznamů neodpovídá souboru s metadaty: "+self.metadataFile)
+            raise RecordIndexInvalidFile()
+
+        if records==0:
+            return np.zeros((self.COLUMNS, 0), dtype="<u8")
+
+        return np.memmap(self.indexFile, dtype="<u8", mode="r", offset=self.HEADER.size, shape=(self.COLUMNS, records))
+
+    def __save(self, columns):
+        """
+        Uloží index vedle souboru s metadaty.
+
+        :param columns: numpy.array -- sloupce indexu (COLUMNS x počet záznamů)
+        :returns: bool -- True uloženo. False nelze uložit.
+        """
+        tmpFile=self.indexFile+".tmp"+str(os.getpid())
+        try:
+            metadataSize, metadataMtime=self.__metadataFileIdentity()
+            with open(tmpFile, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.COLUMNS, metadataSize, metadataMtime, columns.shape[1]))
+                f.write(np.ascontiguousarray(columns, dtype="<u8").tobytes())
+
+            os.replace(tmpFile, self.indexFile)
+        except (IOError, OSError):
+            logging.info("index záznamů nelze uložit: "+self.indexFile)
+            if os.path.isfile(tmpFile):
+                os.remove(tmpFile)
+            return False
+
+        return True
+
+    def __build(self):
+        """
+        Projde soubor s metadaty a vytvoří index záznamů.
+        Řádky jsou číslovány stejně jako v DocReader (prázdné řádky jsou přeskočeny).
+
+        :returns: numpy.array -- sloupce indexu (COLUMNS x počet záznamů)
+        :raises RecordIndexMissingField: Pole není v souboru s metadaty.
+        """
+        logging.info("začátek vytváření indexu záznamů: "+self.metadataFile)
+
+        hashes=[]
+        offsets=[]
+
+        with BlockCompressedFile.open(self.metadataFile, "rb") as f:
+            pos=[0]             #pozice za posledním přečteným řádkem souboru
+            recordStart=[None]  #pozice prvního řádku souboru aktuálního záznamu csv
+
+            def lines():
+                for line in f:
+                    if recordStart[0] is None:
+                        recordStart[0]=pos[0]
+                    pos[0]+=len(line)
+                    yield str(line, self.ENCODING)
+
+            reader=csv.reader(lines())
+            fieldNames=next(reader, None)
+            if fieldNames is None or self.field not in fieldNames:
+                raise RecordIndexMissingField()
+
+            #pokud se název pole opakuje, tak je použit poslední výskyt (stejně jako u csv.DictReader)
+            column=max(i for i, f in enumerate(fieldNames) if f==self.field)
+
+            recordStart[0]=None
+            for row in reader:
+                start=recordStart[0]
+                recordStart[0]=None
+                if not row:
+                    continue
+
+                hashes.append(self.hash(row[column] if column<len(row) else ""))
+                offsets.append(start)
+
+        hashes=np.array(hashes, dtype="<u8")
+        order=np.argsort(hashes, kind="stable")
+
+        columns=np.stack((hashes[order], order.astype("<u8"), np.array(offsets, dtype="<u8")[order])) if order.shape[0] \
+            else np.zeros((self.COLUMNS, 0), dtype="<u8")
+
+        logging.info("konec vytváření indexu záznamů: "+self.metadataFile)
+        return columns
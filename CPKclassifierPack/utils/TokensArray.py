@@ -0,0 +1,250 @@
+# -*- coding: UTF-8 -*-
+"""
+Obsahuje třídy pro kompaktní reprezentaci plných textů pomocí identifikátorů slov.
+
+:author:     Martin Dočekal
+:contact:    xdocek09@stud.fit.vubtr.cz
+
+"""
+
+from array import array
+
+import numpy as np
+
+class TokensVocabulary(object):
+    """
+    Slovník převádějící slova na identifikátory (int32) a zpět.
+    Identifikátor slova je jeho pořadí ve slovníku.
+    """
+
+    def __init__(self):
+        """
+        Inicializace prázdného slovníku.
+        """
+        self.words=[]
+        self.__ids={}
+
+    def __len__(self):
+        """
+        Počet slov ve slovníku.
+        """
+        return len(self.words)
+
+    def __getitem__(self, i):
+        """
+        Slovo s daným identifikátorem.
+
+        :param i: int -- identifikátor
+        :returns: str -- slovo
+        """
+        return self.words[i]
+
+    def toIds(self, words):
+        """
+        Převede slova na identifikátory. Nová slova jsou přidána do slovníku.
+
+        :param words: list -- slov
+        :returns: list -- identifikátorů
+        """
+        ids=self.__ids
+        vocaWords=self.words
+        res=[]
+        for w in words:
+            i=ids.get(w)
+            if i is None:
+                i=len(vocaWords)
+                ids[w]=i
+                vocaWords.append(w)
+            res.append(i)
+        return res
+
+    def __getstate__(self):
+        """
+        Pro serializaci je uložen pouze list slov. Převodní dict je obnoven z listu.
+        """
+        return self.words
+
+    def __setstate__(self, state):
+        """
+        Obnovení ze serializace.
+
+        :param state: list -- slov
+        """
+        self.words=state
+        self.__ids=dict((w, i) for i, w in enumerate(state))
+
+class TokensDocument(object):
+    """
+    Jeden dokument reprezentovaný polem identifikátorů slov.
+    Chová se jako list slov (délka, iterace, indexování). Pro tvorbu ngramů poskytuje metodu ngrams, která pracuje
+    nad polem identifikátorů.
+    """
+
+    __slots__=("ids", "vocabulary")
+
+    def __init__(self, ids, vocabulary):
+        """
+        Inicializace.
+
+        :param ids: numpy.array -- int32 identifikátorů slov
+        :param vocabulary: TokensVocabulary -- slovník, do kterého identifikátory patří
+        """
+        self.ids=ids
+        self.vocabulary=vocabulary
+
+    def __len__(self):
+        """
+        Počet slov.
+        """
+        return self.ids.shape[0]
+
+    def __iter__(self):
+        """
+        Iteruje přes slova.
+        """
+        words=self.vocabulary.words
+        for i in self.ids.tolist():
+            yield words[i]
+
+    def __getitem__(self, ind):
+        """
+        Získá slovo/slova na daném indexu.
+
+        :param ind: int|slice
+        :returns: str|list -- slovo nebo list slov
+        """
+        words=self.vocabulary.words
+        if isinstance(ind, slice):
+            return [words[i] for i in self.ids[ind].tolist()]
+        return words[int(self.ids[ind])]
+
+    def words(self):
+        """
+        Převede dokument na list slov.
+
+        :returns: list -- slov
+        """
+        words=self.vocabulary.words
+        return [words[i] for i in self.ids.tolist()]
+
+    def ngrams(self, n):
+        """
+        Vytvoří ngramy ve stejné podobě jako analyzerFulltextNgrams nad listem slov (slova spojená "_").
+        Ngramy jsou tvořeny nad polem identifikátorů. Každý rozdílný ngram je převeden na řetězec pouze jednou.
+
+        :param n: velikost (například 2 vytvoří bigramy)
+        :returns: list -- ngramů
+        """
+        words=self.vocabulary.words
+        ids=self.ids
+
+        if ids.shape[0]<n:
+            return ["_".join([words[i] for i in ids.tolist()])]
+
+        if n==1:
+            return [words[i] for i in ids.tolist()]
+
+        numOfGrams=ids.shape[0]-n+1
+        grams=np.lib.stride_tricks.as_strided(ids, shape=(numOfGrams, n), strides=(ids.strides[0], ids.strides[0]))
+
+        vocaSize=max(len(self.vocabulary), 1)
+        if vocaSize**n<2**63:
+            #ngram zakódujeme do jednoho čísla
+            keys=np.zeros(numOfGrams, dtype=np.int64)
+            for k in range(n):
+                keys=keys*vocaSize+grams[:, k]
+            keys, firstIndex, inverse=np.unique(keys, return_index=True, return_inverse=True)
+            unique=grams[firstIndex]
+        else:
+            unique, inverse=np.unique(grams, axis=0, return_inverse=True)
+
+        uniqueStr=["_".join([words[i] for i in g]) for g in unique.tolist()]
+        return [uniqueStr[i] for i in inverse.ravel().tolist()]
+
+    def __str__(self):
+        """
+        Konverze na string.
+        """
+        return str(self.words())
+
+    def __repr__(self):
+        """
+        Reprezentace dokumentu.
+        """
+        return repr(self.words())
+
+class TokensArray(object):
+    """
+    Plné texty více dokumentů uložené v jednom poli identifikátorů slov (int32) s offsety dokumentů.
+    Oproti listu listů slov výrazně snižuje paměťovou náročnost.
+
+    Chová se jako list dokumentů. Dokument je vrácen jako TokensDocument. Výřez vrací opět TokensArray se
+    sdíleným slovníkem.
+    """
+
+    def __init__(self, vocabulary=None):
+        """
+        Inicializace prázdného pole.
+
+        :param vocabulary: TokensVocabulary -- sdílený slovník. None => vytvoří nový.
+        """
+        self.vocabulary=TokensVocabulary() if vocabulary is None else vocabulary
+        self.ids=array("i")
+        self.offsets=array("q", [0])
+
+    def append(self, words):
+        """
+        Přidá dokument.
+
+        :param words: list -- slov dokumentu
+        """
+        self.ids.extend(self.vocabulary.toIds(words))
+        self.offsets.append(len(self.ids))
+
+    def __len__(self):
+        """
+        Počet dokumentů.
+        """
+        return len(self.offsets)-1
+
+    def __getitem__(self, ind):
+        """
+        Získá dokument/y.
+
+        :param ind: int|slice
+        :returns: TokensDocument|TokensArray
+        """
+        if isinstance(ind, slice):
+            start, stop, step=ind.indices(len(self))
+            res=TokensArray(self.vocabulary)
+            if step==1:
+                if stop>start:
+                    res.ids=self.ids[self.offsets[start]:self.offsets[stop]]
+                    base=self.offsets[start]
+                    res.offsets=array("q", (o-base for o in self.offsets[start:stop+1]))
+            else:
+                for i in range(start, stop, step):
+                    res.ids.extend(self.ids[self.offsets[i]:self.offsets[i+1]])
+                    res.offsets.append(len(res.ids))
+            return res
+
+        if ind<0:
+            ind+=len(self)
+        if ind<0 or ind>=len(self):
+            raise IndexError("TokensArray index out of range")
+
+        return TokensDocument(np.array(self.ids[self.offsets[ind]:self.offsets[ind+1]], dtype=np.int32), self.vocabulary)
+
+    def __iter__(self):
+        """
+        Iteruje přes dokumenty.
+        """
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self):
+        """
+        Velikost polí s identifikátory a offsety v bajtech (bez slovníku).
+        """
+        return self.ids.itemsize*len(self.ids)+self.offsets.itemsize*len(self.offsets)
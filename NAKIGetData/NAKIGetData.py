@@ -15,6 +15,9 @@ import logging
 import configparser
 import copy
 import glob
+import json
+
+from collections import OrderedDict
 
 from argparse import ArgumentParser, ArgumentTypeError
 from asyncore import write
@@ -24,6 +27,145 @@ from ufal.morphodita import *
 class LemmatizerException(Exception):
     pass
 
+class LemmatizerCache(object):
+    """
+    Omezená cache výsledků morfologické analýzy slovních tvarů (tvar -> (lemma, slovní druh)).
+    Při zaplnění jsou odstraňovány nejdéle nepoužité tvary (LRU).
+
+    Cache lze uložit do souboru a při dalším spuštění z něj načíst (předehřátí). Uložená cache je platná pouze
+    pro stejný slovník morphodity (porovnává se velikost a čas poslední modifikace slovníku).
+    """
+
+    VERSION=1
+
+    def __init__(self, maxSize, dictMorpho=None, cacheFile=None):
+        """
+        Inicializace cache. Pokud je zadán soubor s uloženou cache, tak je načten.
+
+        :param maxSize: Maximální počet tvarů v cache.
+        :param dictMorpho: Cesta k souboru se slovníkem morphodity, pro který cache platí.
+        :param cacheFile: Cesta k souboru pro uložení cache. None => cache není ukládána.
+        """
+        self.maxSize=maxSize
+        self.cacheFile=cacheFile
+        self.dictIdentity=None
+        if dictMorpho is not None:
+            st=os.stat(dictMorpho)
+            self.dictIdentity=[st.st_size, st.st_mtime_ns]
+
+        self.hits=0
+        self.misses=0
+        self.__forms=OrderedDict()
+
+        if self.cacheFile is not None:
+            self.load()
+
+    def __len__(self):
+        """
+        Počet tvarů v cache.
+        """
+        return len(self.__forms)
+
+    def get(self, form):
+        """
+        Získá výsledek analýzy tvaru z cache.
+
+        :param form: str -- slovní tvar
+        :returns: tuple|None -- (lemma, slovní druh). None => tvar není v cache.
+        """
+        res=self.__forms.get(form)
+        if res is None:
+            self.misses+=1
+        else:
+            self.hits+=1
+            self.__forms.move_to_end(form)
+        return res
+
+    def put(self, form, analysis):
+        """
+        Vloží výsledek analýzy tvaru do cache.
+
+        :param form: str -- slovní tvar
+        :param analysis: tuple -- (lemma, slovní druh)
+        """
+        self.__forms[form]=analysis
+        if len(self.__forms)>self.maxSize:
+            self.__forms.popitem(last=False)
+
+    def hitRate(self):
+        """
+        Podíl dotazů, které byly nalezeny v cache.
+
+        :returns: float -- 0..1
+        """
+        total=self.hits+self.misses
+        return self.hits/total if total else 0.0
+
+    def statsInfo(self):
+        """
+        Statistiky cache pro logování.
+
+        :returns: str
+        """
+        return "Lemmatizer cache: "+str(len(self))+" forms, hits: "+str(self.hits)+", misses: "+str(self.misses)+\
+            ", hit rate: "+"{:.2%}".format(self.hitRate())
+
+    def load(self):
+        """
+        Načte (předehřeje) cache ze souboru. Neplatný nebo neexistující soubor je ignorován.
+        """
+        try:
+            with open(self.cacheFile, "r", encoding="utf-8") as f:
+                stored=json.load(f)
+        except (IOError, ValueError):
+            return
+
+        if not isinstance(stored, dict) or stored.get("version")!=self.VERSION or stored.get("dict")!=self.dictIdentity:
+            logging.info("Stored lemmatizer cache does not match the dictionary: "+self.cacheFile)
+            return
+
+        #uloženo od nejdéle nepoužitého
+        for form, lemma, pos in stored["forms"][-self.maxSize:]:
+            self.__forms[form]=(lemma, pos)
+
+        logging.info("Loaded lemmatizer cache ("+str(len(self))+" forms): "+self.cacheFile)
+
+    def save(self):
+        """
+        Uloží cache do souboru. Tvary z již uloženého souboru, které nejsou v cache, jsou zachovány
+        (mají nižší prioritu), takže se do souboru mohou postupně ukládat cache více běhů.
+        """
+        if self.cacheFile is None:
+            return
+
+        forms=OrderedDict()
+        try:
+            with open(self.cacheFile, "r", encoding="utf-8") as f:
+                stored=json.load(f)
+            if isinstance(stored, dict) and stored.get("version")==self.VERSION and stored.get("dict")==self.dictIdentity:
+                for form, lemma, pos in stored["forms"]:
+                    forms[form]=(lemma, pos)
+        except (IOError, ValueError):
+            pass
+
+        for form, analysis in self.__forms.items():
+            forms.pop(form, None)
+            forms[form]=analysis
+
+        while len(forms)>self.maxSize:
+            forms.popitem(last=False)
+
+        tmpFile=self.cacheFile+".tmp"+str(os.getpid())
+        try:
+            with open(tmpFile, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "dict": self.dictIdentity,
+                           "forms": [[form, lemma, pos] for form, (lemma, pos) in forms.items()]}, f, ensure_ascii=False)
+            os.replace(tmpFile, self.cacheFile)
+        except (IOError, OSError):
+            logging.info("Could not save lemmatizer cache: "+self.cacheFile)
+            if os.path.isfile(tmpFile):
+                os.remove(tmpFile)
+
 class Lemmatizer(object):
     """
     Třída pro lemmatizaci slov a extrakci vybraných slovních druhů. Používá nástroj morphodita.
@@ -55,11 +197,13 @@ class Lemmatizer(object):
         10 : "I"
         }
     
-    def __init__(self, dict):
+    def __init__(self, dict, cacheSize=0, cacheFile=None):
         """
         Konstrukce objektu.
         
         :param dict: Cesta k souboru pro dict morphodity.
+        :param cacheSize: Maximální počet slovních tvarů v cache výsledků analýzy. 0 => bez cache.
+        :param cacheFile: Cesta k souboru, do kterého je cache ukládána a ze kterého je předehřáta. None => neukládá se.
         :raises LemmatizerException: Když není definovaný tokenizer pro dodaný model. Nebo nevalidní slovník.
         """
 
@@ -76,8 +220,43 @@ class Lemmatizer(object):
         self.lemmas = TaggedLemmas()
         self.converter=TagsetConverter.newPdtToConll2009Converter()
         
+        self.cache=LemmatizerCache(cacheSize, dict, cacheFile) if cacheSize>0 else None
+        
+    def analyze(self, word):
+        """
+        Morfologická analýza jednoho slovního tvaru. Výsledek je brán z cache, pokud je k dispozici.
+        
+        :param word: str -- slovní tvar
+        :returns: tuple -- (lemma, slovní druh)
+        """
+        if self.cache is not None:
+            res=self.cache.get(word)
+            if res is not None:
+                return res
         
+        self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
+        pos=self.lemmas[0].tag[0]
+        self.converter.convert(self.lemmas[0])
+        res=(self.lemmas[0].lemma, pos)
         
+        if self.cache is not None:
+            self.cache.put(word, res)
+            
+        return res
+    
+    def logCacheStats(self):
+        """
+        Zaloguje statistiky cache.
+        """
+        if self.cache is not None:
+            logging.info(self.cache.statsInfo())
+    
+    def saveCache(self):
+        """
+        Uloží cache, pokud je nastaven soubor pro uložení.
+        """
+        if self.cache is not None:
+            self.cache.save()
 
     def lemmatize(self, text):
         """
@@ -90,9 +269,7 @@ class Lemmatizer(object):
         words=[]
         while self.tokenizer.nextSentence(self.forms, self.tokens):
             for word in self.forms:
-                self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
-                self.converter.convert(self.lemmas[0])
-                words.append(self.lemmas[0].lemma)
+                words.append(self.analyze(word)[0])
             
         return words
     
@@ -108,8 +285,7 @@ class Lemmatizer(object):
         words=[]
         while self.tokenizer.nextSentence(self.forms, self.tokens):
             for word in self.forms:
-                self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
-                words.append((word, self.lemmas[0].tag[0]))
+                words.append((word, self.analyze(word)[1]))
                     
         return words
         
@@ -128,11 +304,10 @@ class Lemmatizer(object):
         
         while self.tokenizer.nextSentence(self.forms, self.tokens):
             for word in self.forms:
-                self.morpho.analyze( word , self.morpho.GUESSER, self.lemmas)
-                if self.lemmas[0].tag[0] in only:
+                lemma, pos=self.analyze(word)
+                if pos in only:
                     if lemmatized:
-                        self.converter.convert(self.lemmas[0])
-                        words.append(self.lemmas[0].lemma)
+                        words.append(lemma)
                     else:
                         words.append(word)
  
@@ -279,7 +454,11 @@ class NAKIGetData( object):
         if not os.path.isabs(self.config["DICT"]):
             dictMorpho=os.path.dirname(os.path.realpath(__file__))+"/"+self.config["DICT"]
 
-        self.lemmatizer=Lemmatizer(dictMorpho)
+        cacheFile=self.config["LEMMATIZER_CACHE_FILE"] or None
+        if cacheFile is not None and not os.path.isabs(cacheFile):
+            cacheFile=os.path.dirname(os.path.realpath(__file__))+"/"+cacheFile
+
+        self.lemmatizer=Lemmatizer(dictMorpho, int(self.config["LEMMATIZER_CACHE_SIZE"]), cacheFile)
         self.fieldsForLematization=self.config["FIELDS_FOR_LEMMATIZATION"].split(",")
         self.lemmFieldExtension=self.config["LEMMATIZED_FIELD_EXTENSION"]
         self.fulltextFileExtension=self.config["FULLTEXT_FILE_EXTENSION"]
@@ -484,6 +663,8 @@ class NAKIGetData( object):
                             m[name+self.lemmFieldExtension].add(lemm_item)
             
             logging.info("End of metadata lemmatization.")
+            self.lemmatizer.logCacheStats()
+            self.lemmatizer.saveCache()
         logging.info("End of getting metadata.")
         return meta
     